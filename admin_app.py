@@ -7,184 +7,40 @@ import base64
 import hmac
 import hashlib
 import uuid
+from datetime import datetime
 from urllib.parse import urlencode
 
-import http.client
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
-from sqlalchemy.orm import Session
 from sqladmin import Admin, ModelView
 
-from .db import engine, get_session
+from .db import engine, async_engine, get_async_session, get_async_read_session, get_read_session
+from .db import dispose_engines, add_missing_columns, get_session
 from .models import Base, Client, CommandLog, Enrollment, TerminalAudit
 from .models import Plugin, PluginVersion, PluginInstallJob
 # Plugin loader (MVP)
 from .plugins.loader import PluginLoader
-import random
-import string
-
-
-def _http_json(method: str, url: str, body: Dict[str, Any] | None = None, headers: Dict[str, str] | None = None, timeout: float = 15.0) -> Any:
-    base = os.getenv("CM_BASE_URL", "http://127.0.0.1:10000")
-    from urllib.parse import urlparse as _parse
-    b = _parse(base)
-    scheme = (b.scheme or "http").lower()
-    host = b.hostname or "127.0.0.1"
-    port = b.port or (443 if scheme == "https" else 80)
-    path = url
-    if not path.startswith("/"):
-        path = "/" + path
-    if scheme == "https":
-        import ssl
-        ctx = ssl.create_default_context()
-        # Dev-режим: отключаем проверку сертификата внутри docker-сети
-        ctx.check_hostname = False
-        ctx.verify_mode = ssl.CERT_NONE
-        conn = http.client.HTTPSConnection(host, port, timeout=timeout, context=ctx)
-    else:
-        conn = http.client.HTTPConnection(host, port, timeout=timeout)
-    try:
-        payload = None
-        hdrs = {"Content-Type": "application/json"}
-        if headers:
-            hdrs.update(headers)
-        if body is not None:
-            payload = json.dumps(body)
-        conn.request(method.upper(), path, body=payload, headers=hdrs)
-        resp = conn.getresponse()
-        data = resp.read()
-        text = data.decode("utf-8") if data else ""
-        if 200 <= resp.status < 300:
-            return json.loads(text) if text else None
-        raise HTTPException(status_code=resp.status, detail=text or "Upstream error")
-    except (TimeoutError, ConnectionError, OSError) as e:
-        raise HTTPException(status_code=503, detail=f"Client manager unavailable: {str(e)}")
-    finally:
-        try:
-            conn.close()
-        except:
-            pass
-
-def _http_multipart(path: str, fields: Dict[str, str], file_field: str, filename: str, file_bytes: bytes, file_content_type: str = "application/octet-stream", timeout: float = 30.0) -> Any:
-    """Send a multipart/form-data POST to the configured client_manager base url.
-    This is a minimal implementation suitable for small-to-medium files in dev.
-    """
-    base = os.getenv("CM_BASE_URL", "http://127.0.0.1:10000")
-    from urllib.parse import urlparse as _parse
-    b = _parse(base)
-    scheme = (b.scheme or "http").lower()
-    host = b.hostname or "127.0.0.1"
-    port = b.port or (443 if scheme == "https" else 80)
-    if not path.startswith("/"):
-        path = "/" + path
-
-    boundary = "----boundary" + ''.join(random.choice(string.ascii_letters + string.digits) for _ in range(16))
-    crlf = "\r\n"
-    body_parts = []
-    for k, v in (fields or {}).items():
-      # Do not include a trailing CRLF after the value — the join will
-      # insert separators and we will append separators around the file part.
-      body_parts.append(f"--{boundary}{crlf}Content-Disposition: form-data; name=\"{k}\"{crlf}{crlf}{v}")
-
-    # file part (headers end with two CRLFs, file bytes follow immediately)
-    body_parts.append(f"--{boundary}{crlf}Content-Disposition: form-data; name=\"{file_field}\"; filename=\"{filename}\"{crlf}Content-Type: {file_content_type}{crlf}{crlf}")
-
-    # Join parts with CRLF, then append file bytes, a CRLF and the final boundary.
-    body_bytes = crlf.join(body_parts).encode("utf-8") + file_bytes + crlf.encode("utf-8") + f"--{boundary}--{crlf}".encode("utf-8")
-
-    hdrs = {"Content-Type": f"multipart/form-data; boundary={boundary}", "Content-Length": str(len(body_bytes))}
-
-    if scheme == "https":
-        import ssl
-        ctx = ssl.create_default_context()
-        ctx.check_hostname = False
-        ctx.verify_mode = ssl.CERT_NONE
-        conn = http.client.HTTPSConnection(host, port, timeout=timeout, context=ctx)
-    else:
-        conn = http.client.HTTPConnection(host, port, timeout=timeout)
-
-    try:
-        conn.request('POST', path, body=body_bytes, headers=hdrs)
-        resp = conn.getresponse()
-        data = resp.read()
-        text = data.decode("utf-8") if data else ""
-        if 200 <= resp.status < 300:
-            return json.loads(text) if text else None
-        raise HTTPException(status_code=resp.status, detail=text or "Upstream error")
-    except (TimeoutError, ConnectionError, OSError) as e:
-        raise HTTPException(status_code=503, detail=f"Client manager unavailable: {str(e)}")
-    finally:
-        try:
-            conn.close()
-        except:
-            pass
-
-
-def _http_multipart_stream(path: str, fields: Dict[str, str], file_field: str, filename: str, file_path: str, file_content_type: str = "application/octet-stream", timeout: float = 30.0) -> Any:
-    """Stream a multipart/form-data POST to the configured client_manager using chunked encoding.
-    body will be an iterator yielding bytes: preamble -> file chunks -> epilogue.
-    This avoids loading the whole file into memory.
-    """
-    base = os.getenv("CM_BASE_URL", "http://127.0.0.1:10000")
-    from urllib.parse import urlparse as _parse
-    b = _parse(base)
-    scheme = (b.scheme or "http").lower()
-    host = b.hostname or "127.0.0.1"
-    port = b.port or (443 if scheme == "https" else 80)
-    if not path.startswith("/"):
-        path = "/" + path
-
-    boundary = "----boundary" + ''.join(random.choice(string.ascii_letters + string.digits) for _ in range(16))
-    crlf = "\r\n"
-
-    # prepare preamble (fields + file header)
-    pre_parts = []
-    for k, v in (fields or {}).items():
-        pre_parts.append(f"--{boundary}{crlf}Content-Disposition: form-data; name=\"{k}\"{crlf}{crlf}{v}")
-    pre_parts.append(f"--{boundary}{crlf}Content-Disposition: form-data; name=\"{file_field}\"; filename=\"{filename}\"{crlf}Content-Type: {file_content_type}{crlf}{crlf}")
-    preamble = crlf.join(pre_parts).encode("utf-8")
-    epilogue = (crlf + f"--{boundary}--{crlf}").encode("utf-8")
-
-    hdrs = {"Content-Type": f"multipart/form-data; boundary={boundary}", "Transfer-Encoding": "chunked"}
-
-    if scheme == "https":
-        import ssl
-        ctx = ssl.create_default_context()
-        ctx.check_hostname = False
-        ctx.verify_mode = ssl.CERT_NONE
-        conn = http.client.HTTPSConnection(host, port, timeout=timeout, context=ctx)
-    else:
-        conn = http.client.HTTPConnection(host, port, timeout=timeout)
-
-    def body_iter():
-        yield preamble
-        with open(file_path, "rb") as f:
-            while True:
-                chunk = f.read(64 * 1024)
-                if not chunk:
-                    break
-                yield chunk
-        yield epilogue
-
-    try:
-        # Use encode_chunked to stream the iterable body
-        conn.request('POST', path, body=body_iter(), headers=hdrs, encode_chunked=True)
-        resp = conn.getresponse()
-        data = resp.read()
-        text = data.decode("utf-8") if data else ""
-        if 200 <= resp.status < 300:
-            return json.loads(text) if text else None
-        raise HTTPException(status_code=resp.status, detail=text or "Upstream error")
-    except (TimeoutError, ConnectionError, OSError) as e:
-        raise HTTPException(status_code=503, detail=f"Client manager unavailable: {str(e)}")
-    finally:
-        try:
-            conn.close()
-        except:
-            pass
+from .upstream import UpstreamClient
+from .upload_stream import MultipartPipe
+from .coalesce import SingleFlight
+from .cache import SWRCache, CachePolicy
+from .client_snapshot import read_snapshot, write_rows, parse_dt
+from .command_history import setup_history_schema, query_history, serialize_log
+from .output_store import set_output, load_full_output, spill_inline_outputs
+from .writebehind import WriteBehindQueue
+from .ids import new_command_id
+from .events import EventBus, diff_by_id
+from .command_stream import CommandStreams, run_streaming
+from .presence import PresenceIndex, decode_heartbeats
+from .responses import ListResponder
+from .maintenance import default_scheduler, table_sizes, read_daily_rollups, RETENTION_DAYS
+
+
+# поля статуса сервиса, изменение которых публикуется в SSE и меняет ETag /api/services (без last_checked/latency_ms)
+SERVICE_EVENT_FIELDS = ("running", "healthy", "pid", "next_restart_at", "restart_reason")
 
 
 class ClientAdmin(ModelView, model=Client):
@@ -205,8 +61,74 @@ class EnrollmentAdmin(ModelView, model=Enrollment):
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Создание таблиц на запуске
-    Base.metadata.create_all(bind=engine)
-    yield
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(add_missing_columns, CommandLog.__table__)
+        # индексы истории команд и полнотекстовый поиск для уже существующих БД
+        await conn.run_sync(setup_history_schema)
+    # Общий пул соединений к client_manager на всё время жизни приложения
+    app.state.upstream = getattr(app.state, "upstream", None) or UpstreamClient.from_env()
+    # Отложенная пакетная запись логов команд и аудита
+    app.state.writes = WriteBehindQueue(
+        max_batch=int(os.getenv("CORE_WRITE_BATCH_MAX", "200")),
+        max_delay=float(os.getenv("CORE_WRITE_BATCH_DELAY", "0.2")),
+    )
+    app.state.writes.start()
+
+    async def _spill_old_outputs():
+        # однократный перенос длинного inline-вывода из старых записей в блобы, пачками
+        moved = 0
+        try:
+            while True:
+                def _batch():
+                    with get_session() as db:
+                        return spill_inline_outputs(db)
+                n = await asyncio.to_thread(_batch)
+                moved += n
+                if not n:
+                    break
+        except Exception as e:
+            print(f"⚠️ Перенос вывода команд в блобы прерван: {e}")
+        if moved:
+            print(f"📦 Вывод {moved} команд перенесён в blob-хранилище")
+
+    spill = asyncio.create_task(_spill_old_outputs())
+    # Индекс присутствия агентов поднимается из сохранённого снапшота
+    presence = getattr(app.state, "presence", None)
+    if presence is not None:
+        try:
+            await asyncio.to_thread(presence.load_from_db)
+        except Exception as e:
+            print(f"⚠️ Presence index load failed: {e}")
+    # Фоновые циклы, которые регистрирует create_admin_app
+    background = [asyncio.create_task(job()) for job in getattr(app.state, "background_jobs", [])]
+    # Ретенция, роллапы, VACUUM и WAL checkpoint по расписанию
+    app.state.maintenance = default_scheduler(app.state.writes)
+    await app.state.maintenance.start()
+    try:
+        yield
+    finally:
+        spill.cancel()
+        for task in background:
+            task.cancel()
+        if presence is not None:
+            try:
+                await asyncio.to_thread(app.state.presence_flush)
+            except Exception as e:
+                print(f"⚠️ Presence persist on shutdown failed: {e}")
+        await app.state.maintenance.stop()
+        if getattr(app.state, "events", None):
+            await app.state.events.close()
+        # батчи и потоковые команды ещё ходят в upstream и пишут в очередь — гасим до закрытия клиента
+        pending = list(getattr(app.state, "batch_tasks", ()))
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        await app.state.upstream.aclose()
+        # дописываем всё, что осталось в очереди, до остановки процесса
+        await asyncio.to_thread(app.state.writes.flush, 30.0)
+        await asyncio.to_thread(app.state.writes.stop)
+        await dispose_engines()
 
 
 def create_admin_app(orchestrator) -> FastAPI:
@@ -232,6 +154,77 @@ def create_admin_app(orchestrator) -> FastAPI:
     admin.add_view(CommandLogAdmin)
     admin.add_view(EnrollmentAdmin)
 
+    def _upstream_json(method: str, path: str, body: Dict[str, Any] | None = None, headers: Dict[str, str] | None = None):
+      """JSON call to client_manager over the pooled client created in lifespan."""
+      return app.state.upstream.request_json(method, path, body=body, headers=headers)
+
+    # Одинаковые GET-запросы, пришедшие одновременно, делят один вызов upstream
+    flights = SingleFlight()
+    app.state.singleflight = flights
+
+    def _coalesced_get(template: str, headers: Dict[str, str] | None = None, **params: str):
+      # статистика singleflight ведётся по шаблону маршрута, ключ — конкретный путь
+      path = template.format(**params)
+      return flights.do(f"GET {path}", lambda: _upstream_json("GET", path, headers=headers), label=f"GET {template}")
+
+    # Кэш для опросов дашборда; мутирующие маршруты сбрасывают затронутые ключи
+    cache = SWRCache(max_entries=int(os.getenv("CORE_CACHE_MAX_ENTRIES", "256")), singleflight=flights)
+    app.state.cache = cache
+    cache_policies = {
+      "clients": CachePolicy.from_env("clients", ttl=2.0, stale_ttl=30.0),
+      "enrollments": CachePolicy.from_env("enrollments", ttl=5.0, stale_ttl=60.0),
+      "history": CachePolicy.from_env("history", ttl=5.0, stale_ttl=60.0),
+      "plugins": CachePolicy.from_env("plugins", ttl=30.0, stale_ttl=300.0),
+    }
+    # Списки для дашборда: ETag по версии данных, 304, пагинация, fields=, сжатие
+    lists = ListResponder()
+    app.state.lists = lists
+
+    def _service_state(services: Dict[str, Any]) -> Dict[str, tuple]:
+      # без last_checked/latency_ms: они меняются на каждой пробе, а не вместе с состоянием сервиса
+      return {name: tuple(s.get(f) for f in SERVICE_EVENT_FIELDS) for name, s in services.items()}
+
+    # Push-канал дашборда: один продюсер опрашивает источники, изменения рассылаются всем вкладкам
+    async def _produce_events(bus: EventBus):
+      interval = float(os.getenv("CORE_EVENTS_INTERVAL", "1.0"))
+      prev_services = prev_enrollments = None
+      prev_clients: Dict[str, Any] | None = None
+      while True:
+        try:
+          services = orchestrator.get_services_status()
+          # last_checked/latency_ms меняются на каждой пробе — событие только при смене состояния
+          state = _service_state(services)
+          if state != prev_services:
+            bus.publish("services", services, snapshot=services)
+            prev_services = state
+        except Exception:
+          pass
+        # продюсер — единственный опрашивающий: обновляем кэш каждый тик, HTTP-читатели получают те же данные;
+        # при ошибке upstream в кэше остаётся прежнее значение
+        try:
+          clients = await cache.refresh("clients", _fetch_clients, cache_policies["clients"])
+          if isinstance(clients, list):
+            index, upserted, removed = diff_by_id(prev_clients or {}, clients, ("hostname", "ip", "port", "status"))
+            if prev_clients is None:
+              bus.publish("clients", {"full": clients}, snapshot={"full": clients})
+            elif upserted or removed:
+              bus.publish("clients", {"upserted": upserted, "removed": removed}, snapshot={"full": clients})
+            prev_clients = index
+        except Exception:
+          pass
+        try:
+          enrollments = await cache.refresh("enrollments", lambda: _upstream_json("GET", "/api/enrollments/pending", headers=_admin_hdrs()),
+                                        cache_policies["enrollments"])
+          if enrollments != prev_enrollments:
+            bus.publish("enrollments", enrollments, snapshot=enrollments)
+            prev_enrollments = enrollments
+        except Exception:
+          pass
+        await asyncio.sleep(interval)
+
+    events = EventBus(_produce_events, idle_timeout=float(os.getenv("CORE_EVENTS_IDLE_TIMEOUT", "30")))
+    app.state.events = events
+
     # Initialize plugin loader (scans core_service/plugins directory)
     try:
       plugins_dir = os.path.join(os.path.dirname(__file__), 'plugins')
@@ -239,17 +232,19 @@ def create_admin_app(orchestrator) -> FastAPI:
     except Exception:
       plugin_loader = PluginLoader()
 
-    @app.get('/api/plugins')
-    async def list_plugins():
+    async def _load_plugins():
       # Return plugins from registry (DB) if available, otherwise fall back to filesystem loader
       try:
         from sqlalchemy import select
-        with get_session() as db:
-          q = db.execute(select(Plugin)).scalars().all()
+        async with get_async_read_session() as db:
+          q = (await db.execute(select(Plugin))).scalars().all()
+          # все версии одним запросом вместо запроса на каждый плагин
+          versions: Dict[str, list] = {}
+          for v in (await db.execute(select(PluginVersion))).scalars().all():
+            versions.setdefault(v.plugin_name, []).append(v)
           result = {}
           for p in q:
-            # fetch versions
-            vs = db.execute(select(PluginVersion).where(PluginVersion.plugin_name == p.name)).scalars().all()
+            vs = versions.get(p.name, [])
             result[p.name] = {
               'name': p.name,
               'description': p.description,
@@ -262,6 +257,11 @@ def create_admin_app(orchestrator) -> FastAPI:
         return {k: dict(v) for k, v in data.items()}
       return result
 
+    @app.get('/api/plugins')
+    async def list_plugins(request: Request, fields: str | None = None, cursor: str | None = None, limit: int | None = None):
+      data = await cache.get("plugins", _load_plugins, cache_policies["plugins"])
+      return await lists.respond(request, "plugins", data, fields=fields, cursor=cursor, limit=limit)
+
     @app.post('/api/registry/plugins')
     async def registry_publish(payload: Dict[str, Any]):
       """Publish a plugin manifest to the registry.
@@ -282,14 +282,11 @@ def create_admin_app(orchestrator) -> FastAPI:
       mtype = manifest.get('type') or (payload or {}).get('type') or None
       if mtype and mtype not in allowed_types:
         raise HTTPException(status_code=400, detail=f"Unsupported manifest type: {mtype}")
-      # Normalize manifest fields
-      entrypoint = manifest.get('entrypoint') or manifest.get('main') or None
-      install_cmd = manifest.get('install_cmd') or manifest.get('install') or None
       try:
         from sqlalchemy import select
-        with get_session() as db:
+        async with get_async_session() as db:
           # upsert plugin
-          existing = db.execute(select(Plugin).where(Plugin.name == name)).scalars().first()
+          existing = (await db.execute(select(Plugin).where(Plugin.name == name))).scalars().first()
           if not existing:
             p = Plugin(id=name, name=name, description=manifest.get('description'), publisher=publisher, latest_version=version)
             db.add(p)
@@ -301,217 +298,210 @@ def create_admin_app(orchestrator) -> FastAPI:
           pv_id = f"{name}:{version}"
           pv = PluginVersion(id=pv_id, plugin_name=name, version=version, manifest=manifest, artifact_url=artifact_url, type=mtype)
           db.add(pv)
-          db.commit()
       except Exception as e:
         raise HTTPException(status_code=500, detail=f'Failed saving plugin: {e}')
 
+      cache.invalidate("plugins")
       return JSONResponse({'status': 'ok', 'plugin': name, 'version': version})
 
     @app.get('/api/registry/plugins/{name}')
     async def registry_get(name: str):
       try:
         from sqlalchemy import select
-        with get_session() as db:
-          p = db.execute(select(Plugin).where(Plugin.name == name)).scalars().first()
+        async with get_async_read_session() as db:
+          p = (await db.execute(select(Plugin).where(Plugin.name == name))).scalars().first()
           if not p:
             raise HTTPException(status_code=404, detail='plugin not found')
-          vs = db.execute(select(PluginVersion).where(PluginVersion.plugin_name == name)).scalars().all()
+          vs = (await db.execute(select(PluginVersion).where(PluginVersion.plugin_name == name))).scalars().all()
           return JSONResponse({ 'name': p.name, 'description': p.description, 'publisher': p.publisher, 'latest_version': p.latest_version, 'versions': [ { 'version': v.version, 'artifact_url': v.artifact_url, 'created_at': v.created_at.isoformat() } for v in vs ] })
       except HTTPException:
         raise
       except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-        @app.post('/api/registry/plugins/{name}/{version}/install')
-        async def install_registry_plugin(request: Request, name: str, version: str):
-          """Create a PluginInstallJob and forward install request to the client_manager agent.
+    @app.post('/api/registry/plugins/{name}/{version}/install')
+    async def install_registry_plugin(request: Request, name: str, version: str):
+      """Create a PluginInstallJob and forward install request to the client_manager agent.
 
-          Body: {"agent_id": "agent-123", "options": { ... }}
-          """
-          try:
-            payload = await request.json()
-          except Exception:
-            payload = {}
-          agent_id = payload.get('agent_id')
-          options = payload.get('options') or {}
-
-          from sqlalchemy import select
-          with get_session() as db:
-            pv = db.execute(select(PluginVersion).where(PluginVersion.plugin_name == name, PluginVersion.version == version)).scalars().first()
-            if not pv:
-              raise HTTPException(status_code=404, detail='plugin/version not found')
-
-            import uuid
-            job_id = str(uuid.uuid4())
-            from datetime import datetime
-            job = PluginInstallJob(id=job_id, plugin_name=name, version=version, target_agent=agent_id, status='pending', created_at=datetime.utcnow())
-            db.add(job)
-            db.commit()
-
-          # prepare message for client_manager
-          msg = {
-            'message': {
-              'type': 'admin.install_plugin',
-              'data': {
-                'plugin_name': name,
-                'version': version,
-                'manifest': pv.manifest,
-                'artifact_url': pv.artifact_url,
-                'type': pv.type,
-                'options': options,
-                'install_job_id': job_id,
-              }
-            },
-            'client_id': agent_id,
+      Body: {"agent_id": "agent-123", "options": { ... }}
+      """
+      try:
+        payload = await request.json()
+      except Exception:
+        payload = {}
+      agent_id = payload.get('agent_id')
+      options = payload.get('options') or {}
+
+      from sqlalchemy import select
+      from datetime import datetime
+      async with get_async_session() as db:
+        pv = (await db.execute(select(PluginVersion).where(PluginVersion.plugin_name == name, PluginVersion.version == version))).scalars().first()
+        if not pv:
+          raise HTTPException(status_code=404, detail='plugin/version not found')
+
+        job_id = str(uuid.uuid4())
+        job = PluginInstallJob(id=job_id, plugin_name=name, version=version, target_agent=agent_id, status='pending', created_at=datetime.utcnow())
+        db.add(job)
+
+      # prepare message for client_manager
+      msg = {
+        'message': {
+          'type': 'admin.install_plugin',
+          'data': {
+            'plugin_name': name,
+            'version': version,
+            'manifest': pv.manifest,
+            'artifact_url': pv.artifact_url,
+            'type': pv.type,
+            'options': options,
+            'install_job_id': job_id,
           }
+        },
+        'client_id': agent_id,
+      }
+
+      # Build auth headers (reuse ADMIN_JWT_SECRET or ADMIN_TOKEN patterns)
+      headers = {}
+      admin_jwt_secret = os.getenv('ADMIN_JWT_SECRET', '')
+      admin_token = os.getenv('ADMIN_TOKEN', '')
+      if admin_jwt_secret:
+        alg = os.getenv('ADMIN_JWT_ALG', 'HS256').upper()
+        try:
+          import jwt as _pyjwt  # type: ignore
+        except Exception:
+          _pyjwt = None
 
-          # Build auth headers (reuse ADMIN_JWT_SECRET or ADMIN_TOKEN patterns)
-          headers = {}
-          admin_jwt_secret = os.getenv('ADMIN_JWT_SECRET', '')
-          admin_token = os.getenv('ADMIN_TOKEN', '')
-          if admin_jwt_secret:
-            alg = os.getenv('ADMIN_JWT_ALG', 'HS256').upper()
+        priv = None
+        if alg == 'RS256':
+          priv = os.getenv('ADMIN_JWT_PRIVATE_KEY') or None
+          priv_file = os.getenv('ADMIN_JWT_PRIVATE_KEY_FILE') or None
+          if not priv and priv_file:
             try:
-              import jwt as _pyjwt  # type: ignore
+              with open(priv_file, 'r') as f:
+                priv = f.read()
             except Exception:
-              _pyjwt = None
-
-            priv = None
-            if alg == 'RS256':
-              priv = os.getenv('ADMIN_JWT_PRIVATE_KEY') or None
-              priv_file = os.getenv('ADMIN_JWT_PRIVATE_KEY_FILE') or None
-              if not priv and priv_file:
-                try:
-                  with open(priv_file, 'r') as f:
-                    priv = f.read()
-                except Exception:
-                  priv = None
-              if not priv:
-                alg = 'HS256'
-
-            if alg == 'RS256' and _pyjwt and priv:
-              jwt_payload = {
-                'iss': 'core_service',
-                'sub': f'install:{agent_id}',
-                'aud': 'client_manager',
-                'iat': int(time.time()),
-                'exp': int(time.time()) + 120,
-                'jti': str(uuid.uuid4())
-              }
-              token = _pyjwt.encode(jwt_payload, priv, algorithm='RS256')
-              headers = {'Authorization': f'Bearer {token}'}
-            else:
-              # HS256 fallback (shared secret)
-              def _b64u(data: bytes) -> str:
-                return base64.urlsafe_b64encode(data).rstrip(b"=").decode('utf-8')
+              priv = None
+          if not priv:
+            alg = 'HS256'
+
+        if alg == 'RS256' and _pyjwt and priv:
+          jwt_payload = {
+            'iss': 'core_service',
+            'sub': f'install:{agent_id}',
+            'aud': 'client_manager',
+            'iat': int(time.time()),
+            'exp': int(time.time()) + 120,
+            'jti': str(uuid.uuid4())
+          }
+          token = _pyjwt.encode(jwt_payload, priv, algorithm='RS256')
+          headers = {'Authorization': f'Bearer {token}'}
+        else:
+          # HS256 fallback (shared secret)
+          def _b64u(data: bytes) -> str:
+            return base64.urlsafe_b64encode(data).rstrip(b"=").decode('utf-8')
+
+          header = {'alg': 'HS256', 'typ': 'JWT'}
+          jwt_claims = {
+            'iss': 'core_service',
+            'sub': f'install:{agent_id}',
+            'aud': 'client_manager',
+            'iat': int(time.time()),
+            'exp': int(time.time()) + 120,
+            'jti': str(uuid.uuid4())
+          }
+          header_b = _b64u(json.dumps(header).encode('utf-8'))
+          payload_b = _b64u(json.dumps(jwt_claims).encode('utf-8'))
+          signing = (header_b + '.' + payload_b).encode('utf-8')
+          sig = hmac.new(admin_jwt_secret.encode('utf-8'), signing, hashlib.sha256).digest()
+          sig_b = _b64u(sig)
+          jwt_token = header_b + '.' + payload_b + '.' + sig_b
+          headers = {'Authorization': f'Bearer {jwt_token}'}
+      elif admin_token:
+        headers = {'Authorization': f'Bearer {admin_token}'}
 
-              header = {'alg': 'HS256', 'typ': 'JWT'}
-              jwt_claims = {
-                'iss': 'core_service',
-                'sub': f'install:{agent_id}',
-                'aud': 'client_manager',
-                'iat': int(time.time()),
-                'exp': int(time.time()) + 120,
-                'jti': str(uuid.uuid4())
-              }
-              header_b = _b64u(json.dumps(header).encode('utf-8'))
-              payload_b = _b64u(json.dumps(jwt_claims).encode('utf-8'))
-              signing = (header_b + '.' + payload_b).encode('utf-8')
-              sig = hmac.new(admin_jwt_secret.encode('utf-8'), signing, hashlib.sha256).digest()
-              sig_b = _b64u(sig)
-              jwt_token = header_b + '.' + payload_b + '.' + sig_b
-              headers = {'Authorization': f'Bearer {jwt_token}'}
-          elif admin_token:
-            headers = {'Authorization': f'Bearer {admin_token}'}
+      try:
+        resp = await _upstream_json('POST', '/api/admin/send_message', body=msg, headers=headers)
+      except HTTPException as he:
+        # mark job failed
+        async with get_async_session() as db:
+          j = await db.get(PluginInstallJob, job_id)
+          if j:
+            j.status = 'failed'
+            j.logs = str(he.detail)
+            j.finished_at = datetime.utcnow()
+            db.add(j)
+        raise
 
+      # update job as sent
+      async with get_async_session() as db:
+        j = await db.get(PluginInstallJob, job_id)
+        if j:
+          j.status = 'sent'
           try:
-            resp = await asyncio.to_thread(_http_json, 'POST', '/api/admin/send_message', body=msg, headers=headers)
-          except HTTPException as he:
-            # mark job failed
-            with get_session() as db:
-              j = db.get(PluginInstallJob, job_id)
-              if j:
-                j.status = 'failed'
-                j.logs = str(he.detail)
-                from datetime import datetime
-                j.finished_at = datetime.utcnow()
-                db.add(j)
-                db.commit()
-            raise
+            j.logs = json.dumps(resp)
+          except Exception:
+            j.logs = str(resp)
+          j.started_at = datetime.utcnow()
+          db.add(j)
+
+      return JSONResponse({'ok': True, 'job_id': job_id, 'forward': resp})
+
+    @app.get('/api/registry/plugins/install/{job_id}')
+    async def get_install_job_status(job_id: str):
+      async with get_async_read_session() as db:
+        j = await db.get(PluginInstallJob, job_id)
+        if not j:
+          raise HTTPException(status_code=404, detail='job not found')
+        return JSONResponse({
+          'id': j.id,
+          'plugin_name': j.plugin_name,
+          'version': j.version,
+          'target_agent': j.target_agent,
+          'status': j.status,
+          'logs': j.logs,
+          'created_at': j.created_at.isoformat() if j.created_at else None,
+          'started_at': j.started_at.isoformat() if j.started_at else None,
+          'finished_at': j.finished_at.isoformat() if j.finished_at else None,
+        })
+
+    @app.post('/api/registry/plugins/install/callback')
+    async def install_job_callback(payload: Dict[str, Any]):
+      """Callback endpoint for client_manager to update install job status.
+
+      Expected JSON: {"install_job_id":"...","status":"running|success|failed","logs":"...","agent_id":"...","finished_at":"iso8601"}
+      This endpoint MUST be protected by internal auth in production (ADMIN_TOKEN / mTLS / JWT).
+      """
+      jid = (payload or {}).get('install_job_id')
+      if not jid:
+        raise HTTPException(status_code=400, detail='install_job_id required')
+      status = (payload or {}).get('status') or 'running'
+      logs = (payload or {}).get('logs')
+      agent_id = (payload or {}).get('agent_id')
+      finished_at = (payload or {}).get('finished_at')
 
-          # update job as sent
-          with get_session() as db:
-            j = db.get(PluginInstallJob, job_id)
-            if j:
-              j.status = 'sent'
-              try:
-                j.logs = json.dumps(resp)
-              except Exception:
-                j.logs = str(resp)
-              from datetime import datetime
-              j.started_at = datetime.utcnow()
-              db.add(j)
-              db.commit()
-
-          return JSONResponse({'ok': True, 'job_id': job_id, 'forward': resp})
-
-        @app.get('/api/registry/plugins/install/{job_id}')
-        async def get_install_job_status(job_id: str):
-          with get_session() as db:
-            j = db.get(PluginInstallJob, job_id)
-            if not j:
-              raise HTTPException(status_code=404, detail='job not found')
-            return JSONResponse({
-              'id': j.id,
-              'plugin_name': j.plugin_name,
-              'version': j.version,
-              'target_agent': j.target_agent,
-              'status': j.status,
-              'logs': j.logs,
-              'created_at': j.created_at.isoformat() if j.created_at else None,
-              'started_at': j.started_at.isoformat() if j.started_at else None,
-              'finished_at': j.finished_at.isoformat() if j.finished_at else None,
-            })
+      from datetime import datetime
+      async with get_async_session() as db:
+        job = await db.get(PluginInstallJob, jid)
+        if not job:
+          raise HTTPException(status_code=404, detail='job not found')
+        # Accept transitions: pending -> sent -> running -> success/failed
+        job.status = status
+        if logs:
+          # append to existing logs
+          try:
+            prev = job.logs or ''
+            job.logs = prev + "\n" + str(logs)
+          except Exception:
+            job.logs = str(logs)
+        if status in ('success', 'failed'):
+          job.finished_at = datetime.fromisoformat(finished_at) if finished_at else datetime.utcnow()
+        if status == 'running' and not job.started_at:
+          job.started_at = datetime.utcnow()
+        if agent_id:
+          job.target_agent = agent_id
+        db.add(job)
 
-            @app.post('/api/registry/plugins/install/callback')
-            async def install_job_callback(payload: Dict[str, Any]):
-              """Callback endpoint for client_manager to update install job status.
-
-              Expected JSON: {"install_job_id":"...","status":"running|success|failed","logs":"...","agent_id":"...","finished_at":"iso8601"}
-              This endpoint MUST be protected by internal auth in production (ADMIN_TOKEN / mTLS / JWT).
-              """
-              jid = (payload or {}).get('install_job_id')
-              if not jid:
-                raise HTTPException(status_code=400, detail='install_job_id required')
-              status = (payload or {}).get('status') or 'running'
-              logs = (payload or {}).get('logs')
-              agent_id = (payload or {}).get('agent_id')
-              finished_at = (payload or {}).get('finished_at')
-
-              from datetime import datetime
-              with get_session() as db:
-                job = db.get(PluginInstallJob, jid)
-                if not job:
-                  raise HTTPException(status_code=404, detail='job not found')
-                # Accept transitions: pending -> sent -> running -> success/failed
-                job.status = status
-                if logs:
-                  # append to existing logs
-                  try:
-                    prev = job.logs or ''
-                    job.logs = prev + "\n" + str(logs)
-                  except Exception:
-                    job.logs = str(logs)
-                if status in ('success', 'failed'):
-                  job.finished_at = datetime.fromisoformat(finished_at) if finished_at else datetime.utcnow()
-                if status == 'running' and not job.started_at:
-                  job.started_at = datetime.utcnow()
-                if agent_id:
-                  job.target_agent = agent_id
-                db.add(job)
-                db.commit()
-
-              return JSONResponse({'ok': True, 'id': jid, 'status': status})
+      return JSONResponse({'ok': True, 'id': jid, 'status': status})
 
     # --- Yandex Smart Home plugin endpoints (skeleton) ---
     try:
@@ -646,7 +636,10 @@ def create_admin_app(orchestrator) -> FastAPI:
               }
 
               async function loadServices() {
-                const data = await fetchJSON('/api/services');
+                renderServices(await fetchJSON('/api/services'));
+              }
+
+              function renderServices(data) {
                 const el = document.getElementById('services');
                 const rows = Object.values(data).map(s => `
                   <tr>
@@ -672,7 +665,10 @@ def create_admin_app(orchestrator) -> FastAPI:
               }
 
               async function loadClients() {
-                const data = await fetchJSON('/api/clients');
+                renderClients(await fetchJSON('/api/clients'));
+              }
+
+              function renderClients(data) {
                 const el = document.getElementById('clients');
                 el.innerHTML = data.map(c => `
                   <div class=\"row\">
@@ -726,21 +722,24 @@ def create_admin_app(orchestrator) -> FastAPI:
 
               async function loadEnrollments() {
                 try {
-                  const data = await fetchJSON('/api/enrollments/pending');
-                  const el = document.getElementById('enrollments');
-                  if (!data.length) { el.innerHTML = 'Нет ожидающих записей'; return; }
-                  el.innerHTML = data.map(e => `
-                    <div class=\"row\">
-                      <code>${e.client_id || e.id || JSON.stringify(e)}</code>
-                      <button onclick=\"approve('${e.client_id || e.id}')\">Approve</button>
-                      <button onclick=\"reject('${e.client_id || e.id}')\">Reject</button>
-                    </div>
-                  `).join('');
+                  renderEnrollments(await fetchJSON('/api/enrollments/pending'));
                 } catch (e) {
                   document.getElementById('enrollments').innerText = 'Недоступно (проверь ADMIN_TOKEN)';
                 }
               }
 
+              function renderEnrollments(data) {
+                const el = document.getElementById('enrollments');
+                if (!data.length) { el.innerHTML = 'Нет ожидающих записей'; return; }
+                el.innerHTML = data.map(e => `
+                  <div class=\"row\">
+                    <code>${e.client_id || e.id || JSON.stringify(e)}</code>
+                    <button onclick=\"approve('${e.client_id || e.id}')\">Approve</button>
+                    <button onclick=\"reject('${e.client_id || e.id}')\">Reject</button>
+                  </div>
+                `).join('');
+              }
+
               async function approve(id) {
                 await fetchJSON(`/api/enrollments/${id}/approve`, { method: 'POST' });
                 await loadEnrollments();
@@ -752,15 +751,16 @@ def create_admin_app(orchestrator) -> FastAPI:
 
               async function loadHistory() {
                 try {
-                  const items = await fetchJSON('/api/commands/history');
+                  const page = await fetchJSON('/api/commands/log?limit=20');
+                  const items = page.items;
                   const el = document.getElementById('history');
                   if (!items || items.length === 0) { el.innerHTML = 'История пуста'; return; }
-                  el.innerHTML = items.slice(-20).reverse().map(r => `
+                  el.innerHTML = items.map(r => `
                     <div class="row">
-                      <code>${r.command_id || r.id}</code> @ <b>${r.client_id}</b>
-                      — <span>${r.success ? 'success' : 'failed'}</span>
-                      ${r.result ? `<pre style="white-space:pre-wrap;background:#f9fafb;padding:6px;border-radius:6px">${String(r.result).substring(0,500)}</pre>`: ''}
-                      ${r.error ? `<pre style="white-space:pre-wrap;background:#fff1f2;padding:6px;border-radius:6px">${String(r.error).substring(0,500)}</pre>`: ''}
+                      <code>${r.id}</code> @ <b>${r.client_id}</b>
+                      — <span>${r.status || ''}</span>
+                      ${r.stdout ? `<pre style="white-space:pre-wrap;background:#f9fafb;padding:6px;border-radius:6px">${String(r.stdout).substring(0,500)}</pre>`: ''}
+                      ${r.stderr ? `<pre style="white-space:pre-wrap;background:#fff1f2;padding:6px;border-radius:6px">${String(r.stderr).substring(0,500)}</pre>`: ''}
                     </div>
                   `).join('');
                 } catch(e) {
@@ -771,8 +771,33 @@ def create_admin_app(orchestrator) -> FastAPI:
               async function tick() {
                 await Promise.all([loadServices(), loadClients(), loadEnrollments(), loadHistory()]);
               }
+              // Живые обновления через /api/events; опрос раз в 5 с — только пока поток недоступен
+              let clientsById = {};
+              let pollTimer = null;
+              function startPolling() { if (!pollTimer) pollTimer = setInterval(tick, 5000); }
+              function stopPolling() { if (pollTimer) { clearInterval(pollTimer); pollTimer = null; } }
+
+              function startLive() {
+                if (!window.EventSource) return false;
+                const es = new EventSource('/api/events');
+                es.addEventListener('services', e => renderServices(JSON.parse(e.data)));
+                es.addEventListener('clients', e => {
+                  const d = JSON.parse(e.data);
+                  if (d.full) { clientsById = {}; d.full.forEach(c => clientsById[c.id] = c); }
+                  (d.upserted || []).forEach(c => clientsById[c.id] = c);
+                  (d.removed || []).forEach(id => delete clientsById[id]);
+                  renderClients(Object.values(clientsById));
+                });
+                es.addEventListener('enrollments', e => renderEnrollments(JSON.parse(e.data)));
+                es.addEventListener('command', () => loadHistory());
+                es.onopen = stopPolling;
+                // EventSource переподключается сам; до этого работаем опросом
+                es.onerror = startPolling;
+                return true;
+              }
+
               tick();
-              setInterval(tick, 5000);
+              if (!startLive()) startPolling();
             </script>
           </body>
         </html>
@@ -781,15 +806,87 @@ def create_admin_app(orchestrator) -> FastAPI:
 
     # --- Services ---
     @app.get("/api/services")
-    async def services_status() -> JSONResponse:
-        return JSONResponse(orchestrator.get_services_status())
+    async def services_status(request: Request, fields: str | None = None, cursor: str | None = None, limit: int | None = None) -> Response:
+        # статус читается из снимка HealthProber — без сетевых запросов, поток не нужен
+        data = orchestrator.get_services_status()
+        return await lists.respond(request, "services", data, fields=fields, cursor=cursor, limit=limit,
+                                   version_of=_service_state(data))
     @app.get("/admin/api/services")
-    async def services_status_compat() -> JSONResponse:
-        return await services_status()
+    async def services_status_compat(request: Request, fields: str | None = None, cursor: str | None = None, limit: int | None = None) -> Response:
+        return await services_status(request, fields, cursor, limit)
 
+    @app.get("/api/services/startup")
+    async def services_startup() -> JSONResponse:
+        """Timeline of the last start_all: per-service wait for dependencies and boot time."""
+        return JSONResponse(orchestrator.get_startup_timeline())
+
+    def _service_logs(name: str):
+        logs = getattr(orchestrator, "logs", {}).get(name)
+        if logs is None:
+            raise HTTPException(status_code=404, detail="service not found")
+        return logs
+
+    def _log_since(since: str | None) -> Dict[str, Any]:
+        """`since` is a line seq (for incremental polling) or an ISO 8601 time."""
+        if not since:
+            return {}
+        if since.isdigit():
+            return {"since_seq": int(since)}
+        dt = parse_dt(since)
+        if dt is None:
+            raise HTTPException(status_code=400, detail="since must be a line seq or an ISO 8601 datetime")
+        from datetime import timezone
+        return {"since_ts": dt.replace(tzinfo=timezone.utc).timestamp()}
+
+    @app.get("/api/services/{name}/logs")
+    async def service_logs(name: str, tail: int = 200, since: str | None = None, stream: str | None = None) -> JSONResponse:
+        """Recent output of a managed service from its in-memory ring buffers."""
+        logs = _service_logs(name)
+        tail = max(1, min(tail, 10000))
+        lines = logs.query(tail=tail, stream=stream, **_log_since(since))
+        return JSONResponse({"service": name, "lines": [l.to_dict() for l in lines], **logs.stats()})
+
+    @app.get("/api/services/{name}/logs/follow")
+    async def service_logs_follow(request: Request, name: str, tail: int = 100, stream: str | None = None):
+        """SSE: the last `tail` lines, then new lines as they arrive. Resumes from Last-Event-ID (line seq)."""
+        from fastapi.responses import StreamingResponse
+        logs = _service_logs(name)
+        keepalive = float(os.getenv("CORE_EVENTS_KEEPALIVE", "15"))
+        last_id = request.headers.get("last-event-id", "")
+        tail = max(1, min(tail, 10000))
+
+        async def _stream():
+            event = logs.follow()
+            try:
+                yield "retry: 3000\n\n"
+                if last_id.isdigit():
+                    seq, batch = int(last_id), logs.query(since_seq=int(last_id), stream=stream)
+                else:
+                    batch = logs.query(tail=tail, stream=stream)
+                    seq = batch[-1].seq if batch else logs.next_seq - 1
+                while True:
+                    for entry in batch:
+                        seq = entry.seq
+                        yield f"id: {entry.seq}\nevent: line\ndata: {json.dumps(entry.to_dict(), ensure_ascii=False)}\n\n"
+                    event.clear()
+                    batch = logs.query(since_seq=seq, stream=stream)
+                    if batch:
+                        continue
+                    try:
+                        await asyncio.wait_for(event.wait(), keepalive)
+                    except asyncio.TimeoutError:
+                        yield ": ping\n\n"
+                    batch = logs.query(since_seq=seq, stream=stream)
+            finally:
+                logs.unfollow(event)
+
+        return StreamingResponse(_stream(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    # старт ждёт зависимостей и health-check (до минуты), остановка — завершения процесса: не на цикле событий
     @app.post("/api/services/restart/{name}")
     async def services_restart(name: str) -> JSONResponse:
-        ok = orchestrator.restart(name)
+        ok = await asyncio.to_thread(orchestrator.restart, name)
         if not ok:
             raise HTTPException(status_code=404, detail="service not found")
         return JSONResponse({"message": "restarted", "name": name})
@@ -799,7 +896,7 @@ def create_admin_app(orchestrator) -> FastAPI:
 
     @app.post("/api/services/stop/{name}")
     async def services_stop(name: str) -> JSONResponse:
-        ok = orchestrator.stop(name)
+        ok = await asyncio.to_thread(orchestrator.stop, name)
         if not ok:
             raise HTTPException(status_code=404, detail="service not found")
         return JSONResponse({"message": "stopped", "name": name})
@@ -809,7 +906,7 @@ def create_admin_app(orchestrator) -> FastAPI:
 
     @app.post("/api/services/start/{name}")
     async def services_start(name: str) -> JSONResponse:
-        ok = orchestrator.start(name)
+        ok = await asyncio.to_thread(orchestrator.start, name)
         if not ok:
             raise HTTPException(status_code=404, detail="service not found")
         return JSONResponse({"message": "started", "name": name})
@@ -818,73 +915,323 @@ def create_admin_app(orchestrator) -> FastAPI:
         return await services_start(name)
 
     # --- Clients proxy to client_manager ---
+    # Индекс присутствия: обновляется диффом каждого опроса, в таблицу Client пишется периодически
+    presence = PresenceIndex()
+    app.state.presence = presence
+
+    async def _fetch_clients():
+        data = await _upstream_json("GET", "/api/clients")
+        if isinstance(data, list):
+            app.state.client_upsert = await asyncio.to_thread(presence.apply_snapshot, data)
+        return data
+
+    def _flush_presence() -> int:
+        rows = presence.take_dirty()
+        removed = presence.take_removed()
+        try:
+            return write_rows(rows, removed)
+        except Exception:
+            presence.mark_dirty(r["id"] for r in rows)
+            presence.mark_removed(removed)
+            raise
+    app.state.presence_flush = _flush_presence
+
+    async def _persist_presence():
+        interval = float(os.getenv("CORE_PRESENCE_PERSIST_INTERVAL", "10"))
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                app.state.presence_persisted = await asyncio.to_thread(_flush_presence)
+            except Exception as e:
+                # снапшот — только запасной источник; занятая БД не должна ломать индекс
+                print(f"⚠️ Presence persist failed: {e}")
+
+    async def _poll_presence():
+        # без открытых дашбордов индекс всё равно обновляется; при живом трафике кэш уже свежий
+        interval = float(os.getenv("CORE_PRESENCE_POLL_INTERVAL", "10"))
+        if interval <= 0:
+            return
+        while True:
+            try:
+                await cache.get("clients", _fetch_clients, cache_policies["clients"])
+            except Exception:
+                pass
+            await asyncio.sleep(interval)
+
+    app.state.background_jobs = [_persist_presence, _poll_presence]
+
     @app.get("/api/clients")
-    async def clients_list() -> JSONResponse:
-        data = await asyncio.to_thread(_http_json, "GET", "/api/clients")
-        # Обновим снапшот в БД
-        def _upsert_clients(clients: list[dict[str, Any]]):
-            with get_session() as db:  # type: Session
-                for c in clients:
-                    obj = db.get(Client, c.get("id"))
-                    if obj is None:
-                        obj = Client(id=c.get("id"))
-                    obj.hostname = c.get("hostname")
-                    obj.ip = c.get("ip")
-                    obj.port = c.get("port")
-                    obj.status = c.get("status")
-                    # Преобразование ISO дат
-                    def _parse(dt):
-                        try:
-                            return datetime.fromisoformat(dt) if dt else None
-                        except Exception:
-                            return None
-                    from datetime import datetime
-                    obj.connected_at = _parse(c.get("connected_at"))
-                    obj.last_heartbeat = _parse(c.get("last_heartbeat"))
-                    db.merge(obj)
-        await asyncio.to_thread(_upsert_clients, data)
-        return JSONResponse(data)
+    async def clients_list(request: Request, fields: str | None = None, cursor: str | None = None, limit: int | None = None) -> Response:
+        try:
+            data = await cache.get("clients", _fetch_clients, cache_policies["clients"])
+        except HTTPException as he:
+            if he.status_code != 503:
+                raise
+            # client_manager недоступен: отдаём последнее известное состояние из индекса (или из БД)
+            snapshot = presence.export(stale=True) if len(presence) else await asyncio.to_thread(read_snapshot)
+            if not snapshot:
+                raise
+            return JSONResponse(snapshot, headers={"X-Data-Source": "snapshot", "X-Upstream-Error": str(he.detail)[:200].encode("ascii", "replace").decode()})
+        return await lists.respond(request, "clients", data, fields=fields, cursor=cursor, limit=limit)
 
     @app.get("/admin/api/clients")
-    async def clients_list_compat() -> JSONResponse:
-        return await clients_list()
+    async def clients_list_compat(request: Request, fields: str | None = None, cursor: str | None = None, limit: int | None = None) -> Response:
+        return await clients_list(request, fields, cursor, limit)
+
+    @app.get("/api/presence/summary")
+    async def presence_summary(stale_after: float = 60.0) -> JSONResponse:
+        """Fleet counts by status and the number of clients silent for `stale_after` seconds."""
+        return JSONResponse(presence.summary(stale_after))
+
+    @app.get("/api/presence/stale")
+    async def presence_stale(since: str | None = None, older_than: float = 60.0, limit: int = 100) -> JSONResponse:
+        """Clients without a heartbeat since `since` (ISO) or for `older_than` seconds, oldest first."""
+        from datetime import timedelta
+        cutoff = parse_dt(since) if since else datetime.utcnow() - timedelta(seconds=older_than)
+        if cutoff is None:
+            raise HTTPException(status_code=400, detail="since must be an ISO 8601 datetime")
+        limit = max(1, min(limit, 10000))
+        return JSONResponse({"since": cutoff.isoformat(), "count": presence.count_stale(cutoff),
+                             "items": presence.stale(cutoff, limit)})
+
+    @app.get("/api/presence/lookup")
+    async def presence_lookup(hostname: str | None = None, ip: str | None = None) -> JSONResponse:
+        if not hostname and not ip:
+            raise HTTPException(status_code=400, detail="hostname or ip is required")
+        return JSONResponse(presence.lookup(hostname=hostname, ip=ip))
+
+    @app.get("/api/presence/clients/{client_id}")
+    async def presence_client(client_id: str) -> JSONResponse:
+        row = presence.get(client_id)
+        if row is None:
+            raise HTTPException(status_code=404, detail="Client not found")
+        return JSONResponse(row)
+
+    @app.post("/api/presence/heartbeats")
+    async def presence_heartbeats(request: Request) -> JSONResponse:
+        """Batch heartbeat ingestion from client_manager (NDJSON, JSON array or msgpack).
+
+        Only the in-memory index is updated here; rows reach the Client table with the next
+        periodic persist, coalesced per client.
+        """
+        body = await request.body()
+        content_type = request.headers.get("content-type", "")
 
-    @app.post("/api/commands/{client_id}")
-    async def command_exec(client_id: str, payload: Dict[str, Any]) -> JSONResponse:
-        # Сохраним команду как queued
-        command_id: str | None = None
+        def _ingest():
+            return presence.heartbeat_many(decode_heartbeats(body, content_type))
+        try:
+            counts = await asyncio.to_thread(_ingest)
+        except RuntimeError as e:
+            raise HTTPException(status_code=415, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Malformed heartbeat batch: {e}")
+        return JSONResponse(counts)
+
+    @app.get("/api/presence/clients/{client_id}/gaps")
+    async def presence_client_gaps(client_id: str, window: float = 3600.0) -> JSONResponse:
+        """Downsampled heartbeat gaps and status flips of one client over the last `window` seconds."""
+        if presence.get(client_id) is None:
+            raise HTTPException(status_code=404, detail="Client not found")
+        return JSONResponse({"client_id": client_id, "bucket_sec": presence.gaps.bucket_sec,
+                             "late_after_sec": presence.gaps.late_sec,
+                             "buckets": presence.gap_series(client_id, window)})
+
+    @app.get("/api/presence/flapping")
+    async def presence_flapping(window: float = 3600.0, min_events: int = 3, limit: int = 100) -> JSONResponse:
+        limit = max(1, min(limit, 10000))
+        items = await asyncio.to_thread(presence.flapping, window, max(1, min_events), limit)
+        return JSONResponse({"window_sec": window, "min_events": min_events, "items": items})
+
+    def _command_text(payload: Any) -> str | None:
         if payload and isinstance(payload, dict):
-            command_text = payload.get("command") or (str(payload.get("name")) + " " + str(payload.get("params")))
-        else:
-            command_text = None
-        if command_text:
-            from datetime import datetime
-            def _prelog():
-                with get_session() as db:
-                    cid = f"cmd_{int(datetime.utcnow().timestamp())}"
-                    log = CommandLog(id=cid, client_id=client_id, command=command_text, status="queued")
-                    db.merge(log)
-                    return cid
-            command_id = await asyncio.to_thread(_prelog)
-
-        data = await asyncio.to_thread(_http_json, "POST", f"/api/commands/{client_id}", body=payload)
-
-        # Дообновим запись результатом, если знаем id
-        if command_id and isinstance(data, dict):
-            def _postlog():
-                with get_session() as db:
+            return payload.get("command") or (str(payload.get("name")) + " " + str(payload.get("params")))
+        return None
+
+    async def _run_command(client_id: str, payload: Any, command_id: str, command_text: str | None):
+        """Forward one command to client_manager and queue the update of its CommandLog row."""
+        # Один id на core и агента: передаём client_manager в теле и заголовке
+        try:
+            data = await _upstream_json("POST", f"/api/commands/{client_id}", body=payload, headers={"X-Command-Id": command_id})
+        except HTTPException as he:
+            if command_text:
+                finished_at = datetime.utcnow()
+                # he удаляется при выходе из except, а операция выполнится позже в потоке записи
+                error = str(he.detail)
+                def _faillog(db):
                     log = db.get(CommandLog, command_id)
                     if log:
-                        # Map fields from client_manager schema
-                        success = data.get("success")
-                        log.status = "success" if success else "failed"
-                        log.stdout = data.get("result")
-                        log.stderr = data.get("error")
-                        log.exit_code = data.get("exit_code")
-                        log.finished_at = __import__("datetime").datetime.utcnow()
-                        db.add(log)
-            await asyncio.to_thread(_postlog)
+                        log.status = "error"
+                        set_output(db, log, "stderr", error)
+                        log.finished_at = finished_at
+                await app.state.writes.submit_async(_faillog)
+            events.publish("command", {"command_id": command_id, "client_id": client_id, "status": "error"})
+            raise
+
+        # Дообновим запись результатом
+        if command_text and isinstance(data, dict):
+            finished_at = datetime.utcnow()
+            def _postlog(db):
+                log = db.get(CommandLog, command_id)
+                if log:
+                    # Map fields from client_manager schema
+                    success = data.get("success")
+                    log.status = "success" if success else "failed"
+                    set_output(db, log, "stdout", data.get("result"))
+                    set_output(db, log, "stderr", data.get("error"))
+                    log.exit_code = data.get("exit_code")
+                    log.finished_at = finished_at
+            await app.state.writes.submit_async(_postlog)
+
+        if isinstance(data, dict):
+            data.setdefault("command_id", command_id)
+            events.publish("command", {
+                "command_id": command_id, "client_id": client_id,
+                "status": "success" if data.get("success") else "failed", "exit_code": data.get("exit_code"),
+            })
+        return data
+
+    # Задачи батчей живут дольше стрима: если браузер отключился, команды всё равно дописываются в лог
+    batch_tasks: set = set()
+    app.state.batch_tasks = batch_tasks
+
+    @app.post("/api/commands/batch")
+    async def command_batch(request: Request, payload: Dict[str, Any], format: str | None = None):
+        """Run one command on many clients concurrently and stream each result as it completes.
+
+        Target selector: `clients` (list of ids), `status` (e.g. "offline") or `all_online: true`.
+        `parallelism` limits concurrent upstream calls (default CORE_BATCH_PARALLELISM, capped by
+        the upstream connection pool). Everything else in the payload is forwarded as the command.
+        The response is NDJSON, or SSE with `?format=sse` / `Accept: text/event-stream`.
+        """
+        forward = {k: v for k, v in payload.items() if k not in ("clients", "status", "all_online", "parallelism")}
+        command_text = _command_text(forward)
+        if not command_text:
+            raise HTTPException(status_code=400, detail="command is required")
+
+        if payload.get("clients") is not None:
+            if not isinstance(payload["clients"], list):
+                raise HTTPException(status_code=400, detail="clients must be a list of client ids")
+            targets = list(dict.fromkeys(str(c) for c in payload["clients"] if c))
+        else:
+            want = "online" if payload.get("all_online") else payload.get("status")
+            if not want:
+                raise HTTPException(status_code=400, detail="Specify clients, status or all_online")
+            clients = await cache.get("clients", _fetch_clients, cache_policies["clients"])
+            targets = [str(c["id"]) for c in clients or [] if isinstance(c, dict) and c.get("id") and c.get("status") == want]
+        if not targets:
+            raise HTTPException(status_code=400, detail="No clients match the selector")
+
+        limit = min(int(os.getenv("CORE_BATCH_MAX_PARALLELISM", "256")), getattr(app.state.upstream, "max_connections", 50))
+        try:
+            parallelism = max(1, min(int(payload.get("parallelism") or os.getenv("CORE_BATCH_PARALLELISM", "32")), limit))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="parallelism must be an integer")
+
+        batch_id = new_command_id().replace("cmd_", "batch_", 1)
+        ids = {cid: new_command_id() for cid in targets}
+        created_at = datetime.utcnow()
+        # Все строки батча — одной операцией write-behind
+        await app.state.writes.submit_async(lambda db: db.add_all([
+            CommandLog(id=ids[cid], client_id=cid, command=command_text, status="queued", created_at=created_at)
+            for cid in targets
+        ]))
+
+        sem = asyncio.Semaphore(parallelism)
+        results: asyncio.Queue = asyncio.Queue()
+
+        async def _one(cid: str):
+            started = time.perf_counter()
+            # результат кладётся в очередь всегда (и при отмене задачи), иначе стрим ждал бы его вечно
+            item: Dict[str, Any] = {"ok": False, "status_code": 503, "error": "cancelled"}
+            try:
+                async with sem:
+                    started = time.perf_counter()
+                    try:
+                        data = await _run_command(cid, {**forward, "command_id": ids[cid]}, ids[cid], command_text)
+                        item = {"ok": True, "status_code": 200, "success": data.get("success") if isinstance(data, dict) else None, "data": data}
+                    except HTTPException as he:
+                        item = {"ok": False, "status_code": he.status_code, "error": he.detail}
+                    except Exception as e:
+                        item = {"ok": False, "status_code": 502, "error": str(e)}
+            finally:
+                item.update(type="result", client_id=cid, command_id=ids[cid], ms=round((time.perf_counter() - started) * 1000, 1))
+                results.put_nowait(item)
+
+        tasks = [asyncio.create_task(_one(cid)) for cid in targets]
+        for t in tasks:
+            batch_tasks.add(t)
+            t.add_done_callback(batch_tasks.discard)
+        asyncio.gather(*tasks, return_exceptions=True).add_done_callback(lambda _: cache.invalidate("history"))
+
+        sse = format == "sse" or "text/event-stream" in request.headers.get("accept", "")
+
+        def _encode(item: Dict[str, Any]) -> str:
+            body = json.dumps(item, default=str, ensure_ascii=False)
+            return f"event: {item['type']}\ndata: {body}\n\n" if sse else body + "\n"
+
+        async def _stream():
+            started = time.perf_counter()
+            yield _encode({"type": "start", "batch_id": batch_id, "command": command_text, "targets": len(targets),
+                           "parallelism": parallelism, "command_ids": ids})
+            ok = failed = 0
+            for _ in range(len(targets)):
+                item = await results.get()
+                if item["ok"]:
+                    ok += 1
+                else:
+                    failed += 1
+                yield _encode(item)
+            yield _encode({"type": "done", "batch_id": batch_id, "ok": ok, "failed": failed,
+                           "seconds": round(time.perf_counter() - started, 3)})
 
+        from fastapi.responses import StreamingResponse
+        return StreamingResponse(
+            _stream(),
+            media_type="text/event-stream" if sse else "application/x-ndjson",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    # Потоки вывода команд, запущенных в асинхронном режиме
+    command_streams = CommandStreams()
+    app.state.command_streams = command_streams
+
+    def _stream_done(out):
+        cache.invalidate("history")
+        events.publish("command", {"command_id": out.command_id, "client_id": out.client_id,
+                                   "status": out.status, "exit_code": out.exit_code})
+
+    @app.post("/api/commands/{client_id}")
+    async def command_exec(client_id: str, payload: Dict[str, Any], mode: str | None = None) -> JSONResponse:
+        """Run a command on a client. With `?mode=async` returns the command id at once (202)
+        and streams the output via /api/commands/{command_id}/stream."""
+        command_id = new_command_id()
+        command_text = _command_text(payload)
+        if isinstance(payload, dict):
+            payload = {**payload, "command_id": command_id}
+        if command_text:
+            # Сохраним команду как queued. Запись уходит в write-behind очередь, коммит не входит в latency запроса;
+            # created_at фиксируем сейчас: дефолт сработал бы только при сбросе батча
+            created_at = datetime.utcnow()
+            await app.state.writes.submit_async(lambda db: db.add(
+                CommandLog(id=command_id, client_id=client_id, command=command_text, status="queued", created_at=created_at)))
+        if mode == "async":
+            if not command_text:
+                raise HTTPException(status_code=400, detail="command is required")
+            out = command_streams.create(command_id, client_id)
+            task = asyncio.create_task(run_streaming(
+                app.state.upstream, app.state.writes, out, payload,
+                flush_interval=float(os.getenv("CORE_STREAM_FLUSH_INTERVAL", "0.5")),
+                read_timeout=float(os.getenv("CORE_STREAM_READ_TIMEOUT", "300")),
+                on_done=_stream_done,
+            ))
+            batch_tasks.add(task)
+            task.add_done_callback(batch_tasks.discard)
+            return JSONResponse({"command_id": command_id, "status": "running",
+                                 "stream": f"/api/commands/{command_id}/stream"}, status_code=202)
+        try:
+            data = await _run_command(client_id, payload, command_id, command_text)
+        finally:
+            cache.invalidate("history")
         return JSONResponse(data)
 
     @app.post("/api/clients/{client_id}/install")
@@ -984,26 +1331,19 @@ def create_admin_app(orchestrator) -> FastAPI:
             if admin_token:
               headers = {"Authorization": f"Bearer {admin_token}"}
 
-          data = await asyncio.to_thread(_http_json, 'POST', '/api/admin/send_message', body=msg, headers=headers)
+          data = await _upstream_json('POST', '/api/admin/send_message', body=msg, headers=headers)
         except HTTPException as he:
             raise he
 
         # Audit log: save CommandLog-like entry
         try:
-            from datetime import datetime
-
-            def _log():
-                with get_session() as db:
-                    import uuid
-
-                    cid = f"install_{uuid.uuid4().hex}"
-                    log = CommandLog(id=cid, client_id=client_id, command="install_pty_manager", status="sent")
-                    db.merge(log)
-
-            await asyncio.to_thread(_log)
+            cid = f"install_{uuid.uuid4().hex}"
+            await app.state.writes.submit_async(lambda db: db.merge(
+                CommandLog(id=cid, client_id=client_id, command="install_pty_manager", status="sent")))
         except Exception:
             pass
 
+        cache.invalidate("clients", "history")
         return JSONResponse({"ok": True, "forwarded": data})
 
     @app.post("/admin/api/commands/{client_id}")
@@ -1020,43 +1360,71 @@ def create_admin_app(orchestrator) -> FastAPI:
       file: UploadFile = File(...),
     ) -> JSONResponse:
         """Принимает multipart/form-data файл и проксирует его в client_manager.
-        Считывает файл в память (подходит для небольших файлов в dev).
+        Файл уже лежит в spooled-буфере UploadFile, отдаём его в upstream чанками без
+        промежуточной копии. Для больших файлов см. /api/files/upload/stream.
         """
         if not client_id or not dest_path:
             raise HTTPException(status_code=400, detail="client_id и dest_path обязательны")
 
-        try:
-            original_name = file.filename
-            # Сохраним входящий файл во временный файл на диске и будем стримить его
-            import tempfile
-            tmp_dir = os.getenv("UPLOAD_TMP_DIR", "/tmp")
-            fd, tmp_path = tempfile.mkstemp(prefix="upload_", dir=tmp_dir)
-            os.close(fd)
-            with open(tmp_path, "wb") as out_f:
-              # copy in chunks from the UploadFile.file (which is a SpooledTemporaryFile)
-              import shutil
-              await file.seek(0)
-              shutil.copyfileobj(file.file, out_f)
-            await file.close()
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Не удалось прочитать файл: {e}")
-
+        original_name = file.filename
         fields = {
           "client_id": client_id,
           "path": dest_path,
           "original_filename": original_name or "",
           "direction": "upload",
         }
+
+        async def file_chunks():
+          await file.seek(0)
+          while True:
+            chunk = await file.read(64 * 1024)
+            if not chunk:
+              break
+            yield chunk
+
         try:
-          data = await asyncio.to_thread(_http_multipart_stream, "/api/files/upload/init", fields, "file", original_name or "upload.bin", tmp_path)
+          data = await app.state.upstream.post_multipart("/api/files/upload/init", fields, "file", original_name or "upload.bin", file_chunks(),
+                                                         file_content_type=file.content_type or "application/octet-stream")
           return JSONResponse(data)
-        except HTTPException as he:
-          raise he
         finally:
-          try:
-            os.remove(tmp_path)
-          except Exception:
-            pass
+          await file.close()
+
+    @app.post("/api/files/upload/stream")
+    async def upload_file_streaming(request: Request, client_id: str | None = None, dest_path: str | None = None) -> JSONResponse:
+        """Pass-through upload: the multipart body is piped to client_manager while it is received.
+
+        Nothing is spooled to disk; at most UPLOAD_STREAM_BUFFER_CHUNKS request chunks are held
+        in memory. `client_id`/`dest_path` come from the query string or from form fields sent
+        before the file part.
+        """
+        content_type = request.headers.get('content-type', '')
+        if not content_type.startswith('multipart/form-data'):
+          raise HTTPException(status_code=400, detail='multipart/form-data expected')
+        try:
+          max_chunks = int(os.getenv("UPLOAD_STREAM_BUFFER_CHUNKS", "16"))
+        except ValueError:
+          max_chunks = 16
+        pipe = MultipartPipe(content_type, max_buffered_chunks=max_chunks)
+        producer = asyncio.create_task(pipe.run(request.stream()))
+        try:
+          await pipe.wait_file_start()
+          client_id = client_id or pipe.fields.get('client_id')
+          dest_path = dest_path or pipe.fields.get('dest_path') or pipe.fields.get('path')
+          if not client_id or not dest_path:
+            raise HTTPException(status_code=400, detail="client_id и dest_path обязательны")
+          fields = {
+            "client_id": client_id,
+            "path": dest_path,
+            "original_filename": pipe.filename or "",
+            "direction": "upload",
+          }
+          data = await app.state.upstream.post_multipart("/api/files/upload/init", fields, "file", pipe.filename or "upload.bin",
+                                                         pipe.file_chunks(), file_content_type=pipe.file_content_type)
+          await producer
+          return JSONResponse(data)
+        finally:
+          if not producer.done():
+            producer.cancel()
 
     @app.post("/api/files/upload/init")
     async def upload_init_proxy(request: Request):
@@ -1081,29 +1449,29 @@ def create_admin_app(orchestrator) -> FastAPI:
       except Exception:
         raise HTTPException(status_code=400, detail='Invalid request body')
       try:
-        data = await asyncio.to_thread(_http_json, 'POST', '/api/files/upload/init', body)
+        data = await _upstream_json('POST', '/api/files/upload/init', body)
         return JSONResponse(data)
       except HTTPException as he:
         raise he
 
     @app.get("/api/files/transfers/{transfer_id}/status")
     async def transfer_status_proxy(transfer_id: str) -> JSONResponse:
-      data = await asyncio.to_thread(_http_json, "GET", f"/api/files/transfers/{transfer_id}/status")
+      data = await _coalesced_get("/api/files/transfers/{transfer_id}/status", transfer_id=transfer_id)
       return JSONResponse(data)
 
     @app.post("/api/files/transfers/pause")
     async def transfer_pause_proxy(payload: Dict[str, Any]) -> JSONResponse:
-      data = await asyncio.to_thread(_http_json, "POST", "/api/files/transfers/pause", body=payload)
+      data = await _upstream_json("POST", "/api/files/transfers/pause", body=payload)
       return JSONResponse(data)
 
     @app.post("/api/files/transfers/resume")
     async def transfer_resume_proxy(payload: Dict[str, Any]) -> JSONResponse:
-      data = await asyncio.to_thread(_http_json, "POST", "/api/files/transfers/resume", body=payload)
+      data = await _upstream_json("POST", "/api/files/transfers/resume", body=payload)
       return JSONResponse(data)
 
     @app.post("/api/files/transfers/cancel")
     async def transfer_cancel_proxy(payload: Dict[str, Any]) -> JSONResponse:
-      data = await asyncio.to_thread(_http_json, "POST", "/api/files/transfers/cancel", body=payload)
+      data = await _upstream_json("POST", "/api/files/transfers/cancel", body=payload)
       return JSONResponse(data)
 
     @app.post("/api/commands/{client_id}/cancel")
@@ -1111,7 +1479,7 @@ def create_admin_app(orchestrator) -> FastAPI:
         # оригинальный endpoint ожидает body или query? используем query для простоты
         # прокинем как query в путь, внутри клиент-менеджера обработается из параметров
         path = f"/api/commands/{client_id}/cancel?" + urlencode({"command_id": command_id})
-        data = await asyncio.to_thread(_http_json, "POST", path)
+        data = await _upstream_json("POST", path)
         return JSONResponse(data)
 
     @app.post("/admin/api/commands/{client_id}/cancel")
@@ -1125,7 +1493,8 @@ def create_admin_app(orchestrator) -> FastAPI:
 
     @app.get("/api/enrollments/pending")
     async def enrollments_pending() -> JSONResponse:
-        data = await asyncio.to_thread(_http_json, "GET", "/api/enrollments/pending", headers=_admin_hdrs())
+        data = await cache.get("enrollments", lambda: _upstream_json("GET", "/api/enrollments/pending", headers=_admin_hdrs()),
+                               cache_policies["enrollments"])
         return JSONResponse(data)
     @app.get("/admin/api/enrollments/pending")
     async def enrollments_pending_compat() -> JSONResponse:
@@ -1133,7 +1502,8 @@ def create_admin_app(orchestrator) -> FastAPI:
 
     @app.post("/api/enrollments/{client_id}/approve")
     async def enroll_approve(client_id: str) -> JSONResponse:
-        data = await asyncio.to_thread(_http_json, "POST", f"/api/enrollments/{client_id}/approve", headers=_admin_hdrs())
+        data = await _upstream_json("POST", f"/api/enrollments/{client_id}/approve", headers=_admin_hdrs())
+        cache.invalidate("enrollments", "clients")
         return JSONResponse(data)
     @app.post("/admin/api/enrollments/{client_id}/approve")
     async def enroll_approve_compat(client_id: str) -> JSONResponse:
@@ -1141,7 +1511,8 @@ def create_admin_app(orchestrator) -> FastAPI:
 
     @app.post("/api/enrollments/{client_id}/reject")
     async def enroll_reject(client_id: str) -> JSONResponse:
-        data = await asyncio.to_thread(_http_json, "POST", f"/api/enrollments/{client_id}/reject", headers=_admin_hdrs())
+        data = await _upstream_json("POST", f"/api/enrollments/{client_id}/reject", headers=_admin_hdrs())
+        cache.invalidate("enrollments", "clients")
         return JSONResponse(data)
     @app.post("/admin/api/enrollments/{client_id}/reject")
     async def enroll_reject_compat(client_id: str) -> JSONResponse:
@@ -1149,15 +1520,153 @@ def create_admin_app(orchestrator) -> FastAPI:
 
     # --- Commands history/status proxy ---
     @app.get("/api/commands/history")
-    async def commands_history() -> JSONResponse:
-        data = await asyncio.to_thread(_http_json, "GET", "/api/commands/history")
-        return JSONResponse(data)
+    async def commands_history(request: Request, fields: str | None = None, cursor: str | None = None, limit: int | None = None) -> Response:
+        data = await cache.get("history", lambda: _upstream_json("GET", "/api/commands/history"), cache_policies["history"])
+        # command_id — ULID, поэтому страницы по убыванию id идут от новых к старым
+        return await lists.respond(request, "history", data, key=("command_id", "id"), descending=True,
+                                   fields=fields, cursor=cursor, limit=limit)
+
+    @app.get("/api/commands/log")
+    async def commands_log(
+        client_id: str | None = None,
+        status: str | None = None,
+        since: str | None = None,
+        until: str | None = None,
+        q: str | None = None,
+        cursor: str | None = None,
+        limit: int = 50,
+    ) -> JSONResponse:
+        """Command history from the local CommandLog: filters, full-text `q` and keyset `cursor`.
+
+        `q` matches the stored preview of truncated outputs, not their full text.
+        """
+        since_dt, until_dt = parse_dt(since), parse_dt(until)
+        if (since and since_dt is None) or (until and until_dt is None):
+            raise HTTPException(status_code=400, detail="since/until must be ISO 8601 datetimes")
+        try:
+            async with get_async_read_session() as db:
+                page = await query_history(
+                    db, client_id=client_id, status=status, since=since_dt, until=until_dt,
+                    q=q, cursor=cursor, limit=limit,
+                )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return JSONResponse(page)
+
+    @app.get("/api/commands/log/{command_id}")
+    async def commands_log_item(command_id: str) -> JSONResponse:
+        """One command with its full stdout/stderr, read from the blob store when truncated."""
+        def _load():
+            with get_read_session() as db:
+                log = db.get(CommandLog, command_id)
+                if log is None:
+                    return None
+                item = serialize_log(log)
+                item.update(load_full_output(db, log))
+                return item
+        # распаковка больших блобов не должна блокировать event loop
+        item = await asyncio.to_thread(_load)
+        if item is None:
+            raise HTTPException(status_code=404, detail="Command not found")
+        return JSONResponse(item)
+
+    @app.get("/api/commands/stats/daily")
+    async def commands_daily_stats(client_id: str | None = None, since: str | None = None, until: str | None = None) -> JSONResponse:
+        """Daily command rollups (kept after raw rows expire), complete days only."""
+        since_dt, until_dt = parse_dt(since), parse_dt(until)
+        if (since and since_dt is None) or (until and until_dt is None):
+            raise HTTPException(status_code=400, detail="since/until must be ISO 8601 dates")
+        items = await asyncio.to_thread(
+            read_daily_rollups, client_id,
+            since_dt.date() if since_dt else None, until_dt.date() if until_dt else None,
+        )
+        return JSONResponse(items)
+
+    @app.get("/api/commands/{command_id}/stream")
+    async def command_stream(command_id: str, request: Request, offset: int | None = None):
+        """SSE with the command's output chunks from `offset` (or after Last-Event-ID), then `done`.
+
+        Chunk events carry their offset as the event id, so a reconnecting EventSource resumes
+        where it stopped. Finished commands no longer in memory are replayed from CommandLog.
+        """
+        from fastapi.responses import StreamingResponse
+        if offset is None:
+            last_id = request.headers.get("last-event-id")
+            offset = int(last_id) + 1 if last_id and last_id.isdigit() else 0
+        offset = max(0, offset)
+        out = command_streams.get(command_id)
+
+        def _sse(event: str, data: Dict[str, Any], event_id: int | None = None) -> str:
+            head = f"id: {event_id}\n" if event_id is not None else ""
+            return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+        if out is None:
+            def _load():
+                with get_read_session() as db:
+                    log = db.get(CommandLog, command_id)
+                    if log is None:
+                        return None
+                    return {**serialize_log(log), **load_full_output(db, log)}
+            item = await asyncio.to_thread(_load)
+            if item is None:
+                raise HTTPException(status_code=404, detail="Command not found")
+
+            async def _replay():
+                # сохранённый вывод: по одному чанку на поток, смещения 0 (stdout) и 1 (stderr)
+                for i, stream in enumerate(("stdout", "stderr")):
+                    if i >= offset and item.get(stream):
+                        yield _sse("chunk", {"offset": i, "stream": stream, "data": item[stream]}, i)
+                yield _sse("done", {"status": item["status"], "exit_code": item["exit_code"], "source": "log"})
+            return StreamingResponse(_replay(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+        keepalive = float(os.getenv("CORE_EVENTS_KEEPALIVE", "15"))
+
+        async def _live():
+            pos = offset
+            yield "retry: 2000\n\n"
+            if pos < out.first_offset:
+                # часть чанков уже вытеснена из буфера — полный вывод будет в /api/commands/log/{id}
+                yield _sse("gap", {"requested": pos, "available_from": out.first_offset})
+                pos = out.first_offset
+            while True:
+                for off, stream, data in out.since(pos):
+                    yield _sse("chunk", {"offset": off, "stream": stream, "data": data}, off)
+                    pos = off + 1
+                if out.done and pos >= out.next_offset:
+                    yield _sse("done", {"status": out.status, "exit_code": out.exit_code, "truncated": out.truncated})
+                    return
+                if not await out.wait(pos, keepalive):
+                    yield ": ping\n\n"
+
+        return StreamingResponse(_live(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
     @app.get("/api/commands/{command_id}")
     async def command_result(command_id: str) -> JSONResponse:
-        data = await asyncio.to_thread(_http_json, "GET", f"/api/commands/{command_id}")
+        data = await _coalesced_get("/api/commands/{command_id}", command_id=command_id)
         return JSONResponse(data)
 
+    @app.get("/api/proxy/stats")
+    async def proxy_stats() -> JSONResponse:
+        """Counters of upstream calls that were originated vs. served from an in-flight call."""
+        return JSONResponse({
+          "singleflight": flights.stats(),
+          "circuit_breaker": app.state.upstream.breaker.stats(),
+          "client_snapshot_last_upsert": getattr(app.state, "client_upsert", None),
+        })
+
+    @app.get("/api/cache/stats")
+    async def cache_stats() -> JSONResponse:
+        return JSONResponse({**cache.stats(), "responses": lists.stats()})
+
+    @app.post("/api/cache/flush")
+    async def cache_flush(key: str | None = None) -> JSONResponse:
+        """Drop one cache key (`?key=clients`) or the whole cache."""
+        if key:
+          cache.invalidate(key)
+          return JSONResponse({"flushed": [key]})
+        return JSONResponse({"flushed": cache.flush()})
+
     # --- Download helpers: initiate download from client and proxy the file
     from fastapi import Form
 
@@ -1165,48 +1674,43 @@ def create_admin_app(orchestrator) -> FastAPI:
     async def initiate_download(client_id: str = Form(...), path: str = Form(...)) -> JSONResponse:
       """Инициировать скачивание файла с клиента; core_service вызывает client_manager и вернёт transfer_id"""
       body = {"client_id": client_id, "path": path, "direction": "download"}
-      data = await asyncio.to_thread(_http_json, "POST", "/api/files/upload/init", body=body)
+      data = await _upstream_json("POST", "/api/files/upload/init", body=body)
       return JSONResponse(data)
 
     @app.get("/api/files/download/{transfer_id}")
-    async def proxy_download(transfer_id: str):
-      """Проксируем запрос скачивания файла от client_manager и стримим его клиенту."""
+    async def proxy_download(transfer_id: str, request: Request):
+      """Проксируем запрос скачивания файла от client_manager и стримим его клиенту.
+
+      Bytes are forwarded as they arrive from upstream, so memory use does not depend on
+      file size. Range/If-Range are passed through to support resuming.
+      """
       # Запросим файл у client_manager
-      import http.client, ssl
-      base = os.getenv("CM_BASE_URL", "http://127.0.0.1:10000")
-      from urllib.parse import urlparse as _parse
-      b = _parse(base)
-      scheme = (b.scheme or "http").lower()
-      host = b.hostname or "127.0.0.1"
-      port = b.port or (443 if scheme == "https" else 80)
       path = f"/api/files/transfers/{transfer_id}/download"
-      if scheme == "https":
-        ctx = ssl.create_default_context()
-        ctx.check_hostname = False
-        ctx.verify_mode = ssl.CERT_NONE
-        conn = http.client.HTTPSConnection(host, port, timeout=30, context=ctx)
-      else:
-        conn = http.client.HTTPConnection(host, port, timeout=30)
-      try:
-        conn.request('GET', path)
-        resp = conn.getresponse()
-        data = resp.read()
-        if resp.status != 200:
-          text = data.decode('utf-8', errors='ignore')
-          raise HTTPException(status_code=resp.status, detail=text)
-        from fastapi.responses import StreamingResponse
-        def stream():
-          yield data
-        headers = {k: v for k, v in resp.getheaders()}
-        return StreamingResponse(stream(), media_type=headers.get('Content-Type', 'application/octet-stream'), headers={})
-      finally:
+      fwd = {k: request.headers[k] for k in ('range', 'if-range') if k in request.headers}
+      resp = await app.state.upstream.open_stream('GET', path, headers=fwd)
+      if resp.status_code not in (200, 206):
         try:
-          conn.close()
-        except Exception:
-          pass
-
-    return app
+          data = await resp.aread()
+        finally:
+          await resp.aclose()
+        text = data.decode('utf-8', errors='ignore')
+        raise HTTPException(status_code=resp.status_code, detail=text)
+
+      from fastapi.responses import StreamingResponse
+      async def stream():
+        # StreamingResponse ждёт отправки каждого чанка клиенту, поэтому
+        # медленный браузер естественно притормаживает чтение из upstream.
+        try:
+          async for chunk in resp.aiter_raw():
+            yield chunk
+        finally:
+          await resp.aclose()
 
+      passthrough = ('content-length', 'content-disposition', 'content-range', 'accept-ranges',
+                     'content-encoding', 'etag', 'last-modified')
+      headers = {k: resp.headers[k] for k in passthrough if k in resp.headers}
+      return StreamingResponse(stream(), status_code=resp.status_code,
+                               media_type=resp.headers.get('Content-Type', 'application/octet-stream'), headers=headers)
 
     # --- Terminal audit endpoint ---
     @app.post("/api/terminals/audit")
@@ -1231,14 +1735,13 @@ def create_admin_app(orchestrator) -> FastAPI:
       else:
         ts_val = datetime.utcnow()
 
-      with get_session() as db:
+      def _apply(db):
         # Try to find existing audit by session_id
         from sqlalchemy import select
         q = select(TerminalAudit).where(TerminalAudit.session_id == sid)
         res = db.execute(q).scalars().first()
         if res is None:
           # create new
-          import uuid
           aid = payload.get("id") or f"term_{uuid.uuid4().hex}"
           rec = TerminalAudit(id=aid, session_id=sid, client_id=payload.get("client_id"),
                     initiator_type=(payload.get("initiator") or {}).get("type"),
@@ -1263,6 +1766,53 @@ def create_admin_app(orchestrator) -> FastAPI:
             res.initiator_id = (payload.get("initiator") or {}).get("id")
           db.add(res)
 
+      # События одной сессии применяются по порядку в write-behind очереди
+      await app.state.writes.submit_async(_apply)
+
       return JSONResponse({"status": "ok"})
 
+    @app.get("/api/maintenance")
+    async def maintenance_status() -> JSONResponse:
+        """Table sizes, retention policy and the last/next run of each maintenance job."""
+        sizes = await asyncio.to_thread(table_sizes)
+        return JSONResponse({**sizes, "retention_days": RETENTION_DAYS, "jobs": app.state.maintenance.stats()})
+
+    @app.post("/api/maintenance/run")
+    async def maintenance_run(job: str) -> JSONResponse:
+        if job not in app.state.maintenance.jobs:
+            raise HTTPException(status_code=404, detail=f"Unknown maintenance job: {job}")
+        app.state.maintenance.trigger(job)
+        return JSONResponse({"scheduled": job}, status_code=202)
+
+    @app.get("/api/events")
+    async def events_stream():
+        """Server-sent events: services, clients (diffs), enrollments and command completions."""
+        from fastapi.responses import StreamingResponse
+        keepalive = float(os.getenv("CORE_EVENTS_KEEPALIVE", "15"))
+
+        async def _stream():
+            yield "retry: 3000\n\n"
+            async with events.subscribe() as sub:
+                while True:
+                    ev = await sub.get(keepalive)
+                    if ev is None:
+                        # комментарий держит соединение через прокси и выявляет отвалившихся клиентов
+                        yield ": ping\n\n"
+                        continue
+                    if ev.type == "closed":
+                        return
+                    yield ev.frame
+
+        return StreamingResponse(_stream(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    @app.get("/api/events/stats")
+    async def events_stats() -> JSONResponse:
+        return JSONResponse(events.stats())
+
+    @app.get("/api/writes/stats")
+    async def writes_stats() -> JSONResponse:
+      """Write-behind queue depth and batch metrics."""
+      return JSONResponse(app.state.writes.stats())
 
+    return app
@@ -0,0 +1,110 @@
+"""CommandLog insert rate under concurrent writers, per SQLite profile.
+
+Each profile runs in a fresh interpreter against its own temporary database, because
+db.py picks the profile at import time:
+
+    python -m core_service.bench.command_log_insert --rows 2000 --writers 8 --readers 2
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+
+def _worker_run(rows: int, writers: int, readers: int) -> dict:
+    from sqlalchemy import func, select
+    from sqlalchemy.exc import OperationalError
+
+    from ..db import engine, get_read_session, get_session
+    from ..models import Base, CommandLog
+
+    Base.metadata.create_all(bind=engine)
+    per_writer = rows // writers
+    errors = {"locked": 0}
+    read_latencies: list[float] = []
+    done = threading.Event()
+
+    def writer():
+        for i in range(per_writer):
+            # одна транзакция на команду — как делал command_exec до write-behind очереди
+            while True:
+                try:
+                    with get_session() as db:
+                        db.add(CommandLog(id=uuid.uuid4().hex, client_id=f"c{i % 50}", command="uptime", status="queued"))
+                    break
+                except OperationalError:
+                    errors["locked"] += 1
+                    time.sleep(0.001)
+
+    def reader():
+        while not done.is_set():
+            t = time.perf_counter()
+            try:
+                with get_read_session() as db:
+                    db.execute(select(func.count()).select_from(CommandLog)).scalar()
+            except OperationalError:
+                errors["locked"] += 1
+            read_latencies.append(time.perf_counter() - t)
+            time.sleep(0.005)
+
+    rthreads = [threading.Thread(target=reader) for _ in range(readers)]
+    wthreads = [threading.Thread(target=writer) for _ in range(writers)]
+    for t in rthreads:
+        t.start()
+    started = time.perf_counter()
+    for t in wthreads:
+        t.start()
+    for t in wthreads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    done.set()
+    for t in rthreads:
+        t.join()
+
+    read_latencies.sort()
+    p99 = read_latencies[int(len(read_latencies) * 0.99) - 1] if read_latencies else 0.0
+    return {
+        "rows": per_writer * writers,
+        "seconds": round(elapsed, 3),
+        "inserts_per_sec": round(per_writer * writers / elapsed, 1),
+        "lock_retries": errors["locked"],
+        "read_p99_ms": round(p99 * 1000, 2),
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=2000)
+    ap.add_argument("--writers", type=int, default=8)
+    ap.add_argument("--readers", type=int, default=2)
+    ap.add_argument("--profiles", default="default,production")
+    ap.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.worker:
+        print(json.dumps(_worker_run(args.rows, args.writers, args.readers)))
+        return
+
+    pkg = __package__.rsplit(".", 1)[0]
+    for profile in args.profiles.split(","):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, CORE_DB_PROFILE=profile, CORE_DB_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+            env.pop("CORE_ASYNC_DB_URL", None)
+            out = subprocess.run(
+                [sys.executable, "-m", f"{pkg}.bench.command_log_insert", "--worker",
+                 "--rows", str(args.rows), "--writers", str(args.writers), "--readers", str(args.readers)],
+                env=env, capture_output=True, text=True, check=True,
+            )
+            result = json.loads(out.stdout.strip().splitlines()[-1])
+            print(f"{profile:>10}: {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Load test for POST /api/commands/{client_id}: throughput and log completeness.
+
+Runs the admin app in-process against a fake client_manager (httpx.MockTransport with a
+configurable delay) and a temporary SQLite database, fires N commands with C in flight,
+then checks that every command got its own CommandLog row with the final status and
+that client_manager saw the same ID core logged:
+
+    python -m core_service.bench.command_pipeline --commands 3000 --concurrency 200
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+
+async def _run(n: int, concurrency: int, upstream_delay: float, clients: int) -> dict:
+    import httpx
+    from sqlalchemy import func, select
+
+    from ..admin_app import create_admin_app
+    from ..db import get_read_session
+    from ..models import CommandLog
+    from ..services import Orchestrator
+    from ..upstream import UpstreamClient
+
+    seen_ids: dict = {}
+
+    async def fake_cm(request: httpx.Request) -> httpx.Response:
+        if request.method != "POST" or not request.url.path.startswith("/api/commands/"):
+            # фоновые опросы приложения (список клиентов и т.п.) к замеру не относятся
+            return httpx.Response(200, json=[])
+        body = json.loads(request.content or b"{}")
+        header_id = request.headers.get("x-command-id")
+        seen_ids[header_id] = body.get("command_id")
+        await asyncio.sleep(upstream_delay)
+        return httpx.Response(200, json={"success": True, "result": f"ok {body.get('command')}", "exit_code": 0})
+
+    app = create_admin_app(Orchestrator(tempfile.gettempdir()))
+    app.state.upstream = UpstreamClient("http://cm", transport=httpx.MockTransport(fake_cm))
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://core") as http:
+            async def one(i: int):
+                nonlocal errors
+                async with sem:
+                    t = time.perf_counter()
+                    r = await http.post(f"/api/commands/c{i % clients}", json={"command": f"echo {i}"})
+                    latencies.append(time.perf_counter() - t)
+                    if r.status_code != 200:
+                        errors += 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(one(i) for i in range(n)))
+            elapsed = time.perf_counter() - started
+        await asyncio.to_thread(app.state.writes.flush, 60.0)
+        writes = app.state.writes.stats()
+
+    with get_read_session() as db:
+        rows = db.execute(select(func.count()).select_from(CommandLog)).scalar()
+        done = db.execute(select(func.count()).select_from(CommandLog).where(CommandLog.status == "success")).scalar()
+        logged_ids = set(db.execute(select(CommandLog.id)).scalars())
+
+    latencies.sort()
+    return {
+        "commands": n,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 2),
+        "commands_per_sec": round(n / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 1),
+        "http_errors": errors,
+        "log_rows": rows,
+        "log_rows_success": done,
+        "ids_match_upstream": all(h == b for h, b in seen_ids.items()) and logged_ids == set(seen_ids),
+        "write_batches": writes["batches"],
+        "write_failed": writes["failed"],
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--commands", type=int, default=3000)
+    ap.add_argument("--concurrency", type=int, default=200)
+    ap.add_argument("--upstream-delay", type=float, default=0.02, help="seconds client_manager takes per command")
+    ap.add_argument("--clients", type=int, default=50)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # БД выбирается при импорте db.py, поэтому окружение задаём до импорта приложения
+        os.environ["CORE_DB_URL"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        os.environ.pop("CORE_ASYNC_DB_URL", None)
+        os.environ.setdefault("CORE_MAINTENANCE_INITIAL_DELAY", "3600")
+        os.environ.setdefault("CORE_PRESENCE_POLL_INTERVAL", "0")
+        result = asyncio.run(_run(args.commands, args.concurrency, args.upstream_delay, args.clients))
+    print(json.dumps(result, indent=2))
+    ok = result["http_errors"] == 0 and result["log_rows_success"] == args.commands and result["ids_match_upstream"]
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Load test for POST /api/presence/heartbeats: ingestion rate and coalesced persistence.
+
+Runs the admin app in-process against a temporary SQLite database, registers a fleet of
+clients, then posts heartbeat batches (NDJSON or msgpack) with C requests in flight and
+reports heartbeats per second. Afterwards one persist pass writes the coalesced rows
+to the `Client` table, and the test checks that every client's last heartbeat landed:
+
+    python -m core_service.bench.heartbeat_ingest --clients 50000 --heartbeats 1000000 --batch 5000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from datetime import timezone
+
+
+def _batch(start: int, size: int, clients: int, base: float, fmt: str) -> bytes:
+    items = [{"id": f"agent-{i % clients}", "at": base + i / clients, "status": "online"}
+             for i in range(start, start + size)]
+    if fmt == "msgpack":
+        import msgpack
+        return msgpack.packb(items)
+    return "\n".join(json.dumps(item) for item in items).encode()
+
+
+async def _run(clients: int, heartbeats: int, batch: int, concurrency: int, fmt: str) -> dict:
+    import httpx
+    from sqlalchemy import func, select
+
+    from ..admin_app import create_admin_app
+    from ..db import get_read_session
+    from ..models import Client
+    from ..services import Orchestrator
+
+    app = create_admin_app(Orchestrator(tempfile.gettempdir()))
+    ctype = "application/msgpack" if fmt == "msgpack" else "application/x-ndjson"
+    base = time.time() - heartbeats / clients - 60
+    # тела готовим заранее: измеряем сервер, а не генератор нагрузки
+    bodies = [_batch(s, min(batch, heartbeats - s), clients, base, fmt) for s in range(0, heartbeats, batch)]
+    sem = asyncio.Semaphore(concurrency)
+    accepted = errors = 0
+
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://core") as http:
+            async def send(body: bytes):
+                nonlocal accepted, errors
+                async with sem:
+                    r = await http.post("/api/presence/heartbeats", content=body, headers={"Content-Type": ctype})
+                    if r.status_code != 200:
+                        errors += 1
+                    else:
+                        accepted += r.json()["accepted"]
+
+            started = time.perf_counter()
+            await asyncio.gather(*(send(b) for b in bodies))
+            elapsed = time.perf_counter() - started
+
+            t = time.perf_counter()
+            persisted = await asyncio.to_thread(app.state.presence_flush)
+            persist_sec = time.perf_counter() - t
+            summary = (await http.get("/api/presence/summary")).json()
+
+    expected_last = {f"agent-{i % clients}": base + i / clients for i in range(heartbeats - clients, heartbeats)}
+    with get_read_session() as db:
+        rows = db.execute(select(func.count()).select_from(Client)).scalar()
+        sample = db.execute(select(Client.id, Client.last_heartbeat).limit(1000)).all()
+    # в БД время хранится как naive UTC
+    up_to_date = all(hb is not None and abs(hb.replace(tzinfo=timezone.utc).timestamp() - expected_last[cid]) < 0.01
+                     for cid, hb in sample)
+
+    return {
+        "format": fmt,
+        "clients": clients,
+        "heartbeats": heartbeats,
+        "batch": batch,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 2),
+        "heartbeats_per_sec": round(heartbeats / elapsed),
+        "accepted": accepted,
+        "http_errors": errors,
+        "persisted_rows": persisted,
+        "persist_seconds": round(persist_sec, 2),
+        "client_rows": rows,
+        "last_heartbeat_persisted": up_to_date,
+        "index_total": summary["total"],
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clients", type=int, default=50000)
+    ap.add_argument("--heartbeats", type=int, default=1000000)
+    ap.add_argument("--batch", type=int, default=5000)
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--format", choices=("ndjson", "msgpack"), default="ndjson")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # БД выбирается при импорте db.py, поэтому окружение задаём до импорта приложения
+        os.environ["CORE_DB_URL"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        os.environ.pop("CORE_ASYNC_DB_URL", None)
+        os.environ.setdefault("CORE_MAINTENANCE_INITIAL_DELAY", "3600")
+        # фоновый persist не должен попасть в замер, опрос client_manager тут не нужен
+        os.environ["CORE_PRESENCE_PERSIST_INTERVAL"] = "3600"
+        os.environ["CORE_PRESENCE_POLL_INTERVAL"] = "0"
+        result = asyncio.run(_run(args.clients, args.heartbeats, args.batch, args.concurrency, args.format))
+    print(json.dumps(result, indent=2))
+    ok = (result["http_errors"] == 0 and result["accepted"] == args.heartbeats
+          and result["client_rows"] == args.clients and result["last_heartbeat_persisted"])
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
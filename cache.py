@@ -0,0 +1,189 @@
+"""In-memory stale-while-revalidate cache for dashboard read proxies.
+
+Fresh entries are served directly. Entries past their TTL but inside the stale window
+are still served, and a single background refresh is started. Loads go through
+`SingleFlight`, so a refresh and a concurrent miss never hit upstream twice.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Set
+
+from .coalesce import SingleFlight
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachePolicy:
+    ttl: float
+    stale_ttl: float
+
+    @classmethod
+    def from_env(cls, name: str, ttl: float, stale_ttl: float) -> "CachePolicy":
+        """Defaults can be overridden with CORE_CACHE_<NAME>_TTL / CORE_CACHE_<NAME>_STALE."""
+        prefix = f"CORE_CACHE_{name.upper()}"
+        try:
+            ttl = float(os.getenv(f"{prefix}_TTL", ttl))
+            stale_ttl = float(os.getenv(f"{prefix}_STALE", stale_ttl))
+        except ValueError:
+            pass
+        return cls(ttl=ttl, stale_ttl=stale_ttl)
+
+
+@dataclass
+class _Entry:
+    value: Any
+    fetched_at: float
+    policy: CachePolicy
+
+
+class SWRCache:
+    def __init__(self, max_entries: int = 256, singleflight: SingleFlight | None = None):
+        self.max_entries = max_entries
+        self._flights = singleflight or SingleFlight()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        # поколение ключа растёт при инвалидации: устаревшая загрузка не перезапишет кэш.
+        # Хранится, пока у ключа есть запись или загрузка в полёте, поэтому не растёт без предела.
+        self._generation: Dict[str, int] = {}
+        self._loading: Dict[str, int] = {}
+        self._refreshing: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    async def get(self, key: str, loader: Callable[[], Awaitable[Any]], policy: CachePolicy) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry.fetched_at
+            if age < entry.policy.ttl:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry.value
+            if age < entry.policy.ttl + entry.policy.stale_ttl:
+                self.stale_hits += 1
+                self._entries.move_to_end(key)
+                self._refresh_in_background(key, loader, policy)
+                return entry.value
+        self.misses += 1
+        return await self._load(key, loader, policy)
+
+    def peek(self, key: str) -> Any:
+        """Return the cached value regardless of age, or None."""
+        entry = self._entries.get(key)
+        return entry.value if entry is not None else None
+
+    async def _load(self, key: str, loader: Callable[[], Awaitable[Any]], policy: CachePolicy) -> Any:
+        generation = self._generation.get(key, 0)
+
+        async def _flight():
+            self._loading[key] = self._loading.get(key, 0) + 1
+            # колбэк срабатывает после того, как SingleFlight забыл задачу
+            asyncio.current_task().add_done_callback(lambda _t: self._landed(key))
+            value = await loader()
+            if self._generation.get(key, 0) == generation:
+                self._store(key, value, policy)
+            return value
+
+        # поколение в ключе: загрузку, начатую до инвалидации, нельзя подхватить после неё
+        return await self._flights.do(f"cache:{key}:{generation}", _flight, label=f"cache:{key}")
+
+    def _landed(self, key: str) -> None:
+        n = self._loading.get(key, 0) - 1
+        if n > 0:
+            self._loading[key] = n
+            return
+        self._loading.pop(key, None)
+        self._forget_generation(key)
+
+    def _forget_generation(self, key: str) -> None:
+        # без записи и без загрузок в полёте поколению нечего защищать
+        if key not in self._entries and key not in self._loading:
+            self._generation.pop(key, None)
+
+    def _store(self, key: str, value: Any, policy: CachePolicy) -> None:
+        self._entries[key] = _Entry(value=value, fetched_at=time.monotonic(), policy=policy)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            self.evictions += 1
+            self._forget_generation(evicted)
+
+    def _refresh_in_background(self, key: str, loader: Callable[[], Awaitable[Any]], policy: CachePolicy) -> None:
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+        self.refreshes += 1
+
+        async def _run():
+            try:
+                await self._load(key, loader, policy)
+            except Exception as e:
+                # upstream недоступен — продолжаем отдавать устаревшее значение
+                self.refresh_errors += 1
+                logger.debug("cache refresh for %s failed: %s", key, e)
+            finally:
+                self._refreshing.discard(key)
+
+        task = asyncio.ensure_future(_run())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def refresh(self, key: str, loader: Callable[[], Awaitable[Any]], policy: CachePolicy) -> Any:
+        """Reload `key` now regardless of age; on failure keep serving the cached value.
+
+        Raises only when there is nothing cached to fall back on.
+        """
+        self.refreshes += 1
+        try:
+            return await self._load(key, loader, policy)
+        except Exception:
+            self.refresh_errors += 1
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry.fetched_at >= entry.policy.ttl + entry.policy.stale_ttl:
+                raise
+            return entry.value
+
+    def invalidate(self, *keys: str) -> None:
+        for key in keys:
+            self._generation[key] = self._generation.get(key, 0) + 1
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+            self._forget_generation(key)
+
+    def invalidate_prefix(self, prefix: str) -> None:
+        self.invalidate(*[k for k in list(self._entries) if k.startswith(prefix)])
+
+    def flush(self) -> int:
+        n = len(self._entries)
+        self.invalidate(*list(self._entries))
+        return n
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.stale_hits + self.misses
+        now = time.monotonic()
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else None,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "keys": {k: {"age_sec": round(now - e.fetched_at, 3), "ttl": e.policy.ttl, "stale_ttl": e.policy.stale_ttl}
+                     for k, e in self._entries.items()},
+        }
@@ -0,0 +1,128 @@
+"""Persisted snapshot of client_manager's client list (`Client` table)."""
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List
+
+from sqlalchemy import delete, select
+
+from .db import get_session, get_read_session
+from .models import Client
+
+
+# Поля снапшота, которые приходят из client_manager и сравниваются при upsert
+SNAPSHOT_FIELDS = ("hostname", "ip", "port", "status", "connected_at", "last_heartbeat")
+UPSERT_BATCH = 500
+
+
+def parse_dt(value: Any) -> datetime | None:
+    """ISO string -> naive UTC datetime (the form SQLAlchemy returns from DateTime columns)."""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        dt = value
+    else:
+        try:
+            dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def coerce_fields(c: Dict[str, Any]) -> Dict[str, Any]:
+    """hostname/ip/port/status present in `c`, converted to the `Client` column types.
+
+    Missing and None values are left out; a port that is not an integer is dropped.
+    """
+    out: Dict[str, Any] = {}
+    for f in ("hostname", "ip", "status"):
+        if c.get(f) is not None:
+            out[f] = str(c[f])
+    if c.get("port") is not None:
+        try:
+            out["port"] = int(c["port"])
+        except (TypeError, ValueError):
+            pass
+    return out
+
+
+def normalize_client(c: Dict[str, Any]) -> Dict[str, Any] | None:
+    cid = c.get("id")
+    if not cid:
+        return None
+    return {
+        "id": str(cid),
+        "hostname": None,
+        "ip": None,
+        "port": None,
+        "status": None,
+        **coerce_fields(c),
+        "connected_at": parse_dt(c.get("connected_at")),
+        "last_heartbeat": parse_dt(c.get("last_heartbeat")),
+    }
+
+
+def _bulk_upsert(db, rows: List[Dict[str, Any]]) -> None:
+    """One INSERT ... ON CONFLICT (id) DO UPDATE statement executed for all rows."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        for r in rows:
+            db.merge(Client(**r))
+        return
+    stmt = dialect_insert(Client)
+    cols = SNAPSHOT_FIELDS + ("updated_at",)
+    stmt = stmt.on_conflict_do_update(index_elements=[Client.id], set_={c: stmt.excluded[c] for c in cols})
+    for i in range(0, len(rows), UPSERT_BATCH):
+        db.execute(stmt, rows[i:i + UPSERT_BATCH])
+
+
+def write_rows(rows: List[Dict[str, Any]], removed: Iterable[str] = ()) -> int:
+    """Upsert already-normalized rows (with `updated_at`), e.g. the presence index's dirty set,
+    and delete the `removed` ids, so deregistered clients leave the fallback snapshot too.
+    """
+    removed = list(removed)
+    if not rows and not removed:
+        return 0
+    with get_session() as db:
+        if rows:
+            _bulk_upsert(db, [{k: r.get(k) for k in ("id",) + SNAPSHOT_FIELDS + ("updated_at",)} for r in rows])
+        for i in range(0, len(removed), UPSERT_BATCH):
+            db.execute(delete(Client).where(Client.id.in_(removed[i:i + UPSERT_BATCH])))
+    return len(rows) + len(removed)
+
+
+def _iso(dt: datetime | None) -> str | None:
+    return dt.isoformat() if dt else None
+
+
+def read_snapshot(now: datetime | None = None) -> List[Dict[str, Any]]:
+    """Return the stored clients in the upstream /api/clients shape, marked as stale.
+
+    Each item carries `stale: True`, the time the row was last refreshed and the age of
+    its last heartbeat in seconds, so callers can tell how old the view is.
+    """
+    now = now or datetime.utcnow()
+    with get_read_session() as db:
+        rows = db.execute(select(Client).order_by(Client.id)).scalars().all()
+        result = []
+        for c in rows:
+            hb_age = (now - c.last_heartbeat).total_seconds() if c.last_heartbeat else None
+            result.append({
+                "id": c.id,
+                "hostname": c.hostname,
+                "ip": c.ip,
+                "port": c.port,
+                "status": c.status,
+                "connected_at": _iso(c.connected_at),
+                "last_heartbeat": _iso(c.last_heartbeat),
+                "last_heartbeat_age_sec": round(hb_age, 1) if hb_age is not None else None,
+                "snapshot_updated_at": _iso(c.updated_at),
+                "stale": True,
+            })
+        return result
@@ -0,0 +1,71 @@
+"""Single-flight request coalescing for idempotent upstream reads.
+
+While a call for a key is in flight, further callers with the same key wait for that
+call's result instead of issuing their own. With several dashboards polling the same
+endpoints, upstream load stays at one call per key per poll interval.
+"""
+from __future__ import annotations
+
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    def __init__(self, max_labels: int = 256) -> None:
+        self.max_labels = max_labels
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        # счётчики по шаблону маршрута, а не по ключу: ключи с id растут без предела
+        self._counters: "OrderedDict[Hashable, Dict[str, int]]" = OrderedDict()
+        self.originated = 0
+        self.coalesced = 0
+
+    def _count(self, label: Hashable, field: str) -> None:
+        c = self._counters.get(label)
+        if c is None:
+            c = self._counters[label] = {"originated": 0, "coalesced": 0}
+            while len(self._counters) > self.max_labels:
+                self._counters.popitem(last=False)
+        else:
+            self._counters.move_to_end(label)
+        c[field] += 1
+        if field == "originated":
+            self.originated += 1
+        else:
+            self.coalesced += 1
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]], label: Hashable | None = None) -> Any:
+        """Run `fn` once for all concurrent callers of `key` and share its result or error.
+
+        The call runs as its own task, so a caller that disconnects does not cancel it
+        for the others waiting on the same key. Stats are kept per `label` (defaults to
+        the key); pass a route template when keys embed ids.
+        """
+        label = key if label is None else label
+        task = self._inflight.get(key)
+        if task is not None:
+            self._count(label, "coalesced")
+        else:
+            self._count(label, "originated")
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._forget(k, t))
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # пометить исключение как полученное, даже если все ожидающие уже ушли
+            task.exception()
+
+    def in_flight(self) -> int:
+        return len(self._inflight)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "originated": self.originated,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+            "keys": {str(k): dict(v) for k, v in self._counters.items()},
+        }
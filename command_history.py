@@ -0,0 +1,178 @@
+"""Locally served command history over `CommandLog`.
+
+Pages are keyset-paginated on `(created_at, id)` newest first, so a page costs the same
+however deep the cursor is. Full-text search over command, stdout and stderr uses an
+FTS5 table on SQLite and a GIN tsvector expression index on PostgreSQL; other backends
+(or a SQLite build without FTS5) fall back to a LIKE scan.
+
+Search sees the text stored on the row, so outputs spilled to the blob store (see
+`output_store`) are matched on their head+tail preview only: text from the middle of an
+output longer than CORE_OUTPUT_INLINE_LIMIT is not found. Indexing it would put the full
+text back into the database, which the blob store exists to avoid; raise the limit when
+whole outputs must be searchable.
+"""
+from __future__ import annotations
+
+import base64
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+from sqlalchemy import and_, or_, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer
+
+from .models import CommandLog
+from .output_store import output_meta
+
+
+FTS_TABLE = "command_logs_fts"
+MAX_PAGE = 500
+
+# Выражение должно совпадать с индексом, иначе Postgres не будет его использовать
+_PG_TSVECTOR = "to_tsvector('simple', coalesce(command, '') || ' ' || coalesce(stdout, '') || ' ' || coalesce(stderr, ''))"
+
+# Внешний контент: FTS хранит только индекс, текст остаётся в command_logs.
+# Связь по rowid, поэтому после VACUUM индекс нужно перестраивать (rebuild_search_index).
+_SQLITE_FTS_DDL = [
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(command, stdout, stderr, content='command_logs', content_rowid='rowid')",
+    f"""CREATE TRIGGER IF NOT EXISTS command_logs_fts_ai AFTER INSERT ON command_logs BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, command, stdout, stderr) VALUES (new.rowid, new.command, new.stdout, new.stderr);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS command_logs_fts_ad AFTER DELETE ON command_logs BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, command, stdout, stderr) VALUES ('delete', old.rowid, old.command, old.stdout, old.stderr);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS command_logs_fts_au AFTER UPDATE OF command, stdout, stderr ON command_logs BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, command, stdout, stderr) VALUES ('delete', old.rowid, old.command, old.stdout, old.stderr);
+        INSERT INTO {FTS_TABLE}(rowid, command, stdout, stderr) VALUES (new.rowid, new.command, new.stdout, new.stderr);
+    END""",
+]
+
+# Какой поиск доступен в текущей БД: "fts5", "tsvector" или None (LIKE)
+_search_backend: str | None = None
+
+
+def setup_history_schema(conn) -> str | None:
+    """Create the history indexes and the full-text index on an existing database.
+
+    `create_all` only builds indexes together with a new table, so the composite
+    indexes are created here with checkfirst for databases that predate them.
+    Runs on a sync connection (inside `run_sync` in lifespan).
+    """
+    global _search_backend
+    for idx in CommandLog.__table__.indexes:
+        idx.create(conn, checkfirst=True)
+
+    dialect = conn.dialect.name
+    _search_backend = None
+    if dialect == "sqlite":
+        exists = conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (FTS_TABLE,)
+        ).first()
+        try:
+            if not exists:
+                conn.exec_driver_sql(_SQLITE_FTS_DDL[0])
+                # заполняем индекс уже накопленными записями
+                conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+            for ddl in _SQLITE_FTS_DDL[1:]:
+                conn.exec_driver_sql(ddl)
+            _search_backend = "fts5"
+        except Exception as e:
+            print(f"⚠️ FTS5 недоступен, поиск по истории через LIKE: {e}")
+    elif dialect == "postgresql":
+        try:
+            with conn.begin_nested():
+                conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS ix_command_logs_fts ON command_logs USING gin ({_PG_TSVECTOR})")
+            _search_backend = "tsvector"
+        except Exception as e:
+            print(f"⚠️ Не удалось создать tsvector-индекс, поиск по истории через LIKE: {e}")
+    return _search_backend
+
+
+def rebuild_search_index(conn) -> None:
+    """Re-sync the SQLite FTS index with command_logs (needed after VACUUM renumbers rowids)."""
+    if _search_backend == "fts5":
+        conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def encode_cursor(created_at: datetime, command_id: str) -> str:
+    raw = f"{created_at.isoformat()}|{command_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, command_id = raw.split("|", 1)
+        return datetime.fromisoformat(ts), command_id
+    except Exception:
+        raise ValueError("invalid cursor")
+
+
+def _fts5_query(q: str) -> str:
+    # каждое слово в кавычках: пользовательский ввод не интерпретируется как синтаксис FTS5
+    return " ".join('"' + tok.replace('"', '""') + '"' for tok in q.split())
+
+
+def _search_clause(q: str):
+    if _search_backend == "fts5":
+        return text(f"command_logs.rowid IN (SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :fts_q)").bindparams(fts_q=_fts5_query(q))
+    if _search_backend == "tsvector":
+        return text(f"{_PG_TSVECTOR} @@ plainto_tsquery('simple', :fts_q)").bindparams(fts_q=q)
+    pattern = f"%{q}%"
+    return or_(CommandLog.command.ilike(pattern), CommandLog.stdout.ilike(pattern), CommandLog.stderr.ilike(pattern))
+
+
+def serialize_log(log: CommandLog) -> Dict[str, Any]:
+    return {
+        "id": log.id,
+        "client_id": log.client_id,
+        "command": log.command,
+        "status": log.status,
+        "exit_code": log.exit_code,
+        # превью; полный вывод — /api/commands/log/{id}
+        "stdout": log.stdout,
+        "stderr": log.stderr,
+        **output_meta(log),
+        "created_at": log.created_at.isoformat() if log.created_at else None,
+        "finished_at": log.finished_at.isoformat() if log.finished_at else None,
+    }
+
+
+async def query_history(
+    db: AsyncSession,
+    *,
+    client_id: str | None = None,
+    status: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    q: str | None = None,
+    cursor: str | None = None,
+    limit: int = 50,
+) -> Dict[str, Any]:
+    """One page of CommandLog, newest first, plus the cursor for the next page (or None)."""
+    limit = max(1, min(limit, MAX_PAGE))
+    stmt = select(CommandLog).options(undefer(CommandLog.stdout), undefer(CommandLog.stderr))
+    if client_id:
+        stmt = stmt.where(CommandLog.client_id == client_id)
+    if status:
+        stmt = stmt.where(CommandLog.status == status)
+    if since:
+        stmt = stmt.where(CommandLog.created_at >= since)
+    if until:
+        stmt = stmt.where(CommandLog.created_at < until)
+    if q and q.strip():
+        stmt = stmt.where(_search_clause(q.strip()))
+    if cursor:
+        c_ts, c_id = decode_cursor(cursor)
+        stmt = stmt.where(or_(
+            CommandLog.created_at < c_ts,
+            and_(CommandLog.created_at == c_ts, CommandLog.id < c_id),
+        ))
+    # берём на одну запись больше, чтобы понять, есть ли следующая страница
+    stmt = stmt.order_by(CommandLog.created_at.desc(), CommandLog.id.desc()).limit(limit + 1)
+    rows: List[CommandLog] = list((await db.execute(stmt)).scalars().all())
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return {"items": [serialize_log(r) for r in rows], "next_cursor": next_cursor, "search": _search_backend if q else None}
@@ -0,0 +1,256 @@
+"""Asynchronous command execution with streamed, resumable output.
+
+`run_streaming` asks client_manager for a streamed result (NDJSON lines of
+`{"stream": "stdout"|"stderr", "data": "..."}` followed by a final object carrying
+`success`/`exit_code`). Older client_manager builds that answer with one JSON document
+are handled too: the whole result becomes one chunk per stream.
+
+Chunks land in an in-memory `OutputStream`. Each chunk has a sequence offset, and SSE
+readers can resume from any offset still in the buffer. The same text is appended to
+the `CommandLog` row through the write-behind queue every `flush_interval`, so the row
+shows live progress. When the command finishes, the full output goes through
+`output_store.set_output` like any other command.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Tuple
+
+from fastapi import HTTPException
+
+from .models import CommandLog
+from .output_store import INLINE_LIMIT, STREAMS, set_output
+
+
+MAX_OUTPUT = int(os.getenv("CORE_STREAM_MAX_OUTPUT", str(32 * 1024 * 1024)))  # символов на поток
+MAX_BUFFERED_CHUNKS = int(os.getenv("CORE_STREAM_BUFFER_CHUNKS", "10000"))
+RETAIN_SEC = float(os.getenv("CORE_STREAM_RETAIN_SEC", "300"))
+
+Chunk = Tuple[int, str, str]  # (offset, stream, data)
+
+
+class OutputStream:
+    """Output of one running command: resumable chunk buffer plus the full text."""
+
+    def __init__(self, command_id: str, client_id: str, max_chunks: int = MAX_BUFFERED_CHUNKS) -> None:
+        self.command_id = command_id
+        self.client_id = client_id
+        self.chunks: Deque[Chunk] = deque(maxlen=max_chunks)
+        self.next_offset = 0
+        self._parts: Dict[str, List[str]] = {s: [] for s in STREAMS}
+        self.sizes: Dict[str, int] = {s: 0 for s in STREAMS}
+        self.truncated = False
+        self.done = False
+        self.status = "running"
+        self.exit_code: int | None = None
+        self.finished_at: float | None = None
+        self._changed = asyncio.Event()
+
+    @property
+    def first_offset(self) -> int:
+        return self.chunks[0][0] if self.chunks else self.next_offset
+
+    def append(self, stream: str, data: str) -> None:
+        if stream not in STREAMS:
+            stream = "stdout"
+        if not data:
+            return
+        room = MAX_OUTPUT - self.sizes[stream]
+        if room <= 0:
+            self.truncated = True
+            return
+        if len(data) > room:
+            data = data[:room]
+            self.truncated = True
+        self.chunks.append((self.next_offset, stream, data))
+        self.next_offset += 1
+        self._parts[stream].append(data)
+        self.sizes[stream] += len(data)
+        self._wake()
+
+    def finish(self, status: str, exit_code: int | None) -> None:
+        self.status = status
+        self.exit_code = exit_code
+        self.done = True
+        self.finished_at = time.monotonic()
+        self._wake()
+
+    def _wake(self) -> None:
+        # читатели ждут текущее событие; для следующих изменений — новое
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def full_text(self, stream: str) -> str | None:
+        return "".join(self._parts[stream]) if self._parts[stream] else None
+
+    def since(self, offset: int) -> List[Chunk]:
+        if offset >= self.next_offset:
+            return []
+        return [c for c in self.chunks if c[0] >= offset]
+
+    async def wait(self, offset: int, timeout: float) -> bool:
+        """Wait until a chunk at `offset` or later exists or the command is done."""
+        if self.done or offset < self.next_offset:
+            return True
+        changed = self._changed
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+class CommandStreams:
+    """Registry of live and recently finished output streams."""
+
+    def __init__(self, retain_sec: float = RETAIN_SEC) -> None:
+        self.retain_sec = retain_sec
+        self._streams: Dict[str, OutputStream] = {}
+
+    def create(self, command_id: str, client_id: str) -> OutputStream:
+        self._gc()
+        out = OutputStream(command_id, client_id)
+        self._streams[command_id] = out
+        return out
+
+    def get(self, command_id: str) -> OutputStream | None:
+        return self._streams.get(command_id)
+
+    def _gc(self) -> None:
+        now = time.monotonic()
+        for cid in [c for c, o in self._streams.items() if o.done and now - o.finished_at > self.retain_sec]:
+            del self._streams[cid]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "streams": len(self._streams),
+            "running": sum(1 for o in self._streams.values() if not o.done),
+        }
+
+
+def _append_op(command_id: str, stream: str, text: str, size: int):
+    def _op(db):
+        log = db.get(CommandLog, command_id)
+        if log is None:
+            return
+        # во время выполнения в строке живёт начало вывода и текущий размер; итог запишет _final_op
+        current = getattr(log, stream) or ""
+        if len(current) < INLINE_LIMIT:
+            setattr(log, stream, (current + text)[:INLINE_LIMIT])
+        setattr(log, f"{stream}_size", size)
+        log.status = "running"
+    return _op
+
+
+def _final_op(out: OutputStream, finished_at: datetime):
+    outputs = {s: out.full_text(s) for s in STREAMS}
+
+    def _op(db):
+        log = db.get(CommandLog, out.command_id)
+        if log is None:
+            return
+        for s in STREAMS:
+            set_output(db, log, s, outputs[s])
+        log.status = out.status
+        log.exit_code = out.exit_code
+        log.finished_at = finished_at
+    return _op
+
+
+async def run_streaming(
+    upstream,
+    writes,
+    out: OutputStream,
+    payload: Dict[str, Any],
+    flush_interval: float = 0.5,
+    read_timeout: float | None = 300.0,
+    on_done: Callable[[OutputStream], None] | None = None,
+) -> None:
+    pending: Dict[str, List[str]] = {s: [] for s in STREAMS}
+    last_flush = time.monotonic()
+
+    async def _flush() -> None:
+        nonlocal last_flush
+        for s in STREAMS:
+            if pending[s]:
+                text = "".join(pending[s])
+                pending[s].clear()
+                await writes.submit_async(_append_op(out.command_id, s, text, out.sizes[s]))
+        last_flush = time.monotonic()
+
+    async def _chunk(stream: str, data: Any) -> None:
+        if data is None:
+            return
+        data = data if isinstance(data, str) else str(data)
+        before = out.sizes.get(stream, 0)
+        out.append(stream, data)
+        if stream in pending and out.sizes[stream] > before:
+            pending[stream].append(data[: out.sizes[stream] - before])
+        if time.monotonic() - last_flush >= flush_interval:
+            await _flush()
+
+    final: Dict[str, Any] = {}
+    try:
+        resp = await upstream.open_stream(
+            "POST", f"/api/commands/{out.client_id}", body={**payload, "stream": True},
+            headers={"X-Command-Id": out.command_id, "Accept": "application/x-ndjson, application/json"},
+            timeout=read_timeout,
+        )
+        try:
+            if resp.status_code >= 300:
+                body = (await resp.aread()).decode("utf-8", errors="replace")
+                raise HTTPException(status_code=resp.status_code, detail=body or "Upstream error")
+            if "ndjson" in resp.headers.get("content-type", ""):
+                async for line in resp.aiter_lines():
+                    if not line.strip():
+                        continue
+                    try:
+                        msg = json.loads(line)
+                    except ValueError:
+                        await _chunk("stdout", line + "\n")
+                        continue
+                    if isinstance(msg, dict) and "data" in msg:
+                        await _chunk(msg.get("stream") or "stdout", msg["data"])
+                    elif isinstance(msg, dict):
+                        final = msg
+            else:
+                # client_manager без потокового режима: один JSON с итогом
+                raw = await resp.aread()
+                data = json.loads(raw) if raw else {}
+                final = data if isinstance(data, dict) else {"result": data}
+                await _chunk("stdout", final.get("result"))
+                await _chunk("stderr", final.get("error"))
+        finally:
+            await resp.aclose()
+        success = final.get("success")
+        if success is None:
+            success = final.get("exit_code") == 0
+        status = "success" if success else "failed"
+        exit_code = final.get("exit_code")
+    except HTTPException as he:
+        await _chunk("stderr", str(he.detail))
+        status, exit_code = "error", None
+    except asyncio.CancelledError:
+        # остановка сервиса: команда не должна остаться в логе со статусом running
+        await _chunk("stderr", "cancelled: core service is shutting down")
+        await _finish(out, writes, _flush, "error", None, on_done)
+        raise
+    except Exception as e:
+        await _chunk("stderr", f"{type(e).__name__}: {e}")
+        status, exit_code = "error", None
+
+    await _finish(out, writes, _flush, status, exit_code, on_done)
+
+
+async def _finish(out: OutputStream, writes, flush: Callable[[], Awaitable[None]], status: str, exit_code: Any,
+                  on_done: Callable[[OutputStream], None] | None) -> None:
+    await flush()
+    out.finish(status, exit_code)
+    await writes.submit_async(_final_op(out, datetime.utcnow()))
+    if on_done:
+        on_done(out)
@@ -1,23 +1,73 @@
 from __future__ import annotations
 
 import os
-from contextlib import contextmanager
-from typing import Iterator
+from contextlib import contextmanager, asynccontextmanager
+from typing import AsyncIterator, Iterator
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, scoped_session
 
 
 DB_URL = os.getenv("CORE_DB_URL", f"sqlite:///" + os.path.join(os.path.dirname(__file__), "core_admin.db"))
 
+# CORE_DB_PROFILE=production включает тюнинг SQLite (WAL, busy timeout, mmap, ...)
+# и отдельные read-only движки для чтения, чтобы дашборд не ждал писателя.
+DB_PROFILE = os.getenv("CORE_DB_PROFILE", "default").lower()
+
+IS_SQLITE = DB_URL.startswith("sqlite")
+SQLITE_TUNED = IS_SQLITE and DB_PROFILE == "production" and ":memory:" not in DB_URL
+
+SQLITE_PRAGMAS = {
+    "busy_timeout": int(os.getenv("CORE_SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "mmap_size": int(os.getenv("CORE_SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    # отрицательное значение — размер в KiB
+    "cache_size": int(os.getenv("CORE_SQLITE_CACHE_SIZE", "-65536")),
+    "temp_store": "MEMORY",
+}
+
+
+def _apply_pragmas(dbapi_conn, writer: bool) -> None:
+    cur = dbapi_conn.cursor()
+    try:
+        if writer:
+            cur.execute("PRAGMA journal_mode=WAL")
+            cur.execute("PRAGMA synchronous=NORMAL")
+        else:
+            cur.execute("PRAGMA query_only=1")
+        for name, value in SQLITE_PRAGMAS.items():
+            cur.execute(f"PRAGMA {name}={value}")
+    finally:
+        cur.close()
+
+
+def _tune(eng, writer: bool) -> None:
+    if SQLITE_TUNED:
+        event.listen(eng, "connect", lambda conn, _rec: _apply_pragmas(conn, writer))
+
+
+def _readonly_url(url: str) -> str:
+    """sqlite:///path -> sqlite:///file:path?mode=ro&uri=true (same driver prefix)."""
+    prefix, _, path = url.partition(":///")
+    return f"{prefix}:///file:{path}?mode=ro&uri=true"
+
+
 engine = create_engine(
     DB_URL,
     echo=False,
     future=True,
-    connect_args={"check_same_thread": False} if DB_URL.startswith("sqlite") else {},
+    connect_args={"check_same_thread": False} if IS_SQLITE else {},
 )
+_tune(engine, writer=True)
+
+if SQLITE_TUNED:
+    read_engine = create_engine(_readonly_url(DB_URL), echo=False, future=True, connect_args={"check_same_thread": False})
+    _tune(read_engine, writer=False)
+else:
+    read_engine = engine
 
 SessionLocal = scoped_session(sessionmaker(bind=engine, autocommit=False, autoflush=False, future=True))
+ReadSessionLocal = sessionmaker(bind=read_engine, autocommit=False, autoflush=False, future=True)
 
 
 @contextmanager
@@ -33,3 +83,119 @@ def get_session() -> Iterator:
         session.close()
 
 
+@contextmanager
+def get_read_session() -> Iterator:
+    """Session for read-only queries; on a tuned SQLite it never takes the write lock."""
+    session = ReadSessionLocal()
+    try:
+        yield session
+    finally:
+        session.rollback()
+        session.close()
+
+
+def _async_url(url: str) -> str:
+    """Map the sync CORE_DB_URL to its asyncio driver (aiosqlite / asyncpg)."""
+    scheme, sep, rest = url.partition("://")
+    base = scheme.split("+", 1)[0]
+    if base == "sqlite":
+        return f"sqlite+aiosqlite{sep}{rest}"
+    if base in ("postgresql", "postgres"):
+        return f"postgresql+asyncpg{sep}{rest}"
+    return url
+
+
+def _pool_kwargs(url: str) -> dict:
+    if url.startswith("sqlite") and ":memory:" in url:
+        return {}
+    return {
+        "pool_size": int(os.getenv("CORE_DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.getenv("CORE_DB_MAX_OVERFLOW", "20")),
+        "pool_timeout": float(os.getenv("CORE_DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("CORE_DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": not url.startswith("sqlite"),
+    }
+
+
+ASYNC_DB_URL = os.getenv("CORE_ASYNC_DB_URL") or _async_url(DB_URL)
+
+# Асинхронный движок для async-маршрутов: не блокирует event loop и не занимает default thread pool
+async_engine = create_async_engine(ASYNC_DB_URL, echo=False, **_pool_kwargs(ASYNC_DB_URL))
+_tune(async_engine.sync_engine, writer=True)
+
+if SQLITE_TUNED and ASYNC_DB_URL.startswith("sqlite"):
+    _ro_url = _readonly_url(ASYNC_DB_URL)
+    async_read_engine = create_async_engine(_ro_url, echo=False, **_pool_kwargs(_ro_url))
+    _tune(async_read_engine.sync_engine, writer=False)
+else:
+    async_read_engine = async_engine
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+AsyncReadSessionLocal = async_sessionmaker(async_read_engine, autoflush=False, expire_on_commit=False)
+
+
+@asynccontextmanager
+async def get_async_session() -> AsyncIterator[AsyncSession]:
+    session = AsyncSessionLocal()
+    try:
+        yield session
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
+
+
+@asynccontextmanager
+async def get_async_read_session() -> AsyncIterator[AsyncSession]:
+    session = AsyncReadSessionLocal()
+    try:
+        yield session
+    finally:
+        await session.rollback()
+        await session.close()
+
+
+def add_missing_columns(conn, table) -> list:
+    """ALTER TABLE ... ADD COLUMN for model columns absent from an existing table.
+
+    `create_all` never alters tables that already exist; new nullable columns are added
+    here instead. Runs on a sync connection (inside `run_sync` in lifespan).
+    """
+    from sqlalchemy import inspect
+
+    insp = inspect(conn)
+    if not insp.has_table(table.name):
+        return []
+    present = {c["name"] for c in insp.get_columns(table.name)}
+    added = []
+    for col in table.columns:
+        if col.name in present:
+            continue
+        ddl_type = col.type.compile(dialect=conn.dialect)
+        conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {col.name} {ddl_type}")
+        added.append(col.name)
+    return added
+
+
+def sqlite_housekeeping(optimize: bool = True) -> dict:
+    """Checkpoint the WAL back into the main file and refresh planner statistics.
+
+    Without periodic checkpoints under constant reads the -wal file keeps growing.
+    No-op unless the production SQLite profile is active.
+    """
+    if not SQLITE_TUNED:
+        return {}
+    with engine.connect() as conn:
+        busy, log_frames, checkpointed = conn.execute(text("PRAGMA wal_checkpoint(TRUNCATE)")).one()
+        if optimize:
+            conn.execute(text("PRAGMA optimize"))
+        conn.commit()
+    return {"busy": busy, "log_frames": log_frames, "checkpointed": checkpointed}
+
+
+async def dispose_engines() -> None:
+    await async_engine.dispose()
+    if async_read_engine is not async_engine:
+        await async_read_engine.dispose()
@@ -0,0 +1,161 @@
+"""In-process event bus behind the dashboard's server-push channel (/api/events).
+
+One producer task polls the sources and publishes changes; every subscriber gets the same
+pre-encoded SSE frames from its own bounded queue. Upstream and orchestrator load
+therefore does not depend on the number of open dashboards. The producer only runs while
+someone is subscribed, and stops `idle_timeout` seconds after the last one leaves.
+
+Topics that represent state ("services", "clients", "enrollments") also keep their
+latest full snapshot, which is replayed to each new subscriber before live events.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, NamedTuple
+
+
+class Event(NamedTuple):
+    seq: int
+    type: str
+    frame: str  # готовый SSE-кадр, кодируется один раз на всех подписчиков
+
+
+_CLOSED = Event(0, "closed", "")
+
+
+def _frame(seq: int, type_: str, data: Any) -> str:
+    return f"id: {seq}\nevent: {type_}\ndata: {json.dumps(data, default=str, ensure_ascii=False)}\n\n"
+
+
+class Subscription:
+    def __init__(self, queue_size: int) -> None:
+        self.queue: "asyncio.Queue[Event]" = asyncio.Queue(maxsize=queue_size)
+        self.closed = False
+
+    async def get(self, timeout: float) -> Event | None:
+        """Next event, None on timeout (time for a keep-alive), `_CLOSED` when dropped."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def _close(self) -> None:
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(_CLOSED)
+
+
+class EventBus:
+    def __init__(
+        self,
+        producer: Callable[["EventBus"], Awaitable[None]] | None = None,
+        queue_size: int = 256,
+        idle_timeout: float = 30.0,
+    ) -> None:
+        self._producer = producer
+        self.queue_size = queue_size
+        self.idle_timeout = idle_timeout
+        self._subs: set[Subscription] = set()
+        self._snapshots: Dict[str, Event] = {}
+        self._seq = 0
+        self._task: asyncio.Task | None = None
+        self._idle: asyncio.TimerHandle | None = None
+        self.published = 0
+        self.dropped = 0
+
+    def publish(self, type_: str, data: Any, snapshot: Any = None) -> None:
+        """Send an event to all subscribers; `snapshot` replaces the replayed state of the topic."""
+        self._seq += 1
+        ev = Event(self._seq, type_, _frame(self._seq, type_, data))
+        if snapshot is not None:
+            self._snapshots[type_] = Event(self._seq, type_, _frame(self._seq, type_, snapshot))
+        self.published += 1
+        for sub in list(self._subs):
+            try:
+                sub.queue.put_nowait(ev)
+            except asyncio.QueueFull:
+                # медленный подписчик: отключаем, EventSource переподключится и получит свежие снапшоты
+                self._subs.discard(sub)
+                sub._close()
+                self.dropped += 1
+
+    @asynccontextmanager
+    async def subscribe(self) -> AsyncIterator[Subscription]:
+        sub = Subscription(self.queue_size)
+        for ev in self._snapshots.values():
+            sub.queue.put_nowait(ev)
+        self._subs.add(sub)
+        self._ensure_producer()
+        try:
+            yield sub
+        finally:
+            self._subs.discard(sub)
+            if not self._subs:
+                self._schedule_idle_stop()
+
+    def _ensure_producer(self) -> None:
+        if self._idle:
+            self._idle.cancel()
+            self._idle = None
+        if self._producer and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._producer(self))
+
+    def _schedule_idle_stop(self) -> None:
+        if self._idle:
+            self._idle.cancel()
+        self._idle = asyncio.get_running_loop().call_later(self.idle_timeout, self._stop_if_idle)
+
+    def _stop_if_idle(self) -> None:
+        self._idle = None
+        if not self._subs and self._task:
+            self._task.cancel()
+            self._task = None
+            # без продюсера снапшоты устаревают; новый подписчик дождётся свежих
+            self._snapshots.clear()
+
+    async def close(self) -> None:
+        if self._idle:
+            self._idle.cancel()
+            self._idle = None
+        for sub in list(self._subs):
+            sub._close()
+        self._subs.clear()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "subscribers": len(self._subs),
+            "producer_running": bool(self._task and not self._task.done()),
+            "published": self.published,
+            "dropped_subscribers": self.dropped,
+            "last_seq": self._seq,
+            "snapshots": sorted(self._snapshots),
+        }
+
+
+def diff_by_id(prev: Dict[str, Any], items: list, fields: tuple) -> tuple[Dict[str, Any], list, list]:
+    """Index `items` by id and return (index, upserted items, removed ids) against `prev`.
+
+    Only `fields` are compared, so volatile fields (heartbeats) do not produce events.
+    """
+    current: Dict[str, Any] = {}
+    upserted = []
+    for item in items:
+        if not isinstance(item, dict) or not item.get("id"):
+            continue
+        key = str(item["id"])
+        sig = tuple(item.get(f) for f in fields)
+        current[key] = sig
+        if prev.get(key) != sig:
+            upserted.append(item)
+    removed = [k for k in prev if k not in current]
+    return current, upserted, removed
@@ -0,0 +1,49 @@
+"""Monotonic, lexicographically sortable IDs (ULID layout).
+
+48-bit millisecond timestamp + 80 random bits, Crockford base32, 26 characters. Within
+one millisecond the random part is incremented instead of redrawn, so IDs generated by
+this process are strictly increasing and string order equals creation order, which keeps
+them cheap to insert into the (created_at, id) indexes and easy to paginate by.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+
+_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_RAND_MAX = (1 << 80) - 1
+
+_lock = threading.Lock()
+_last_ms = 0
+_last_rand = 0
+
+
+def _encode(value: int, length: int) -> str:
+    out = []
+    for _ in range(length):
+        value, rem = divmod(value, 32)
+        out.append(_ALPHABET[rem])
+    return "".join(reversed(out))
+
+
+def ulid() -> str:
+    global _last_ms, _last_rand
+    with _lock:
+        ms = time.time_ns() // 1_000_000
+        if ms <= _last_ms:
+            # тот же миллисекундный тик (или часы ушли назад) — продолжаем последовательность
+            ms = _last_ms
+            rand = _last_rand + 1
+            if rand > _RAND_MAX:
+                ms += 1
+                rand = int.from_bytes(os.urandom(10), "big") >> 1
+        else:
+            # старший бит обнулён: запас на инкременты внутри одной миллисекунды
+            rand = int.from_bytes(os.urandom(10), "big") >> 1
+        _last_ms, _last_rand = ms, rand
+    return _encode(ms, 10) + _encode(rand, 16)
+
+
+def new_command_id() -> str:
+    return f"cmd_{ulid()}"
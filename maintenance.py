@@ -0,0 +1,359 @@
+"""Background database maintenance: retention, daily rollups, blob GC, VACUUM/ANALYZE.
+
+Jobs run on a single asyncio scheduler task inside the admin app, one at a time, each on
+its own interval. Their last run (time, duration, result or error) is persisted in
+`maintenance_runs`, so intervals survive restarts and a weekly VACUUM still happens in a
+process that is restarted daily.
+
+Deletes go in small chunks, each in its own short transaction, with a pause between
+chunks so write-behind batches can take the write lock in between.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List
+
+from sqlalchemy import delete, exists, func, or_, select, text
+
+from .db import engine, get_session, get_read_session, sqlite_housekeeping, SQLITE_TUNED
+from .models import (
+    Client, CommandDailyRollup, CommandLog, CommandOutputBlob, MaintenanceRun,
+    PluginInstallJob, TerminalAudit,
+)
+from .command_history import rebuild_search_index
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+# Сколько дней хранить сырые строки; 0 — хранить всегда
+RETENTION_DAYS = {
+    "command_logs": _env_int("CORE_RETENTION_COMMAND_LOGS_DAYS", 30),
+    "terminal_audit": _env_int("CORE_RETENTION_TERMINAL_AUDIT_DAYS", 90),
+    "plugin_install_jobs": _env_int("CORE_RETENTION_PLUGIN_INSTALL_JOBS_DAYS", 30),
+}
+_RETENTION_MODELS = {
+    "command_logs": (CommandLog, CommandLog.id, CommandLog.created_at),
+    "terminal_audit": (TerminalAudit, TerminalAudit.id, TerminalAudit.created_at),
+    "plugin_install_jobs": (PluginInstallJob, PluginInstallJob.id, PluginInstallJob.created_at),
+}
+
+DELETE_CHUNK = _env_int("CORE_MAINTENANCE_DELETE_CHUNK", 500)
+DELETE_PAUSE = float(os.getenv("CORE_MAINTENANCE_DELETE_PAUSE", "0.05"))
+# Статусы последних дней ещё могут смениться (queued -> success), их роллап пересчитывается
+ROLLUP_REFRESH_DAYS = 2
+FAILED_STATUSES = ("failed", "error", "timeout")
+# Свежие блобы не трогаем: строка, которая на них сошлётся, может быть ещё в очереди записи
+BLOB_GC_GRACE = timedelta(minutes=10)
+
+_SIZE_TABLES = [CommandLog, CommandOutputBlob, CommandDailyRollup, TerminalAudit, PluginInstallJob, Client]
+
+
+def _day_start(day: date) -> datetime:
+    return datetime(day.year, day.month, day.day)
+
+
+def rollup_commands(today: date | None = None) -> Dict[str, Any]:
+    """Recompute daily (client, status) counts for every complete day not yet rolled up."""
+    today = today or datetime.utcnow().date()
+    with get_session() as db:
+        last = db.execute(select(func.max(CommandDailyRollup.day))).scalar()
+        if last is None:
+            first = db.execute(select(func.min(CommandLog.created_at))).scalar()
+            if first is None:
+                return {"days": 0}
+            start = first.date()
+        else:
+            start = last - timedelta(days=ROLLUP_REFRESH_DAYS - 1)
+    keep_days = RETENTION_DAYS["command_logs"]
+    if last is not None and keep_days > 0:
+        # ретенция режет по now - keep_days, так что день today - keep_days уже мог быть удалён частично:
+        # пересчёт по неполным сырым строкам затёр бы сохранённый роллап. Первый полный день — следующий.
+        # Первый роллап (last is None) идёт с самой ранней строки: ретенция до него ещё не запускалась
+        start = max(start, today - timedelta(days=keep_days - 1))
+    days = 0
+    day = start
+    while day < today:
+        lo = _day_start(day)
+        with get_session() as db:
+            counts: Dict[tuple, int] = {}
+            for client_id, status, n in db.execute(
+                select(CommandLog.client_id, CommandLog.status, func.count())
+                .where(CommandLog.created_at >= lo, CommandLog.created_at < lo + timedelta(days=1))
+                .group_by(CommandLog.client_id, CommandLog.status)
+            ):
+                key = (client_id, status or "unknown")
+                counts[key] = counts.get(key, 0) + n
+            db.execute(delete(CommandDailyRollup).where(CommandDailyRollup.day == day))
+            db.add_all([CommandDailyRollup(day=day, client_id=c, status=s, count=n) for (c, s), n in counts.items()])
+        day += timedelta(days=1)
+        days += 1
+    return {"days": days, "through": (today - timedelta(days=1)).isoformat()}
+
+
+def _delete_chunked(model, pk, where) -> int:
+    total = 0
+    while True:
+        with get_session() as db:
+            ids = db.execute(select(pk).where(where).limit(DELETE_CHUNK)).scalars().all()
+            if not ids:
+                return total
+            db.execute(delete(model).where(pk.in_(ids)))
+        total += len(ids)
+        time.sleep(DELETE_PAUSE)
+
+
+def apply_retention(now: datetime | None = None) -> Dict[str, int]:
+    now = now or datetime.utcnow()
+    deleted: Dict[str, int] = {}
+    for name, days in RETENTION_DAYS.items():
+        if days <= 0:
+            continue
+        model, pk, created = _RETENTION_MODELS[name]
+        cutoff = now - timedelta(days=days)
+        if name == "command_logs":
+            # удаляем только дни, уже попавшие в роллап (он считается по полным суткам)
+            cutoff = min(cutoff, _day_start(now.date()))
+        deleted[name] = _delete_chunked(model, pk, created < cutoff)
+    return deleted
+
+
+def gc_output_blobs(now: datetime | None = None) -> int:
+    """Delete command output blobs no longer referenced by any command_logs row."""
+    cutoff = (now or datetime.utcnow()) - BLOB_GC_GRACE
+    unreferenced = ~exists().where(or_(
+        CommandLog.stdout_blob == CommandOutputBlob.digest,
+        CommandLog.stderr_blob == CommandOutputBlob.digest,
+    ))
+    return _delete_chunked(
+        CommandOutputBlob, CommandOutputBlob.digest,
+        (CommandOutputBlob.created_at < cutoff) & unreferenced,
+    )
+
+
+def analyze() -> None:
+    dialect = engine.dialect.name
+    with engine.connect() as conn:
+        if dialect == "sqlite":
+            conn.exec_driver_sql("PRAGMA optimize")
+        elif dialect == "postgresql":
+            conn.exec_driver_sql("ANALYZE " + ", ".join(t.__tablename__ for t in _SIZE_TABLES))
+        conn.commit()
+
+
+def run_retention() -> Dict[str, Any]:
+    """Rollup first, so expired command rows are already summarised when they go."""
+    result: Dict[str, Any] = {"rollup": rollup_commands()}
+    result["deleted"] = apply_retention()
+    result["orphan_blobs_deleted"] = gc_output_blobs()
+    analyze()
+    return result
+
+
+def vacuum() -> Dict[str, Any]:
+    """Reclaim space freed by retention. Takes the whole database on SQLite — run exclusively."""
+    dialect = engine.dialect.name
+    started = time.perf_counter()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if dialect == "sqlite":
+            conn.exec_driver_sql("VACUUM")
+            # VACUUM может перенумеровать rowid, а FTS с внешним контентом на них ссылается
+            rebuild_search_index(conn)
+            conn.exec_driver_sql("PRAGMA optimize")
+        elif dialect == "postgresql":
+            conn.exec_driver_sql("VACUUM (ANALYZE)")
+        else:
+            return {"skipped": dialect}
+    return {"seconds": round(time.perf_counter() - started, 2)}
+
+
+def table_sizes() -> Dict[str, Any]:
+    dialect = engine.dialect.name
+    names = [t.__tablename__ for t in _SIZE_TABLES]
+    out: Dict[str, Any] = {"tables": {}}
+    with get_read_session() as db:
+        for t in _SIZE_TABLES:
+            out["tables"][t.__tablename__] = {"rows": db.execute(select(func.count()).select_from(t)).scalar()}
+        if dialect == "sqlite":
+            page_size = db.execute(text("PRAGMA page_size")).scalar()
+            out["database_bytes"] = db.execute(text("PRAGMA page_count")).scalar() * page_size
+            out["free_bytes"] = db.execute(text("PRAGMA freelist_count")).scalar() * page_size
+            try:
+                # dbstat есть не во всех сборках SQLite; размер индексов считаем вместе с таблицей
+                sizes = dict(db.execute(text("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name")).all())
+                index_owner = dict(db.execute(text("SELECT name, tbl_name FROM sqlite_master WHERE type='index'")).all())
+                for obj, size in sizes.items():
+                    owner = index_owner.get(obj, obj)
+                    if owner in out["tables"]:
+                        out["tables"][owner]["bytes"] = out["tables"][owner].get("bytes", 0) + size
+            except Exception:
+                pass
+        elif dialect == "postgresql":
+            out["database_bytes"] = db.execute(text("SELECT pg_database_size(current_database())")).scalar()
+            for name in names:
+                out["tables"][name]["bytes"] = db.execute(text("SELECT pg_total_relation_size(:t)"), {"t": name}).scalar()
+    return out
+
+
+def read_daily_rollups(client_id: str | None = None, since: date | None = None, until: date | None = None) -> List[Dict[str, Any]]:
+    """Daily totals per client with per-status counts and the failure rate."""
+    stmt = select(CommandDailyRollup).order_by(CommandDailyRollup.day.desc(), CommandDailyRollup.client_id)
+    if client_id:
+        stmt = stmt.where(CommandDailyRollup.client_id == client_id)
+    if since:
+        stmt = stmt.where(CommandDailyRollup.day >= since)
+    if until:
+        stmt = stmt.where(CommandDailyRollup.day < until)
+    days: Dict[tuple, Dict[str, Any]] = {}
+    with get_read_session() as db:
+        for r in db.execute(stmt).scalars():
+            item = days.setdefault((r.day, r.client_id), {
+                "day": r.day.isoformat(), "client_id": r.client_id, "total": 0, "failed": 0, "by_status": {},
+            })
+            item["by_status"][r.status] = r.count
+            item["total"] += r.count
+            if r.status in FAILED_STATUSES:
+                item["failed"] += r.count
+    for item in days.values():
+        item["failure_rate"] = round(item["failed"] / item["total"], 4) if item["total"] else 0.0
+    return list(days.values())
+
+
+class _Job:
+    def __init__(self, name: str, interval: float, fn: Callable[[], Any], exclusive: bool) -> None:
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self.exclusive = exclusive
+        self.next_at = datetime.utcnow()
+        self.last_run_at: datetime | None = None
+        self.duration_ms: float | None = None
+        self.result: Any = None
+        self.error: str | None = None
+        self.running = False
+
+
+class MaintenanceScheduler:
+    def __init__(self, writes=None, initial_delay: float = 60.0) -> None:
+        # exclusive-задачи выполняются в потоке write-behind очереди, между батчами
+        self._writes = writes
+        self.initial_delay = initial_delay
+        self.jobs: Dict[str, _Job] = {}
+        self._task: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+
+    def add(self, name: str, interval: float, fn: Callable[[], Any], exclusive: bool = False) -> None:
+        if interval > 0:
+            self.jobs[name] = _Job(name, interval, fn, exclusive)
+
+    def _load_last_runs(self) -> Dict[str, MaintenanceRun]:
+        with get_read_session() as db:
+            return {r.job: r for r in db.execute(select(MaintenanceRun)).scalars()}
+
+    def _save_run(self, job: _Job) -> None:
+        with get_session() as db:
+            db.merge(MaintenanceRun(
+                job=job.name, last_run_at=job.last_run_at, duration_ms=job.duration_ms,
+                result=job.result, error=job.error,
+            ))
+
+    async def start(self) -> None:
+        now = datetime.utcnow()
+        try:
+            runs = await asyncio.to_thread(self._load_last_runs)
+        except Exception:
+            runs = {}
+        for job in self.jobs.values():
+            run = runs.get(job.name)
+            earliest = now + timedelta(seconds=self.initial_delay)
+            if run and run.last_run_at:
+                job.last_run_at, job.duration_ms = run.last_run_at, run.duration_ms
+                job.result, job.error = run.result, run.error
+                job.next_at = max(run.last_run_at + timedelta(seconds=job.interval), earliest)
+            else:
+                job.next_at = earliest
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self) -> None:
+        while self.jobs:
+            job = min(self.jobs.values(), key=lambda j: j.next_at)
+            delay = (job.next_at - datetime.utcnow()).total_seconds()
+            if delay > 0:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.run(job.name)
+
+    def trigger(self, name: str) -> None:
+        """Make a job due now; the scheduler loop picks it up."""
+        job = self.jobs[name]
+        job.next_at = datetime.utcnow()
+        self._wake.set()
+
+    async def run(self, name: str) -> None:
+        job = self.jobs[name]
+        async with self._lock:
+            job.running = True
+            started = time.perf_counter()
+            job.last_run_at = datetime.utcnow()
+            try:
+                if job.exclusive and self._writes is not None:
+                    job.result = await asyncio.wrap_future(self._writes.run_exclusive(job.fn))
+                else:
+                    job.result = await asyncio.to_thread(job.fn)
+                job.error = None
+            except Exception as e:
+                job.error = f"{type(e).__name__}: {e}"
+                print(f"⚠️ Maintenance job {name} failed: {job.error}")
+            finally:
+                job.running = False
+                job.duration_ms = round((time.perf_counter() - started) * 1000, 1)
+                job.next_at = datetime.utcnow() + timedelta(seconds=job.interval)
+            try:
+                await asyncio.to_thread(self._save_run, job)
+            except Exception as e:
+                print(f"⚠️ Не удалось сохранить результат maintenance job {name}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            name: {
+                "interval_sec": job.interval,
+                "exclusive": job.exclusive,
+                "running": job.running,
+                "last_run_at": job.last_run_at.isoformat() if job.last_run_at else None,
+                "duration_ms": job.duration_ms,
+                "result": job.result,
+                "error": job.error,
+                "next_run_at": job.next_at.isoformat(),
+            }
+            for name, job in self.jobs.items()
+        }
+
+
+def default_scheduler(writes=None) -> MaintenanceScheduler:
+    sched = MaintenanceScheduler(writes, initial_delay=float(os.getenv("CORE_MAINTENANCE_INITIAL_DELAY", "60")))
+    if SQLITE_TUNED:
+        sched.add("checkpoint", float(os.getenv("CORE_SQLITE_CHECKPOINT_INTERVAL", "300")), sqlite_housekeeping)
+    sched.add("retention", float(os.getenv("CORE_MAINTENANCE_RETENTION_INTERVAL", "3600")), run_retention)
+    sched.add("vacuum", float(os.getenv("CORE_MAINTENANCE_VACUUM_INTERVAL", str(7 * 86400))), vacuum, exclusive=True)
+    return sched
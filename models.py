@@ -1,9 +1,9 @@
 from __future__ import annotations
 
 from datetime import datetime
-from sqlalchemy import Column, String, Integer, DateTime, Text, Boolean
+from sqlalchemy import Column, String, Integer, DateTime, Date, Float, Text, Boolean, Index, LargeBinary
 from sqlalchemy import JSON
-from sqlalchemy.orm import declarative_base
+from sqlalchemy.orm import declarative_base, deferred
 
 
 Base = declarative_base()
@@ -27,12 +27,52 @@ class CommandLog(Base):
     client_id = Column(String(128), index=True, nullable=False)
     command = Column(Text, nullable=False)
     status = Column(String(32), nullable=True)  # queued, running, success, error, cancelled, timeout
-    stdout = Column(Text, nullable=True)
-    stderr = Column(Text, nullable=True)
+    # Inline хранится только превью; полный вывод — в command_output_blobs (см. output_store).
+    # deferred: списки и админка не тянут текст вывода, пока его явно не попросят
+    stdout = deferred(Column(Text, nullable=True))
+    stderr = deferred(Column(Text, nullable=True))
+    stdout_size = Column(Integer, nullable=True)  # длина полного вывода в символах
+    stderr_size = Column(Integer, nullable=True)
+    stdout_blob = Column(String(64), nullable=True, index=True)  # sha256 полного вывода, если превью обрезано
+    stderr_blob = Column(String(64), nullable=True, index=True)
     exit_code = Column(Integer, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     finished_at = Column(DateTime, nullable=True)
 
+    # Индексы под keyset-пагинацию истории: (created_at, id) и фильтры по клиенту/статусу
+    __table_args__ = (
+        Index("ix_command_logs_created_id", "created_at", "id"),
+        Index("ix_command_logs_client_created_id", "client_id", "created_at", "id"),
+        Index("ix_command_logs_status_created_id", "status", "created_at", "id"),
+    )
+
+
+class CommandOutputBlob(Base):
+    __tablename__ = "command_output_blobs"
+    digest = Column(String(64), primary_key=True)  # sha256 несжатого вывода
+    codec = Column(String(16), nullable=False)  # zstd / zlib
+    size = Column(Integer, nullable=False)  # байт до сжатия
+    data = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class CommandDailyRollup(Base):
+    """Per-day command counts per client and status; survives command_logs retention."""
+    __tablename__ = "command_daily_rollups"
+    day = Column(Date, primary_key=True)
+    client_id = Column(String(128), primary_key=True)
+    status = Column(String(32), primary_key=True)  # "unknown" для записей без статуса
+    count = Column(Integer, nullable=False, default=0)
+
+
+class MaintenanceRun(Base):
+    __tablename__ = "maintenance_runs"
+    job = Column(String(64), primary_key=True)
+    last_run_at = Column(DateTime, nullable=True)
+    duration_ms = Column(Float, nullable=True)
+    result = Column(JSON, nullable=True)
+    error = Column(Text, nullable=True)
+
 
 class Enrollment(Base):
     __tablename__ = "enrollments"
@@ -0,0 +1,126 @@
+"""Content-addressed store for command stdout/stderr.
+
+Outputs up to CORE_OUTPUT_INLINE_LIMIT characters stay inline on `CommandLog`. Longer
+ones are compressed (zstd when installed, zlib otherwise) into `command_output_blobs`
+keyed by their sha256. The row then keeps a head+tail preview, the full size and the
+blob digest. Identical outputs (the same `df -h` on many hosts) share one blob.
+History search indexes the row, so it only sees the preview of a spilled output.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import zlib
+from typing import Dict, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .models import CommandLog, CommandOutputBlob
+
+try:
+    import zstandard as _zstd
+except ImportError:  # zstandard необязателен, хватит zlib
+    _zstd = None
+
+
+INLINE_LIMIT = int(os.getenv("CORE_OUTPUT_INLINE_LIMIT", "4096"))
+ZSTD_LEVEL = int(os.getenv("CORE_OUTPUT_ZSTD_LEVEL", "6"))
+STREAMS = ("stdout", "stderr")
+
+_TRUNC_MARK = "\n…\n"
+
+
+def compress(raw: bytes) -> tuple[str, bytes]:
+    if _zstd is not None:
+        return "zstd", _zstd.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    return "zlib", zlib.compress(raw, 6)
+
+
+def decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zstd":
+        if _zstd is None:
+            raise RuntimeError("blob is zstd-compressed but zstandard is not installed")
+        return _zstd.ZstdDecompressor().decompress(data)
+    if codec == "zlib":
+        return zlib.decompress(data)
+    raise ValueError(f"unknown blob codec: {codec}")
+
+
+def preview(text: str, limit: int = INLINE_LIMIT) -> str:
+    """Head and tail of a long output: errors tend to be at the end, headers at the start."""
+    half = max(1, (limit - len(_TRUNC_MARK)) // 2)
+    return text[:half] + _TRUNC_MARK + text[-half:]
+
+
+def put_blob(db: Session, text: str) -> str:
+    raw = text.encode("utf-8", errors="surrogatepass")
+    digest = hashlib.sha256(raw).hexdigest()
+    if db.get(CommandOutputBlob, digest) is not None:
+        return digest
+    codec, data = compress(raw)
+    row = {"digest": digest, "codec": codec, "size": len(raw), "data": data}
+    dialect = db.get_bind().dialect.name
+    # тот же блоб может параллельно записать другой поток (спилл при старте и write-behind)
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        db.execute(dialect_insert(CommandOutputBlob).values(**row).on_conflict_do_nothing(index_elements=[CommandOutputBlob.digest]))
+        return digest
+    try:
+        with db.begin_nested():
+            db.add(CommandOutputBlob(**row))
+    except IntegrityError:
+        pass
+    return digest
+
+
+def set_output(db: Session, log: CommandLog, stream: str, text: Optional[str]) -> None:
+    """Assign stdout/stderr on a row, spilling long text into the blob store."""
+    if text is not None and not isinstance(text, str):
+        text = str(text)
+    size = len(text) if text is not None else None
+    blob = None
+    if text is not None and len(text) > INLINE_LIMIT:
+        blob = put_blob(db, text)
+        text = preview(text)
+    setattr(log, stream, text)
+    setattr(log, f"{stream}_size", size)
+    setattr(log, f"{stream}_blob", blob)
+
+
+def output_meta(log: CommandLog) -> Dict[str, object]:
+    return {
+        f"{s}_{k}": v
+        for s in STREAMS
+        for k, v in (("size", getattr(log, f"{s}_size")), ("truncated", getattr(log, f"{s}_blob") is not None))
+    }
+
+
+def load_full_output(db: Session, log: CommandLog) -> Dict[str, Optional[str]]:
+    """Full stdout/stderr of one command, reading blobs only for truncated streams."""
+    out: Dict[str, Optional[str]] = {}
+    for s in STREAMS:
+        digest = getattr(log, f"{s}_blob")
+        if digest is None:
+            out[s] = getattr(log, s)
+            continue
+        blob = db.get(CommandOutputBlob, digest)
+        # блоб мог удалить сборщик мусора — отдаём хотя бы превью
+        out[s] = decompress(blob.codec, blob.data).decode("utf-8", errors="surrogatepass") if blob else getattr(log, s)
+    return out
+
+
+def spill_inline_outputs(db: Session, batch: int = 200) -> int:
+    """Move one batch of pre-existing oversized inline outputs into blobs; returns rows moved."""
+    too_long = (func.length(CommandLog.stdout) > INLINE_LIMIT) | (func.length(CommandLog.stderr) > INLINE_LIMIT)
+    logs = db.execute(select(CommandLog).where(too_long).limit(batch)).scalars().all()
+    for log in logs:
+        for s in STREAMS:
+            text = getattr(log, s)
+            if text is not None and len(text) > INLINE_LIMIT:
+                set_output(db, log, s, text)
+    return len(logs)
@@ -0,0 +1,524 @@
+"""In-memory index of agent presence, persisted to the `Client` table in the background.
+
+Keyed by client id, with:
+- status counters, kept up to date on every change, so fleet counts are O(1);
+- a list of (last_heartbeat, id) sorted with bisect, so "silent since T" is
+  O(log n + k);
+- hostname and IP secondary indexes.
+
+The index is fed by diffing full client_manager polls (`apply_snapshot`) or by
+heartbeats (`heartbeat`, `heartbeat_many` for ingested batches). Changed ids are tracked,
+and `take_dirty` hands them to the periodic persister, so the database only sees rows
+that actually changed, once per persist interval however many heartbeats arrived.
+Ids dropped from the fleet are handed over by `take_removed` and deleted from the table.
+
+The heartbeat list is re-sorted lazily: bulk updates only mark it stale, and the next
+stale query rebuilds it once. Every heartbeat also feeds `GapSeries`, a downsampled
+per-client history of heartbeat gaps and status flips used for flapping detection.
+"""
+from __future__ import annotations
+
+import bisect
+import json
+import os
+import threading
+from array import array
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Tuple
+
+from sqlalchemy import select
+
+try:
+    import msgpack as _msgpack
+except ImportError:  # msgpack необязателен, NDJSON работает всегда
+    _msgpack = None
+
+from .client_snapshot import SNAPSHOT_FIELDS, coerce_fields, normalize_client, parse_dt
+from .db import get_read_session
+from .models import Client
+
+
+def _ts(dt: datetime | None) -> float | None:
+    return dt.replace(tzinfo=timezone.utc).timestamp() if dt else None
+
+
+def _iso(dt: datetime | None) -> str | None:
+    return dt.isoformat() if dt else None
+
+
+# При массовом обновлении дешевле пересобрать отсортированный список целиком, чем вставлять по одному
+_REBUILD_FRACTION = 0.05
+
+GAP_BUCKET_SEC = int(os.getenv("CORE_HEARTBEAT_GAP_BUCKET_SEC", "300"))
+GAP_BUCKETS = int(os.getenv("CORE_HEARTBEAT_GAP_BUCKETS", "24"))
+LATE_SEC = float(os.getenv("CORE_HEARTBEAT_LATE_SEC", "30"))
+
+_I32_MAX = 2**31 - 1
+
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+
+def decode_heartbeats(body: bytes, content_type: str) -> List[Any]:
+    """Heartbeat batch body -> list of items.
+
+    NDJSON (one object per line) by default, a JSON array, or msgpack (one array or a
+    stream of maps). Raises ValueError on malformed input, RuntimeError without msgpack.
+    """
+    ctype = (content_type or "").split(";")[0].strip().lower()
+    if ctype in MSGPACK_TYPES:
+        if _msgpack is None:
+            raise RuntimeError("msgpack is not installed")
+        items: List[Any] = []
+        unpacker = _msgpack.Unpacker(raw=False, max_buffer_size=max(len(body), 1024))
+        unpacker.feed(body)
+        try:
+            for obj in unpacker:
+                items.extend(obj if isinstance(obj, list) else [obj])
+        except Exception as e:
+            raise ValueError(f"invalid msgpack: {e}") from e
+        return items
+    body = body.strip()
+    if not body:
+        return []
+    if body[:1] == b"[":
+        data = json.loads(body)
+        return data if isinstance(data, list) else [data]
+    # склеиваем строки в один JSON-массив: один вызов json.loads вместо вызова на строку
+    lines = [line for line in body.split(b"\n") if line.strip()]
+    try:
+        return json.loads(b"[" + b",".join(lines) + b"]")
+    except ValueError:
+        for n, line in enumerate(lines, 1):
+            try:
+                json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"line {n}: {e}") from e
+        raise
+
+
+class GapSeries:
+    """Per-client heartbeat gaps downsampled into a fixed ring of time buckets.
+
+    Each client has one int32 array of GAP_BUCKETS slots:
+    (bucket number, heartbeats, sum of gaps ms, max gap ms, gaps over LATE_SEC, status flips).
+    Memory is about 600 bytes per client whatever the heartbeat rate.
+    """
+
+    FIELDS = ("bucket", "heartbeats", "sum_gap_ms", "max_gap_ms", "late", "flips")
+    _W = len(FIELDS)
+
+    def __init__(self, bucket_sec: int = GAP_BUCKET_SEC, buckets: int = GAP_BUCKETS, late_sec: float = LATE_SEC) -> None:
+        self.bucket_sec = bucket_sec
+        self.buckets = buckets
+        self.late_sec = late_sec
+        self._data: Dict[str, array] = {}
+        self._blank = array("i", bytes(4 * self._W * buckets))
+
+    def record(self, cid: str, ts: float, gap: float | None, flipped: bool) -> None:
+        b = int(ts // self.bucket_sec)
+        arr = self._data.get(cid)
+        if arr is None:
+            arr = self._data[cid] = array("i", self._blank)
+        o = (b % self.buckets) * self._W
+        if arr[o] != b:
+            if arr[o] > b:
+                return  # запоздавший heartbeat старше окна
+            arr[o:o + self._W] = array("i", (b, 0, 0, 0, 0, 0))
+        arr[o + 1] += 1
+        if gap is not None:
+            ms = min(int(gap * 1000), _I32_MAX)
+            arr[o + 2] = min(arr[o + 2] + ms, _I32_MAX)
+            if ms > arr[o + 3]:
+                arr[o + 3] = ms
+            if gap > self.late_sec:
+                arr[o + 4] += 1
+        if flipped:
+            arr[o + 5] += 1
+
+    def drop(self, cid: str) -> None:
+        self._data.pop(cid, None)
+
+    def _rows(self, arr: array, since_bucket: int) -> List[Tuple[int, ...]]:
+        w = self._W
+        rows = (tuple(arr[i:i + w]) for i in range(0, len(arr), w))
+        return sorted(r for r in rows if r[0] >= since_bucket and (r[1] or r[5]))
+
+    def series(self, cid: str, since: float) -> List[Dict[str, Any]]:
+        arr = self._data.get(cid)
+        if arr is None:
+            return []
+        out = []
+        for b, n, total, mx, late, flips in self._rows(arr, int(since // self.bucket_sec)):
+            out.append({
+                "start": datetime.fromtimestamp(b * self.bucket_sec, timezone.utc).replace(tzinfo=None).isoformat(),
+                "heartbeats": n,
+                "avg_gap_sec": round(total / n / 1000, 3) if n else None,
+                "max_gap_sec": round(mx / 1000, 3),
+                "late": late,
+                "flips": flips,
+            })
+        return out
+
+    def events(self, since: float, min_events: int) -> List[Tuple[str, int, int, int]]:
+        """(id, late gaps, flips, max gap ms) of clients with at least `min_events` late gaps + flips."""
+        since_bucket = int(since // self.bucket_sec)
+        w = self._W
+        found = []
+        for cid, arr in self._data.items():
+            late = flips = mx = 0
+            for i in range(0, len(arr), w):
+                if arr[i] >= since_bucket:
+                    late += arr[i + 4]
+                    flips += arr[i + 5]
+                    if arr[i + 3] > mx:
+                        mx = arr[i + 3]
+            if late + flips >= min_events:
+                found.append((cid, late, flips, mx))
+        return found
+
+
+class PresenceIndex:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._rows: Dict[str, Dict[str, Any]] = {}
+        self._status = Counter()
+        self._hb: List[Tuple[float, str]] = []
+        self._no_hb: set[str] = set()
+        self._by_hostname: Dict[str, set[str]] = {}
+        self._by_ip: Dict[str, set[str]] = {}
+        self._dirty: set[str] = set()
+        self._removed: set[str] = set()
+        self._hb_stale = False
+        self.gaps = GapSeries()
+        self.heartbeats_received = 0
+        self.version = 0
+        self.last_change: datetime | None = None
+
+    # --- внутреннее обслуживание индексов (под self._lock) ---
+
+    def _unindex(self, row: Dict[str, Any], hb: bool = True) -> None:
+        cid = row["id"]
+        self._status[row["status"]] -= 1
+        if self._status[row["status"]] <= 0:
+            del self._status[row["status"]]
+        for idx, key in ((self._by_hostname, row["hostname"]), (self._by_ip, row["ip"])):
+            ids = idx.get(key)
+            if ids is not None:
+                ids.discard(cid)
+                if not ids:
+                    del idx[key]
+        if hb and not self._hb_stale:
+            ts = _ts(row["last_heartbeat"])
+            if ts is None:
+                self._no_hb.discard(cid)
+            else:
+                i = bisect.bisect_left(self._hb, (ts, cid))
+                if i < len(self._hb) and self._hb[i] == (ts, cid):
+                    del self._hb[i]
+
+    def _index(self, row: Dict[str, Any], hb: bool = True) -> None:
+        cid = row["id"]
+        self._status[row["status"]] += 1
+        if row["hostname"]:
+            self._by_hostname.setdefault(row["hostname"], set()).add(cid)
+        if row["ip"]:
+            self._by_ip.setdefault(row["ip"], set()).add(cid)
+        if hb and not self._hb_stale:
+            ts = _ts(row["last_heartbeat"])
+            if ts is None:
+                self._no_hb.add(cid)
+            else:
+                bisect.insort(self._hb, (ts, cid))
+
+    def _rebuild_hb(self) -> None:
+        self._hb = sorted((_ts(r["last_heartbeat"]), cid) for cid, r in self._rows.items() if r["last_heartbeat"])
+        self._no_hb = {cid for cid, r in self._rows.items() if not r["last_heartbeat"]}
+        self._hb_stale = False
+
+    def _ensure_hb(self) -> None:
+        if self._hb_stale:
+            self._rebuild_hb()
+
+    def _track(self, old: Dict[str, Any] | None, row: Dict[str, Any]) -> None:
+        ts = _ts(row["last_heartbeat"])
+        if ts is None:
+            return
+        prev = _ts(old["last_heartbeat"]) if old else None
+        gap = ts - prev if prev is not None and ts > prev else None
+        flipped = old is not None and old["status"] != row["status"]
+        if gap is not None or flipped or old is None:
+            self.gaps.record(row["id"], ts, gap, flipped)
+
+    def _put(self, row: Dict[str, Any], now: datetime, hb: bool = True) -> bool:
+        cid = row["id"]
+        old = self._rows.get(cid)
+        if old is not None:
+            if all(old[f] == row[f] for f in SNAPSHOT_FIELDS):
+                return False
+            self._unindex(old, hb)
+        self._track(old, row)
+        row["updated_at"] = now
+        self._rows[cid] = row
+        self._index(row, hb)
+        self._dirty.add(cid)
+        self._removed.discard(cid)
+        return True
+
+    def _drop(self, cid: str) -> None:
+        old = self._rows.pop(cid, None)
+        if old is not None:
+            self._unindex(old)
+            self._dirty.discard(cid)
+            self._removed.add(cid)
+            self.gaps.drop(cid)
+
+    # --- запись ---
+
+    def apply_snapshot(self, clients: Iterable[Dict[str, Any]], complete: bool = True) -> Dict[str, int]:
+        """Diff a client_manager client list into the index.
+
+        With `complete=True` the list is the whole fleet and ids missing from it are dropped.
+        """
+        incoming: Dict[str, Dict[str, Any]] = {}
+        for c in clients or []:
+            row = normalize_client(c) if isinstance(c, dict) else None
+            if row is not None:
+                incoming[row["id"]] = row
+        now = datetime.utcnow()
+        counts = {"inserted": 0, "updated": 0, "unchanged": 0, "removed": 0}
+        with self._lock:
+            bulk = len(incoming) > 64 and len(incoming) >= _REBUILD_FRACTION * max(1, len(self._rows))
+            for cid, row in incoming.items():
+                existed = cid in self._rows
+                # при массовом обновлении список heartbeat пересобирается один раз в конце
+                if self._put(row, now, hb=not bulk):
+                    counts["updated" if existed else "inserted"] += 1
+                else:
+                    counts["unchanged"] += 1
+            if complete:
+                for cid in [c for c in self._rows if c not in incoming]:
+                    self._drop(cid)
+                    counts["removed"] += 1
+            if bulk:
+                self._hb_stale = True
+            if counts["inserted"] or counts["updated"] or counts["removed"]:
+                self.version += 1
+                self.last_change = now
+        return counts
+
+    def heartbeat(self, client_id: str, at: datetime | str | None = None, **fields: Any) -> bool:
+        """Record one heartbeat (and optionally status/hostname/ip/port) for a client."""
+        now = datetime.utcnow()
+        with self._lock:
+            old = self._rows.get(client_id)
+            row = dict(old) if old else {"id": client_id, "hostname": None, "ip": None, "port": None,
+                                         "status": None, "connected_at": now}
+            row["last_heartbeat"] = parse_dt(at) or now
+            # значения из запроса агента приводятся к типам колонок Client (port — Integer)
+            row.update(coerce_fields(fields))
+            if row["status"] is None:
+                row["status"] = "online"
+            changed = self._put(row, now)
+            if changed:
+                self.version += 1
+                self.last_change = now
+            return changed
+
+    def heartbeat_many(self, items: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+        """Apply a batch of heartbeats under one lock.
+
+        Items are `{"id": ..., "at": epoch seconds | ISO, "status"?, "hostname"?, "ip"?, "port"?}`
+        (`client_id`/`ts`/`last_heartbeat` are accepted as aliases). Heartbeats older than the
+        one already recorded are ignored.
+        """
+        now = datetime.utcnow()
+        counts = {"accepted": 0, "ignored": 0, "rejected": 0}
+        with self._lock:
+            # heartbeat-список пересобирается при следующем запросе stale, а не на каждую запись
+            self._hb_stale = True
+            rows = self._rows
+            for item in items:
+                try:
+                    cid = item.get("id") or item.get("client_id")
+                    at = item.get("at", item.get("ts", item.get("last_heartbeat")))
+                    if isinstance(at, (int, float)):
+                        ts = float(at)
+                        hb = datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None)
+                    else:
+                        hb = parse_dt(at) if at else now
+                        ts = _ts(hb) if hb else None
+                except (AttributeError, TypeError, ValueError, OverflowError, OSError):
+                    cid = ts = None
+                if not cid or ts is None:
+                    counts["rejected"] += 1
+                    continue
+                cid = str(cid)
+                old = rows.get(cid)
+                if old is not None and old["last_heartbeat"] is not None and hb <= old["last_heartbeat"]:
+                    counts["ignored"] += 1
+                    continue
+                update = coerce_fields(item)
+                if old is not None and all(old[f] == v for f, v in update.items()):
+                    # частый случай: только новое время — обновляем строку на месте
+                    prev = _ts(old["last_heartbeat"]) if old["last_heartbeat"] else None
+                    self.gaps.record(cid, ts, ts - prev if prev is not None else None, False)
+                    old["last_heartbeat"] = hb
+                    old["updated_at"] = now
+                    self._dirty.add(cid)
+                else:
+                    row = dict(old) if old else {"id": cid, "hostname": None, "ip": None, "port": None,
+                                                 "status": None, "connected_at": now}
+                    row["last_heartbeat"] = hb
+                    row.update(update)
+                    if row["status"] is None:
+                        row["status"] = "online"
+                    self._put(row, now)
+                counts["accepted"] += 1
+            if counts["accepted"]:
+                self.version += 1
+                self.last_change = now
+            self.heartbeats_received += counts["accepted"]
+        return counts
+
+    def load_rows(self, rows: Iterable[Dict[str, Any]]) -> int:
+        """Seed the index from persisted rows without marking them dirty."""
+        with self._lock:
+            for row in rows:
+                old = self._rows.get(row["id"])
+                if old is not None:
+                    self._unindex(old, hb=False)
+                self._rows[row["id"]] = row
+                self._index(row, hb=False)
+            self._rebuild_hb()
+            self.version += 1
+            return len(self._rows)
+
+    def load_from_db(self) -> int:
+        cols = [getattr(Client, f) for f in ("id",) + SNAPSHOT_FIELDS + ("updated_at",)]
+        with get_read_session() as db:
+            rows = [dict(r._mapping) for r in db.execute(select(*cols))]
+        return self.load_rows(rows)
+
+    def take_dirty(self) -> List[Dict[str, Any]]:
+        """Rows changed since the last call, for the persister."""
+        with self._lock:
+            rows = [dict(self._rows[cid]) for cid in self._dirty if cid in self._rows]
+            self._dirty.clear()
+            return rows
+
+    def mark_dirty(self, ids: Iterable[str]) -> None:
+        """Put rows back for the next persist attempt (after a failed write)."""
+        with self._lock:
+            self._dirty.update(cid for cid in ids if cid in self._rows)
+
+    def take_removed(self) -> List[str]:
+        """Ids dropped since the last call, for the persister to delete."""
+        with self._lock:
+            ids = sorted(self._removed)
+            self._removed.clear()
+            return ids
+
+    def mark_removed(self, ids: Iterable[str]) -> None:
+        """Put ids back for the next persist attempt, unless they came back meanwhile."""
+        with self._lock:
+            self._removed.update(cid for cid in ids if cid not in self._rows)
+
+    # --- чтение ---
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return {str(k): v for k, v in self._status.items()}
+
+    def count_stale(self, since: datetime) -> int:
+        """Clients whose last heartbeat is older than `since` (clients with none included)."""
+        with self._lock:
+            self._ensure_hb()
+            return bisect.bisect_left(self._hb, (_ts(since), "")) + len(self._no_hb)
+
+    def stale(self, since: datetime, limit: int = 100, include_unknown: bool = True) -> List[Dict[str, Any]]:
+        """Oldest-first clients silent since `since`."""
+        now = datetime.utcnow()
+        with self._lock:
+            self._ensure_hb()
+            end = bisect.bisect_left(self._hb, (_ts(since), ""))
+            ids = [cid for _, cid in self._hb[:min(end, limit)]]
+            if include_unknown and len(ids) < limit:
+                ids.extend(sorted(self._no_hb)[: limit - len(ids)])
+            return [self._public(self._rows[cid], now) for cid in ids]
+
+    def lookup(self, hostname: str | None = None, ip: str | None = None) -> List[Dict[str, Any]]:
+        now = datetime.utcnow()
+        with self._lock:
+            ids: set[str] | None = None
+            for idx, key in ((self._by_hostname, hostname), (self._by_ip, ip)):
+                if key:
+                    found = idx.get(key, set())
+                    ids = set(found) if ids is None else ids & found
+            return [self._public(self._rows[cid], now) for cid in sorted(ids or ())]
+
+    def get(self, client_id: str) -> Dict[str, Any] | None:
+        with self._lock:
+            row = self._rows.get(client_id)
+            return self._public(row, datetime.utcnow()) if row else None
+
+    def export(self, stale: bool = False) -> List[Dict[str, Any]]:
+        """All clients in the upstream /api/clients shape (plus heartbeat age)."""
+        now = datetime.utcnow()
+        with self._lock:
+            return [self._public(self._rows[cid], now, stale) for cid in sorted(self._rows)]
+
+    @staticmethod
+    def _public(row: Dict[str, Any], now: datetime, stale: bool = False) -> Dict[str, Any]:
+        hb = row["last_heartbeat"]
+        out = {
+            "id": row["id"],
+            "hostname": row["hostname"],
+            "ip": row["ip"],
+            "port": row["port"],
+            "status": row["status"],
+            "connected_at": _iso(row["connected_at"]),
+            "last_heartbeat": _iso(hb),
+            "last_heartbeat_age_sec": round((now - hb).total_seconds(), 1) if hb else None,
+        }
+        if stale:
+            out["snapshot_updated_at"] = _iso(row.get("updated_at"))
+            out["stale"] = True
+        return out
+
+    def summary(self, stale_after: float = 60.0) -> Dict[str, Any]:
+        now = datetime.utcnow()
+        return {
+            "total": len(self._rows),
+            "by_status": self.counts(),
+            "stale": self.count_stale(now - timedelta(seconds=stale_after)),
+            "stale_after_sec": stale_after,
+            "version": self.version,
+            "last_change": _iso(self.last_change),
+            "heartbeats_received": self.heartbeats_received,
+        }
+
+    def gap_series(self, client_id: str, window: float) -> List[Dict[str, Any]]:
+        since = _ts(datetime.utcnow()) - window
+        with self._lock:
+            return self.gaps.series(client_id, since)
+
+    def flapping(self, window: float, min_events: int = 3, limit: int = 100) -> List[Dict[str, Any]]:
+        """Clients with at least `min_events` late heartbeats + status flips in the last `window` seconds."""
+        now = datetime.utcnow()
+        with self._lock:
+            found = self.gaps.events(_ts(now) - window, min_events)
+            found.sort(key=lambda f: (-(f[1] + f[2]), f[0]))
+            out = []
+            for cid, late, flips, mx in found[:limit]:
+                row = self._rows.get(cid)
+                if row is None:
+                    continue
+                item = self._public(row, now)
+                item.update({"late_heartbeats": late, "status_flips": flips, "max_gap_sec": round(mx / 1000, 3)})
+                out.append(item)
+            return out
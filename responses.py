@@ -0,0 +1,261 @@
+"""Conditional, paginated and compressed JSON responses for the dashboard list endpoints.
+
+`ListResponder.respond` turns a list (or a name -> object mapping) into a response with:
+- `fields=` projection and keyset pagination. `limit`/`cursor` return one page, and the
+  next cursor goes in `X-Next-Cursor` and a `Link: rel="next"` header, so the body keeps
+  the shape of the unpaginated endpoint;
+- a strong ETag built from a per-endpoint data version. The version only changes when
+  the data changes: an identity check first (cache hits return the same object), then
+  an equality check. The body is never hashed, so `If-None-Match` -> 304 costs neither
+  serialization nor compression;
+- gzip or brotli (when installed) above CORE_COMPRESS_MIN_BYTES. Rendered and compressed
+  bodies are cached per version, so unchanged polls reuse the same bytes.
+"""
+from __future__ import annotations
+
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import os
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Sequence, Tuple
+
+from fastapi import HTTPException, Request
+from fastapi.responses import Response
+
+try:
+    import brotli as _brotli
+except ImportError:  # brotli необязателен, есть gzip
+    _brotli = None
+
+
+COMPRESS_MIN_BYTES = int(os.getenv("CORE_COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("CORE_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("CORE_BROTLI_QUALITY", "5"))
+MAX_LIMIT = 10000
+
+# Версии живут в памяти процесса: после рестарта старые ETag не должны совпасть с новыми данными
+_BOOT = uuid.uuid4().hex[:8]
+
+
+def encode_cursor(key: str) -> str:
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> str:
+    try:
+        return base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def negotiate_encoding(accept: str) -> str | None:
+    """'br' or 'gzip' from an Accept-Encoding header (q=0 honoured), None for identity."""
+    offered: Dict[str, float] = {}
+    for part in (accept or "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            offered[name.strip().lower()] = q
+    for enc in ("br", "gzip"):
+        if enc == "br" and _brotli is None:
+            continue
+        if offered.get(enc, offered.get("*", 0.0)) > 0:
+            return enc
+    return None
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return _brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _dumps(content: Any) -> bytes:
+    # те же параметры, что у JSONResponse
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+class _Rendered:
+    __slots__ = ("bodies", "next_cursor")
+
+    def __init__(self, body: bytes, next_cursor: str | None) -> None:
+        self.bodies: Dict[str | None, bytes] = {None: body}
+        self.next_cursor = next_cursor
+
+
+class ListResponder:
+    def __init__(self, max_bodies: int = 64, compress_min_bytes: int = COMPRESS_MIN_BYTES) -> None:
+        self.max_bodies = max_bodies
+        self.compress_min_bytes = compress_min_bytes
+        self._last: Dict[str, Tuple[Any, int]] = {}
+        self._bodies: "OrderedDict[tuple, _Rendered]" = OrderedDict()
+        self.not_modified = 0
+        self.rendered = 0
+        self.reused = 0
+
+    def version(self, name: str, value: Any) -> int:
+        """Data version of endpoint `name`; bumps only when `value` differs from the last one seen."""
+        last = self._last.get(name)
+        if last is not None and (last[0] is value or last[0] == value):
+            return last[1]
+        version = last[1] + 1 if last else 1
+        self._last[name] = (value, version)
+        # тела прошлых версий больше не понадобятся
+        for k in [k for k in self._bodies if k[0] == name]:
+            del self._bodies[k]
+        return version
+
+    async def respond(
+        self,
+        request: Request,
+        name: str,
+        value: Any,
+        key: str | Sequence[str] = "id",
+        descending: bool = False,
+        fields: str | None = None,
+        cursor: str | None = None,
+        limit: int | None = None,
+        headers: Dict[str, str] | None = None,
+        version_of: Any = None,
+    ) -> Response:
+        """`key` names the cursor field of list items; with several names the first present one is used.
+        `version_of` replaces `value` for versioning when `value` has fields that change without the data
+        changing (probe timestamps); the body of a version is then the one rendered first.
+        """
+        version = self.version(name, value if version_of is None else version_of)
+        projection = tuple(sorted({f.strip() for f in fields.split(",") if f.strip()})) if fields else None
+        if limit is not None:
+            limit = max(1, min(limit, MAX_LIMIT))
+        after = decode_cursor(cursor) if cursor else None
+        variant = (projection, after, limit)
+        tag = f"{_BOOT}-{name}-{version}"
+        if projection or after is not None or limit is not None:
+            tag += "-" + hashlib.blake2s(repr(variant).encode(), digest_size=6).hexdigest()
+        encoding = negotiate_encoding(request.headers.get("accept-encoding", ""))
+        base_headers = {"Vary": "Accept-Encoding", "Cache-Control": "no-cache", **(headers or {})}
+
+        matched = _etag_match(request.headers.get("if-none-match"), tag)
+        if matched:
+            self.not_modified += 1
+            return Response(status_code=304, headers={**base_headers, "ETag": matched})
+
+        entry_key = (name, version, variant)
+        rendered = self._bodies.get(entry_key)
+        if rendered is None:
+            keys = (key,) if isinstance(key, str) else tuple(key)
+            rendered = await asyncio.to_thread(_render, value, keys, descending, projection, after, limit)
+            self._bodies[entry_key] = rendered
+            self.rendered += 1
+            while len(self._bodies) > self.max_bodies:
+                self._bodies.popitem(last=False)
+        else:
+            self._bodies.move_to_end(entry_key)
+            self.reused += 1
+
+        identity = rendered.bodies[None]
+        if encoding is None or len(identity) < self.compress_min_bytes:
+            encoding = None
+        body = rendered.bodies.get(encoding)
+        if body is None:
+            body = await asyncio.to_thread(_compress, identity, encoding)
+            rendered.bodies[encoding] = body
+        out_headers = {**base_headers, "ETag": _etag(tag, encoding)}
+        if encoding:
+            out_headers["Content-Encoding"] = encoding
+        if rendered.next_cursor:
+            out_headers["X-Next-Cursor"] = rendered.next_cursor
+            out_headers["Link"] = f'<{_next_url(request, rendered.next_cursor)}>; rel="next"'
+        return Response(content=body, media_type="application/json", headers=out_headers)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "versions": {name: v for name, (_, v) in self._last.items()},
+            "cached_bodies": len(self._bodies),
+            "not_modified": self.not_modified,
+            "rendered": self.rendered,
+            "reused": self.reused,
+            "brotli": _brotli is not None,
+        }
+
+
+def _etag(tag: str, encoding: str | None) -> str:
+    # у каждого представления свой сильный ETag
+    return f'"{tag}-{encoding}"' if encoding else f'"{tag}"'
+
+
+def _etag_match(header: str | None, tag: str) -> str | None:
+    """The If-None-Match entry naming this data version (in any content encoding), if any."""
+    if not header:
+        return None
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return _etag(tag, None)
+        opaque = candidate[2:] if candidate.startswith("W/") else candidate
+        if opaque.strip('"') in (tag, f"{tag}-gzip", f"{tag}-br"):
+            return opaque
+    return None
+
+
+def _next_url(request: Request, cursor: str) -> str:
+    url = request.url.include_query_params(cursor=cursor)
+    return f"{url.path}?{url.query}"
+
+
+def _project(item: Any, projection: Tuple[str, ...] | None) -> Any:
+    if projection is None or not isinstance(item, dict):
+        return item
+    return {f: item[f] for f in projection if f in item}
+
+
+def _item_key(item: Any, keys: Tuple[str, ...]) -> str | None:
+    if isinstance(item, dict):
+        for k in keys:
+            if item.get(k) not in (None, ""):
+                return str(item[k])
+    return None
+
+
+def _render(
+    value: Any,
+    keys: Tuple[str, ...],
+    descending: bool,
+    projection: Tuple[str, ...] | None,
+    after: str | None,
+    limit: int | None,
+) -> _Rendered:
+    paged = after is not None or limit is not None
+    if isinstance(value, dict):
+        pairs: List[Tuple[str, Any]] = list(value.items())
+    elif isinstance(value, list):
+        pairs = [(_item_key(item, keys), item) for item in value]
+        if any(k is None for k, _ in pairs):
+            # без ключа у элемента keyset-курсор не построить — отдаём список целиком
+            paged = False
+    else:
+        return _Rendered(_dumps(value), None)
+
+    next_cursor = None
+    if paged:
+        # keyset по ключу: удаление элементов между страницами не сдвигает следующую страницу
+        pairs.sort(key=lambda p: p[0], reverse=descending)
+        if after is not None:
+            pairs = [p for p in pairs if (p[0] < after if descending else p[0] > after)]
+        if limit is not None and len(pairs) > limit:
+            pairs = pairs[:limit]
+            next_cursor = encode_cursor(pairs[-1][0])
+
+    if isinstance(value, dict):
+        content: Any = {k: _project(v, projection) for k, v in pairs}
+    else:
+        content = [_project(item, projection) for _, item in pairs]
+    return _Rendered(_dumps(content), next_cursor)
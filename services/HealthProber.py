@@ -0,0 +1,97 @@
+import asyncio
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+import httpx
+
+from .ManagedService import ManagedService
+
+
+@dataclass
+class HealthState:
+    healthy: Optional[bool] = None  # None — ещё не проверялся после старта
+    last_checked: float = 0.0
+    latency_ms: Optional[float] = None
+    consecutive_failures: int = 0
+    last_error: Optional[str] = None
+
+
+class HealthProber:
+    """Background health-checks on a private event loop.
+
+    Every service gets its own probe task on its own `health_interval_sec` and the
+    first probe waits for `health_start_grace_sec` after launch. All probes share one
+    keep-alive `httpx.AsyncClient`. Results land in `snapshot` (name -> HealthState),
+    which readers use without I/O, and are passed to `on_result` to drive restarts.
+    """
+
+    def __init__(self, services: Dict[str, ManagedService],
+                 is_running: Callable[[ManagedService], bool],
+                 on_result: Callable[[ManagedService, HealthState], None]):
+        self._services = services
+        self._is_running = is_running
+        self._on_result = on_result
+        self.snapshot: Dict[str, HealthState] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=lambda: asyncio.run(self._main()), name="health-prober", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._loop is not None and self._stop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    async def _main(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        limits = httpx.Limits(max_connections=max(4, len(self._services)), max_keepalive_connections=len(self._services))
+        async with httpx.AsyncClient(limits=limits) as client:
+            tasks = [asyncio.create_task(self._probe_loop(client, svc)) for svc in self._services.values()
+                     if svc.healthcheck_url]
+            await self._stop.wait()
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _probe_loop(self, client: httpx.AsyncClient, svc: ManagedService) -> None:
+        state = self.snapshot.setdefault(svc.name, HealthState())
+        started = svc.last_start_ts
+        while True:
+            if svc.last_start_ts != started:
+                # перезапуск: прежняя серия ошибок к новому процессу не относится
+                started = svc.last_start_ts
+                state.healthy, state.consecutive_failures = None, 0
+            due = max(state.last_checked + svc.health_interval_sec, svc.last_start_ts + svc.health_start_grace_sec)
+            delay = due - time.time()
+            if delay > 0:
+                await asyncio.sleep(min(delay, svc.health_interval_sec))
+                continue
+            if not self._is_running(svc):
+                state.last_checked = time.time()
+                continue
+            await self._probe(client, svc, state)
+            try:
+                self._on_result(svc, state)
+            except Exception as e:
+                print(f"⚠️ Health result handler failed for {svc.name}: {e}")
+
+    async def _probe(self, client: httpx.AsyncClient, svc: ManagedService, state: HealthState) -> None:
+        t = time.perf_counter()
+        try:
+            resp = await client.get(svc.healthcheck_url, timeout=svc.health_timeout_sec)
+            ok = 200 <= resp.status_code < 300
+            error = None if ok else f"HTTP {resp.status_code}"
+        except httpx.HTTPError as e:
+            ok, error = False, f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+        state.latency_ms = round((time.perf_counter() - t) * 1000, 1)
+        state.last_checked = time.time()
+        state.healthy = ok
+        state.last_error = error
+        state.consecutive_failures = 0 if ok else state.consecutive_failures + 1
@@ -0,0 +1,163 @@
+import asyncio
+import gzip
+import logging
+import logging.handlers
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, NamedTuple, Optional, Set, Tuple
+
+
+MAX_LINES = int(os.getenv("CORE_SERVICE_LOG_LINES", "5000"))            # строк на поток
+MAX_BYTES = int(os.getenv("CORE_SERVICE_LOG_BYTES", str(1024 * 1024)))  # байт текста на поток
+MAX_LINE = int(os.getenv("CORE_SERVICE_LOG_MAX_LINE", "8192"))          # длинные строки обрезаются
+
+STREAMS = ("stdout", "stderr", "system")
+
+
+class LogLine(NamedTuple):
+    seq: int
+    ts: float
+    stream: str
+    line: str
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"seq": self.seq, "ts": self.ts, "stream": self.stream, "line": self.line}
+
+
+class LogRing:
+    """Fixed-size ring of lines of one stream, bounded by line count and total text size."""
+
+    def __init__(self, max_lines: int = MAX_LINES, max_bytes: int = MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.lines: Deque[LogLine] = deque(maxlen=max_lines)
+        self.size = 0
+        self.dropped = 0
+
+    def append(self, entry: LogLine) -> None:
+        if len(self.lines) == self.lines.maxlen:
+            self.size -= len(self.lines[0].line)
+            self.dropped += 1
+        self.lines.append(entry)
+        self.size += len(entry.line)
+        while self.size > self.max_bytes and len(self.lines) > 1:
+            self.size -= len(self.lines.popleft().line)
+            self.dropped += 1
+
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def _disk_handler(path: str, max_bytes: int, backups: int) -> logging.Handler:
+    # ротация по размеру, старые файлы — <name>.log.N.gz
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8", delay=True)
+    handler.namer = lambda name: name + ".gz"
+    handler.rotator = _gzip_rotator
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    return handler
+
+
+class ServiceLogs:
+    """Output of one service: a ring per stream with a shared line sequence.
+
+    Writers are the orchestrator's pipe-reader threads; readers are API handlers and SSE
+    followers on the admin app's event loop, woken through `call_soon_threadsafe`.
+    """
+
+    def __init__(self, name: str, max_lines: int = MAX_LINES, max_bytes: int = MAX_BYTES,
+                 log_dir: Optional[str] = None, disk_max_bytes: int = 10 * 1024 * 1024, disk_backups: int = 5,
+                 echo: bool = False):
+        self.name = name
+        self.rings: Dict[str, LogRing] = {s: LogRing(max_lines, max_bytes) for s in STREAMS}
+        self.next_seq = 1
+        self.echo = echo
+        self._lock = threading.Lock()
+        self._followers: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+        self._disk: Optional[logging.Logger] = None
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+            logger = logging.getLogger(f"core_service.service_logs.{name}")
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            if not logger.handlers:
+                logger.addHandler(_disk_handler(os.path.join(log_dir, f"{name}.log"), disk_max_bytes, disk_backups))
+            self._disk = logger
+
+    def append(self, stream: str, line: str) -> int:
+        line = line.rstrip("\r\n")
+        if len(line) > MAX_LINE:
+            line = line[:MAX_LINE] + f"… [{len(line) - MAX_LINE} chars truncated]"
+        now = time.time()
+        with self._lock:
+            seq = self.next_seq
+            self.next_seq += 1
+            self.rings[stream if stream in self.rings else "stdout"].append(LogLine(seq, now, stream, line))
+            followers = list(self._followers)
+        for loop, event in followers:
+            if not event.is_set():
+                try:
+                    loop.call_soon_threadsafe(event.set)
+                except RuntimeError:
+                    # цикл подписчика уже закрыт
+                    with self._lock:
+                        self._followers.discard((loop, event))
+        if self._disk is not None:
+            self._disk.info("%s %s %s", time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(now)), stream, line)
+        if self.echo and stream != "system":
+            print(f"[{self.name}] {line}")
+        return seq
+
+    def query(self, tail: Optional[int] = None, since_seq: Optional[int] = None, since_ts: Optional[float] = None,
+              stream: Optional[str] = None) -> List[LogLine]:
+        """Lines in sequence order, filtered by stream and `since`, limited to the last `tail`."""
+        with self._lock:
+            rings = [self.rings[stream]] if stream in self.rings else list(self.rings.values())
+            parts = []
+            for ring in rings:
+                lines = ring.lines
+                # кольца упорядочены по seq/ts: с конца берём только нужное
+                picked = []
+                for entry in reversed(lines):
+                    if (since_seq is not None and entry.seq <= since_seq) or (since_ts is not None and entry.ts < since_ts):
+                        break
+                    picked.append(entry)
+                    if tail is not None and len(picked) >= tail:
+                        break
+                parts.extend(picked)
+        parts.sort(key=lambda e: e.seq)
+        return parts[-tail:] if tail is not None else parts
+
+    def follow(self) -> asyncio.Event:
+        event = asyncio.Event()
+        with self._lock:
+            self._followers.add((asyncio.get_running_loop(), event))
+        return event
+
+    def unfollow(self, event: asyncio.Event) -> None:
+        with self._lock:
+            self._followers = {f for f in self._followers if f[1] is not event}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "last_seq": self.next_seq - 1,
+                "followers": len(self._followers),
+                "persisted": self._disk is not None,
+                "streams": {s: {"lines": len(r.lines), "bytes": r.size, "dropped": r.dropped} for s, r in self.rings.items()},
+            }
+
+
+def logs_from_env(name: str) -> ServiceLogs:
+    """ServiceLogs configured from CORE_SERVICE_LOG_* (disk persistence only when CORE_SERVICE_LOG_DIR is set)."""
+    return ServiceLogs(
+        name,
+        log_dir=os.getenv("CORE_SERVICE_LOG_DIR") or None,
+        disk_max_bytes=int(os.getenv("CORE_SERVICE_LOG_FILE_BYTES", str(10 * 1024 * 1024))),
+        disk_backups=int(os.getenv("CORE_SERVICE_LOG_FILE_BACKUPS", "5")),
+        echo=os.getenv("CORE_SERVICE_LOG_ECHO", "1") in ("1", "true", "True"),
+    )
@@ -1,5 +1,6 @@
 from typing import List, Dict, Optional
 import subprocess
+import threading
 from dataclasses import dataclass, field
 
 @dataclass
@@ -16,5 +17,18 @@ class ManagedService:
     backoff_multiplier: float = 2.0
     restart_window_sec: int = 60
     restart_limit_in_window: int = 5
+    # после стольких секунд работы без падений backoff возвращается к начальному
+    restart_stable_sec: float = 60.0
+    # Health-check: свой интервал у каждого сервиса; первые секунды после старта не проверяем
+    health_interval_sec: float = 10.0
+    health_start_grace_sec: float = 30.0
+    health_failure_threshold: int = 2
+    health_timeout_sec: float = 3.0
     _restart_timestamps: List[float] = field(default_factory=list, init=False)
-    last_start_ts: float = field(default=0.0, init=False)
\ No newline at end of file
+    last_start_ts: float = field(default=0.0, init=False)
+    # Выставляется, когда сервис после старта впервые прошёл health-check
+    _ready: threading.Event = field(default_factory=threading.Event, init=False)
+    _initial_backoff_sec: int = field(default=0, init=False)
+
+    def __post_init__(self) -> None:
+        self._initial_backoff_sec = self.restart_backoff_sec
@@ -1,4 +1,4 @@
-from typing import Dict
+from typing import Any, Dict, List
 import sys
 import os
 import time
@@ -7,7 +7,11 @@ from urllib.parse import urlparse
 import threading
 import subprocess
 import signal
+from datetime import datetime, timezone
 from .ManagedService import ManagedService
+from .RestartScheduler import RestartScheduler
+from .HealthProber import HealthProber, HealthState
+from .LogBuffer import ServiceLogs, logs_from_env
 
 
 class Orchestrator:
@@ -16,6 +20,13 @@ class Orchestrator:
         self.services: Dict[str, ManagedService] = {}
         self._stop_event = threading.Event()
         self._lock = threading.Lock()
+        self.startup_timeline: Dict[str, Any] = {}
+        # Вывод сервисов: кольцевые буферы фиксированного размера (и опционально файлы с ротацией)
+        self.logs: Dict[str, ServiceLogs] = {}
+        # Таймеры рестартов: backoff и пауза троттлинга не блокируют ни монитор, ни другие сервисы
+        self.restarts = RestartScheduler(self._run_scheduled)
+        # Health-check в фоне; get_services_status читает только готовый снимок
+        self.health = HealthProber(self.services, self._is_running, self._on_health_result)
 
         # Реестр сервисов
         self.register(
@@ -47,6 +58,8 @@ class Orchestrator:
 
     def register(self, service: ManagedService) -> None:
         self.services[service.name] = service
+        if service.name not in self.logs:
+            self.logs[service.name] = logs_from_env(service.name)
 
     def _deps_healthy(self, svc: ManagedService) -> bool:
         if not svc.depends_on:
@@ -65,13 +78,20 @@ class Orchestrator:
             time.sleep(1)
         return self._deps_healthy(svc)
 
-    def _record_restart(self, svc: ManagedService) -> None:
+    def _record_restart(self, svc: ManagedService) -> float:
+        """Count the restart and return its delay: the current backoff minus the uptime."""
         now = time.time()
         svc._restart_timestamps.append(now)
         # чистим окно
         svc._restart_timestamps = [t for t in svc._restart_timestamps if now - t <= svc.restart_window_sec]
-        # экспоненциальный backoff с верхней границей
+        uptime = now - svc.last_start_ts
+        if uptime >= svc.restart_stable_sec:
+            # сервис работал стабильно — прошлые падения на backoff не влияют
+            svc.restart_backoff_sec = svc._initial_backoff_sec
+        delay = max(0.0, svc.restart_backoff_sec - uptime)
+        # экспоненциальный backoff с верхней границей — для следующего падения
         svc.restart_backoff_sec = min(int(max(1, svc.restart_backoff_sec * svc.backoff_multiplier)), svc.backoff_max_sec)
+        return delay
 
     def _should_throttle(self, svc: ManagedService) -> bool:
         now = time.time()
@@ -93,26 +113,73 @@ class Orchestrator:
                 print(f"❌ Refusing to start {svc.name}: command argument contains unsafe characters: {part}")
                 return
 
-        now = time.time()
-        backoff = max(0, svc.restart_backoff_sec - int(now - svc.last_start_ts))
-        if backoff:
-            time.sleep(backoff)
         svc.last_start_ts = time.time()
-        if self._should_throttle(svc):
-            print(f"🧯 Слишком частые рестарты {svc.name}, делаем паузу {svc.backoff_max_sec}s")
-            time.sleep(svc.backoff_max_sec)
         svc.process = subprocess.Popen(
             svc.command,
             cwd=svc.cwd or self.project_root,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             text=True,
+            errors="replace",
         )
+        svc._ready.clear()
         print(f"🚀 Запущен {svc.name} (pid={svc.process.pid})")
+        self.logs[svc.name].append("system", f"started pid={svc.process.pid}")
 
         # Потоки логов, чтобы не блокировать stdout/stderr
-        threading.Thread(target=self._pipe_output, args=(svc, True), daemon=True).start()
-        threading.Thread(target=self._pipe_output, args=(svc, False), daemon=True).start()
+        threading.Thread(target=self._pipe_output, args=(svc, svc.process, True), name=f"stdout-{svc.name}", daemon=True).start()
+        threading.Thread(target=self._pipe_output, args=(svc, svc.process, False), name=f"stderr-{svc.name}", daemon=True).start()
+        # Сторож процесса: узнаёт о завершении сразу, без опроса
+        threading.Thread(target=self._watch_child, args=(svc, svc.process), name=f"watch-{svc.name}", daemon=True).start()
+
+    def _pipe_output(self, svc: ManagedService, proc: subprocess.Popen, is_stdout: bool) -> None:
+        """Read one pipe of the child line by line into its ring buffer until EOF."""
+        pipe = proc.stdout if is_stdout else proc.stderr
+        if pipe is None:
+            return
+        stream = "stdout" if is_stdout else "stderr"
+        log = self.logs[svc.name]
+        try:
+            for line in iter(pipe.readline, ""):
+                log.append(stream, line)
+        except (OSError, ValueError, UnicodeDecodeError) as e:
+            log.append("system", f"{stream} reader stopped: {e}")
+        finally:
+            try:
+                pipe.close()
+            except OSError:
+                pass
+
+    def _watch_child(self, svc: ManagedService, proc: subprocess.Popen) -> None:
+        ret = proc.wait()
+        self.logs[svc.name].append("system", f"exited pid={proc.pid} code={ret}")
+        with self._lock:
+            # остановлен намеренно (stop/restart) или уже заменён новым процессом
+            if self._stop_event.is_set() or svc.process is not proc:
+                return
+            svc.process = None
+        print(f"⚠️  {svc.name} завершился с кодом {ret}. Перезапуск...")
+        self._schedule_restart(svc, "exit", self._record_restart(svc))
+
+    def _schedule_restart(self, svc: ManagedService, reason: str, delay: float) -> None:
+        """Put the restart on the timer heap: after the backoff, or the throttle pause if restarting too often."""
+        if self._should_throttle(svc):
+            print(f"🧯 Слишком частые рестарты {svc.name}, делаем паузу {svc.backoff_max_sec}s")
+            delay = max(delay, svc.backoff_max_sec)
+        self.restarts.schedule(svc.name, delay, reason)
+
+    def _run_scheduled(self, name: str, reason: str) -> None:
+        # Выполняется в отдельном потоке планировщика
+        svc = self.services.get(name)
+        if svc is None or self._stop_event.is_set():
+            return
+        if reason == "health":
+            self._restart_service(svc)
+        elif not self._is_running(svc):
+            self._start_service(svc)
+        if not self._is_running(svc) and not self._stop_event.is_set():
+            # зависимости так и не поднялись — пробуем позже, не блокируя остальных
+            self.restarts.schedule(name, svc.backoff_max_sec, "retry")
 
     @staticmethod
     def _http_get_ok(url: str, timeout: float = 3.0) -> bool:
@@ -138,30 +205,156 @@ class Orchestrator:
             return True
         return self._http_get_ok(svc.healthcheck_url)
 
-    def start_all(self) -> None:
+    def startup_order(self) -> List[List[str]]:
+        """Topological layers of the `depends_on` graph; raises ValueError on cycles or unknown deps."""
         for svc in self.services.values():
-            self._start_service(svc)
+            missing = [d for d in svc.depends_on if d not in self.services]
+            if missing:
+                raise ValueError(f"{svc.name} depends on unknown services: {', '.join(missing)}")
+        indegree = {name: len(set(svc.depends_on)) for name, svc in self.services.items()}
+        dependents: Dict[str, List[str]] = {name: [] for name in self.services}
+        for name, svc in self.services.items():
+            for dep in set(svc.depends_on):
+                dependents[dep].append(name)
+        layers: List[List[str]] = []
+        layer = [name for name, n in indegree.items() if n == 0]
+        while layer:
+            layers.append(layer)
+            nxt = []
+            for name in layer:
+                for child in dependents[name]:
+                    indegree[child] -= 1
+                    if indegree[child] == 0:
+                        nxt.append(child)
+            layer = nxt
+        if sum(len(l) for l in layers) != len(self.services):
+            raise ValueError(f"dependency cycle: {' -> '.join(self._find_cycle())}")
+        return layers
+
+    def _find_cycle(self) -> List[str]:
+        state: Dict[str, int] = {}  # 1 — в стеке обхода, 2 — обработан
+        stack: List[str] = []
+
+        def visit(name: str) -> List[str] | None:
+            state[name] = 1
+            stack.append(name)
+            for dep in self.services[name].depends_on:
+                if state.get(dep) == 1:
+                    return stack[stack.index(dep):] + [dep]
+                if dep not in state:
+                    found = visit(dep)
+                    if found:
+                        return found
+            stack.pop()
+            state[name] = 2
+            return None
 
-        threading.Thread(target=self._monitor_loop, daemon=True).start()
+        for name in self.services:
+            if name not in state:
+                found = visit(name)
+                if found:
+                    return found
+        return []
+
+    def _wait_ready(self, svc: ManagedService, timeout_sec: float) -> bool:
+        """Poll health every 50 ms right after launch until healthy or timeout (refused connects are cheap)."""
+        deadline = time.monotonic() + timeout_sec
+        while not self._stop_event.is_set():
+            if not self._is_running(svc):
+                return False
+            if self._check_health(svc):
+                svc._ready.set()
+                return True
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return False
+            self._stop_event.wait(min(0.05, left))
+        return False
+
+    def _boot_service(self, svc: ManagedService, t0: float, timeout_sec: float) -> None:
+        entry = self.startup_timeline[svc.name]
+        deadline = time.monotonic() + timeout_sec
+        for dep in svc.depends_on:
+            # зависимость сама выставит _ready, как только пройдёт health-check — без опроса раз в секунду
+            if not self.services[dep]._ready.wait(max(0.0, deadline - time.monotonic())):
+                entry.update(status="deps_failed", wait_sec=round(time.monotonic() - t0, 3), failed_dep=dep)
+                print(f"⏳ Зависимость {dep} для {svc.name} не готова, откладываем старт")
+                return
+        launched = time.monotonic()
+        entry.update(wait_sec=round(launched - t0, 3), launched_at=round(launched - t0, 3))
+        self._start_service(svc)
+        if not self._is_running(svc):
+            entry["status"] = "failed"
+            return
+        ok = self._wait_ready(svc, timeout_sec)
+        done = time.monotonic()
+        entry.update(status="ready" if ok else "unhealthy", boot_sec=round(done - launched, 3),
+                     ready_at=round(done - t0, 3))
+
+    def start_all(self, timeout_sec: float = 60.0) -> None:
+        """Start services along the `depends_on` graph: independent ones concurrently,
+        dependents as soon as their dependencies pass a health-check."""
+        layers = self.startup_order()
+        t0 = time.monotonic()
+        self.startup_timeline = {
+            name: {"name": name, "depends_on": list(self.services[name].depends_on), "layer": i, "status": "waiting"}
+            for i, layer in enumerate(layers) for name in layer
+        }
+        threads = [
+            threading.Thread(target=self._boot_service, args=(svc, t0, timeout_sec), name=f"boot-{svc.name}", daemon=True)
+            for svc in self.services.values()
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        ready = [e for e in self.startup_timeline.values() if e["status"] == "ready"]
+        print(f"✅ Старт завершён за {time.monotonic() - t0:.2f}s: готово {len(ready)}/{len(self.services)}")
+
+        self.health.start()
+
+    def get_startup_timeline(self) -> Dict[str, Any]:
+        services = sorted(self.startup_timeline.values(), key=lambda e: (e.get("launched_at") is None, e.get("launched_at") or 0))
+        total = max((e.get("ready_at") or 0 for e in services), default=0)
+        return {"total_sec": total, "services": services}
 
     # --- Admin helpers ---
-    def get_services_status(self) -> Dict[str, Dict[str, str]]:
-        status: Dict[str, Dict[str, str]] = {}
+    def get_services_status(self) -> Dict[str, Dict[str, Any]]:
+        """Status from the prober's snapshot: no health requests are made here."""
+        status: Dict[str, Dict[str, Any]] = {}
         for name, svc in self.services.items():
             running = self._is_running(svc)
-            healthy = self._check_health(svc) if running else False
+            state = self.health.snapshot.get(name)
+            if not svc.healthcheck_url:
+                healthy = running
+            elif state is None or state.healthy is None:
+                # до первой пробы прибер молчит (grace после старта) — берём результат _wait_ready
+                healthy = running and svc._ready.is_set()
+            else:
+                healthy = running and bool(state.healthy)
             status[name] = {
                 "name": name,
                 "running": "yes" if running else "no",
                 "healthy": "yes" if healthy else "no",
                 "pid": str(svc.process.pid) if running and svc.process else "-",
+                "last_checked": _iso(state.last_checked) if state and state.latency_ms is not None else "-",
+                "latency_ms": state.latency_ms if state and state.latency_ms is not None else "-",
+                "consecutive_failures": state.consecutive_failures if state else 0,
+                "last_error": (state.last_error or "-") if state else "-",
+                "next_restart_at": "-",
+                "restart_reason": "-",
             }
+            pending = self.restarts.next_run(name)
+            if pending:
+                status[name]["next_restart_at"] = _iso(pending[0])
+                status[name]["restart_reason"] = pending[1]
         return status
 
     def restart(self, name: str) -> bool:
         svc = self.services.get(name)
         if not svc:
             return False
+        self.restarts.cancel(name)
         self._restart_service(svc)
         return True
 
@@ -169,6 +362,7 @@ class Orchestrator:
         svc = self.services.get(name)
         if not svc:
             return False
+        self.restarts.cancel(name)
         self._stop_service(svc, graceful=graceful)
         return True
 
@@ -178,35 +372,30 @@ class Orchestrator:
             return False
         if self._is_running(svc):
             return True
+        self.restarts.cancel(name)
         self._start_service(svc)
         return True
 
-    def _monitor_loop(self) -> None:
-        while not self._stop_event.is_set():
-            time.sleep(30)  # Увеличиваем интервал с 2 до 30 секунд для уменьшения шума в логах
-            for svc in list(self.services.values()):
-                proc = svc.process
-                if proc is None:
-                    continue
-                # Проверка завершения процесса
-                ret = proc.poll()
-                if ret is not None:
-                    print(f"⚠️  {svc.name} завершился с кодом {ret}. Перезапуск...")
-                    self._record_restart(svc)
-                    self._start_service(svc)
-                    continue
-                # Healthcheck
-                if not self._check_health(svc):
-                    print(f"❌ Health-check провален у {svc.name}. Попытка мягкой перезагрузки...")
-                    self._record_restart(svc)
-                    self._restart_service(svc)
+    def _on_health_result(self, svc: ManagedService, state: HealthState) -> None:
+        # Вызывается из потока HealthProber после каждой проверки
+        if state.healthy:
+            svc._ready.set()
+            return
+        if state.consecutive_failures < svc.health_failure_threshold or self.restarts.next_run(svc.name):
+            return
+        print(f"❌ Health-check провален у {svc.name} ({state.consecutive_failures} раз подряд). Попытка мягкой перезагрузки...")
+        self._schedule_restart(svc, "health", self._record_restart(svc))
 
     def _restart_service(self, svc: ManagedService) -> None:
         self._stop_service(svc, graceful=True)
         self._start_service(svc)
 
     def _stop_service(self, svc: ManagedService, graceful: bool) -> None:
-        proc = svc.process
+        with self._lock:
+            # сначала отвязываем процесс, чтобы _watch_child не принял остановку за падение
+            proc = svc.process
+            svc.process = None
+            svc._ready.clear()
         if not proc:
             return
         try:
@@ -220,14 +409,19 @@ class Orchestrator:
                 proc.kill()
         finally:
             print(f"🛑 Остановлен {svc.name}")
-            svc.process = None
 
     def stop_all(self, graceful: bool = True) -> None:
         self._stop_event.set()
+        self.restarts.stop()
+        self.health.stop()
         for svc in list(self.services.values()):
             self._stop_service(svc, graceful=graceful)
 
 
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
 def contains_shell_meta(s: str) -> bool:
     """Module-level helper: detect shell metacharacters in a string."""
     return any(ch in s for ch in [';', '&', '|', '<', '>', '`', '$', '\\'])
\ No newline at end of file
@@ -0,0 +1,77 @@
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class RestartScheduler:
+    """Heap of per-service timers (restart after backoff, throttle pauses).
+
+    One thread sleeps until the earliest deadline and hands each due job to its own
+    short-lived worker thread, so a service that is waiting out its backoff, or whose
+    start blocks on dependencies, never delays another service's restart.
+    At most one job is pending per service; scheduling again keeps whichever of the two
+    runs earlier, so a retry or throttle pause never postpones an already due restart.
+    """
+
+    def __init__(self, run: Callable[[str, str], None]):
+        self._run = run
+        self._heap: List[Tuple[float, int, str]] = []
+        self._pending: Dict[str, Tuple[float, int, str]] = {}  # name -> (due wall time, seq, reason)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def schedule(self, name: str, delay: float, reason: str) -> float:
+        """Schedule `name` to run in `delay` seconds unless it already runs sooner; returns the wall-clock due time."""
+        due_mono = time.monotonic() + max(0.0, delay)
+        due_wall = time.time() + max(0.0, delay)
+        with self._cond:
+            if self._stopped:
+                return due_wall
+            pending = self._pending.get(name)
+            if pending is not None and pending[0] <= due_wall:
+                return pending[0]
+            seq = next(self._seq)
+            self._pending[name] = (due_wall, seq, reason)
+            heapq.heappush(self._heap, (due_mono, seq, name))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="restart-scheduler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return due_wall
+
+    def cancel(self, name: str) -> bool:
+        with self._cond:
+            # запись в куче остаётся, но без _pending она будет пропущена
+            return self._pending.pop(name, None) is not None
+
+    def next_run(self, name: str) -> Optional[Tuple[float, str]]:
+        """(due wall time, reason) of the pending job for `name`, if any."""
+        entry = self._pending.get(name)
+        return (entry[0], entry[2]) if entry else None
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._pending.clear()
+            self._heap.clear()
+            self._cond.notify()
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stopped and (not self._heap or self._heap[0][0] > time.monotonic()):
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(timeout)
+                if self._stopped:
+                    return
+                _, seq, name = heapq.heappop(self._heap)
+                entry = self._pending.get(name)
+                if entry is None or entry[1] != seq:
+                    continue  # отменено или перепланировано
+                del self._pending[name]
+                reason = entry[2]
+            threading.Thread(target=self._run, args=(name, reason), name=f"restart-{name}", daemon=True).start()
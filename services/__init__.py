@@ -1,4 +1,6 @@
 from .ManagedService import ManagedService
 from .Orchestrator import Orchestrator
+from .RestartScheduler import RestartScheduler
+from .LogBuffer import ServiceLogs
 
-__all__ = ["ManagedService", "Orchestrator"]
\ No newline at end of file
+__all__ = ["ManagedService", "Orchestrator", "RestartScheduler", "ServiceLogs"]
\ No newline at end of file
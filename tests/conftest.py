@@ -0,0 +1,20 @@
+"""Make the repository importable as the `core_service` package.
+
+The repo root is the package itself (the Docker image copies it to /app/core_service),
+and its modules use relative imports, so tests import it as `core_service.<module>`.
+"""
+import importlib.util
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# тесты не должны трогать core_admin.db в репозитории
+os.environ.setdefault("CORE_DB_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="core_service_tests_"), "core_admin.db"))
+
+if "core_service" not in sys.modules:
+    spec = importlib.util.spec_from_loader("core_service", loader=None, is_package=True)
+    package = importlib.util.module_from_spec(spec)
+    package.__path__ = [ROOT]
+    sys.modules["core_service"] = package
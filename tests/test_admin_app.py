@@ -0,0 +1,403 @@
+"""Route-level tests: the admin app in-process against a fake client_manager."""
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from core_service.admin_app import create_admin_app
+from core_service.services import Orchestrator
+from core_service.services.HealthProber import HealthState
+from core_service.upstream import UpstreamClient
+
+
+@pytest.fixture(autouse=True)
+def env(monkeypatch):
+    monkeypatch.setenv("CORE_MAINTENANCE_INITIAL_DELAY", "3600")
+    monkeypatch.setenv("CORE_PRESENCE_POLL_INTERVAL", "0")
+
+
+def make_app(handler=None, orchestrator=None):
+    app = create_admin_app(orchestrator or Orchestrator("/tmp"))
+    app.state.upstream = UpstreamClient("http://cm", transport=httpx.MockTransport(handler or (lambda req: httpx.Response(404))))
+    return app
+
+
+def run_app(app, fn, lifespan=True):
+    """Run `fn(client)` against the app, inside its lifespan unless disabled."""
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://core") as client:
+            if not lifespan:
+                return await fn(client)
+            async with app.router.lifespan_context(app):
+                return await fn(client)
+
+    return asyncio.run(main())
+
+
+def test_services_etag_survives_health_probes():
+    orch = Orchestrator("/tmp")
+    state = orch.health.snapshot["auth_service"] = HealthState(healthy=True, last_checked=1.0, latency_ms=1.0)
+    app = make_app(orchestrator=orch)
+
+    async def fn(client):
+        first = await client.get("/api/services")
+        state.latency_ms, state.last_checked = 9.9, 2.0
+        probed = await client.get("/api/services", headers={"If-None-Match": first.headers["etag"]})
+        orch.restarts.schedule("auth_service", 3600, "exit")
+        restarting = await client.get("/api/services", headers={"If-None-Match": first.headers["etag"]})
+        orch.restarts.stop()
+        return first, probed, restarting
+
+    first, probed, restarting = run_app(app, fn, lifespan=False)
+    assert first.status_code == 200
+    assert probed.status_code == 304
+    assert restarting.status_code == 200
+    assert restarting.json()["auth_service"]["restart_reason"] == "exit"
+
+
+def command_handler(slow: set = frozenset()):
+    async def handler(req: httpx.Request):
+        if req.method == "POST" and req.url.path.startswith("/api/commands/"):
+            cid = req.url.path.rsplit("/", 1)[-1]
+            if cid in slow:
+                await asyncio.sleep(30)
+            if cid == "bad":
+                return httpx.Response(500, text="agent error")
+            return httpx.Response(200, json={"success": True, "result": f"ok {cid}", "exit_code": 0})
+        return httpx.Response(200, json=[])
+    return handler
+
+
+def ndjson(resp: httpx.Response) -> list:
+    return [json.loads(line) for line in resp.text.splitlines() if line]
+
+
+def test_batch_streams_one_result_per_client():
+    app = make_app(command_handler())
+
+    async def fn(client):
+        return await client.post("/api/commands/batch", json={"clients": ["a", "b", "bad", "a"], "command": "uptime"})
+
+    resp = run_app(app, fn)
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    items = ndjson(resp)
+    assert items[0]["type"] == "start" and items[0]["targets"] == 3
+    results = {i["client_id"]: i for i in items if i["type"] == "result"}
+    assert results["a"]["ok"] and results["b"]["data"]["result"] == "ok b"
+    assert (results["bad"]["ok"], results["bad"]["status_code"]) == (False, 500)
+    assert items[-1] == {**items[-1], "type": "done", "ok": 2, "failed": 1}
+    assert len({i["command_id"] for i in results.values()}) == 3
+
+
+def test_batch_stream_finishes_when_a_task_is_cancelled():
+    app = make_app(command_handler(slow={"slow"}))
+
+    async def fn(client):
+        async def cancel_slow():
+            await asyncio.sleep(0.3)
+            for task in list(app.state.batch_tasks):
+                task.cancel()
+
+        canceller = asyncio.ensure_future(cancel_slow())
+        resp = await asyncio.wait_for(
+            client.post("/api/commands/batch", json={"clients": ["fast", "slow"], "command": "uptime"}), 10)
+        await canceller
+        return resp
+
+    items = ndjson(run_app(app, fn))
+    results = {i["client_id"]: i for i in items if i["type"] == "result"}
+    assert results["fast"]["ok"]
+    assert results["slow"]["error"] == "cancelled"
+    assert items[-1]["type"] == "done" and items[-1]["failed"] == 1
+
+
+def test_batch_requires_a_selector():
+    app = make_app(command_handler())
+
+    async def fn(client):
+        return await client.post("/api/commands/batch", json={"command": "uptime"})
+
+    assert run_app(app, fn).status_code == 400
+
+
+def test_download_streams_upstream_body_and_range_headers():
+    seen = []
+
+    def handler(req: httpx.Request):
+        seen.append((req.url.path, req.headers.get("range")))
+        if req.url.path.endswith("/missing/download"):
+            return httpx.Response(404, text="no such transfer")
+        async def body():
+            for _ in range(10):
+                yield b"x" * 100
+
+        return httpx.Response(206, content=body(), headers={
+            "content-type": "application/zip", "content-range": "bytes 100-1099/5000",
+            "accept-ranges": "bytes", "x-internal": "hidden"})
+
+    app = make_app(handler)
+
+    async def fn(client):
+        ok = await client.get("/api/files/download/t1", headers={"Range": "bytes=100-1099"})
+        missing = await client.get("/api/files/download/missing")
+        return ok, missing
+
+    ok, missing = run_app(app, fn, lifespan=False)
+    assert seen == [("/api/files/transfers/t1/download", "bytes=100-1099"),
+                    ("/api/files/transfers/missing/download", None)]
+    assert ok.status_code == 206
+    assert ok.content == b"x" * 1000
+    assert ok.headers["content-type"] == "application/zip"
+    assert ok.headers["content-range"] == "bytes 100-1099/5000"
+    assert "x-internal" not in ok.headers
+    assert missing.status_code == 404 and "no such transfer" in missing.text
+
+
+def test_streaming_upload_is_piped_to_client_manager():
+    from core_service.upload_stream import MultipartPipe
+
+    payload = b"z" * 300_000
+    received = {}
+
+    async def handler(req: httpx.Request):
+        pipe = MultipartPipe(req.headers["content-type"])
+        producer = asyncio.ensure_future(pipe.run(req.stream))
+        await pipe.wait_file_start()
+        received["file"] = b"".join([c async for c in pipe.file_chunks()])
+        await producer
+        received["fields"], received["filename"] = pipe.fields, pipe.filename
+        return httpx.Response(200, json={"transfer_id": "t1"})
+
+    app = make_app(handler)
+
+    async def fn(client):
+        files = {"file": ("dump.bin", payload, "application/octet-stream")}
+        stream = await client.post("/api/files/upload/stream", data={"client_id": "c1", "dest_path": "/srv/dump.bin"}, files=files)
+        missing = await client.post("/api/files/upload/stream", files=files)
+        return stream, missing
+
+    stream, missing = run_app(app, fn, lifespan=False)
+    assert stream.status_code == 200 and stream.json() == {"transfer_id": "t1"}
+    assert received["file"] == payload
+    assert received["filename"] == "dump.bin"
+    assert received["fields"] == {"client_id": "c1", "path": "/srv/dump.bin", "original_filename": "dump.bin", "direction": "upload"}
+    assert missing.status_code == 400
+
+
+@pytest.fixture
+def client_table():
+    from sqlalchemy import delete
+
+    from core_service.db import engine, get_session
+    from core_service.models import Base, Client
+
+    Base.metadata.create_all(bind=engine)
+    with get_session() as db:
+        db.execute(delete(Client))
+    yield
+    with get_session() as db:
+        db.execute(delete(Client))
+
+
+def flaky_clients(state: dict):
+    def handler(req: httpx.Request):
+        if state["down"]:
+            raise httpx.ConnectError("connection refused", request=req)
+        return httpx.Response(200, json=[{"id": "a", "hostname": "alpha", "status": "online",
+                                          "last_heartbeat": "2026-10-17T10:00:00Z"}])
+    return handler
+
+
+def test_clients_fall_back_to_the_presence_index_when_upstream_is_down():
+    state = {"down": False}
+    app = make_app(flaky_clients(state))
+
+    async def fn(client):
+        live = await client.get("/api/clients")
+        state["down"] = True
+        await client.post("/api/cache/flush", params={"key": "clients"})
+        return live, await client.get("/api/clients")
+
+    live, fallback = run_app(app, fn, lifespan=False)
+    assert "x-data-source" not in live.headers
+    assert fallback.status_code == 200
+    assert fallback.headers["x-data-source"] == "snapshot"
+    assert "connection refused" in fallback.headers["x-upstream-error"]
+    [item] = fallback.json()
+    assert item["id"] == "a" and item["hostname"] == "alpha" and item["stale"] is True
+
+
+def test_clients_fall_back_to_the_stored_snapshot_on_a_cold_start(client_table):
+    from core_service.client_snapshot import normalize_client, write_rows
+
+    write_rows([{**normalize_client({"id": "b", "hostname": "beta", "status": "offline"}), "updated_at": None}])
+    app = make_app(flaky_clients({"down": True}))
+
+    async def fn(client):
+        return await client.get("/api/clients")
+
+    resp = run_app(app, fn, lifespan=False)
+    assert resp.headers["x-data-source"] == "snapshot"
+    assert [(c["id"], c["status"], c["stale"]) for c in resp.json()] == [("b", "offline", True)]
+
+
+def test_clients_without_any_snapshot_report_503(client_table):
+    app = make_app(flaky_clients({"down": True}))
+
+    async def fn(client):
+        return await client.get("/api/clients")
+
+    assert run_app(app, fn, lifespan=False).status_code == 503
+
+
+@pytest.fixture
+def command_logs():
+    from sqlalchemy import delete
+
+    from core_service.db import get_session
+    from core_service.models import CommandLog
+
+    def clear():
+        with get_session() as db:
+            db.execute(delete(CommandLog))
+
+    def seed():
+        from datetime import datetime
+
+        from core_service.output_store import set_output
+
+        clear()
+        rows = [
+            ("c1", "df -h", "success", "/dev/sda1 42% /", 10),
+            ("c1", "uptime", "success", "load average: 0.42", 11),
+            ("c2", "journalctl -u nginx", "error", "nginx: bind() failed (98: Address in use)", 11),
+            ("c2", "cat /var/log/big", "success", "head\n" + "filler " * 2000 + "\npanic: disk quota", 12),
+            ("c3", 'echo "quoted" OR NOT', "success", "quoted", 13),
+        ]
+        with get_session() as db:
+            for i, (client_id, command, status, out, hour) in enumerate(rows):
+                log = CommandLog(id=f"cmd{i}", client_id=client_id, command=command, status=status,
+                                 created_at=datetime(2026, 10, 17, hour))
+                set_output(db, log, "stdout", out)
+                set_output(db, log, "stderr", None)
+                db.add(log)
+
+    yield seed
+    clear()
+
+
+def test_command_log_keyset_pages_filters_and_search(command_logs):
+    app = make_app()
+
+    async def fn(client):
+        command_logs()
+        pages, cursor = [], None
+        while True:
+            page = (await client.get("/api/commands/log", params={"limit": 2, **({"cursor": cursor} if cursor else {})})).json()
+            pages.append([i["id"] for i in page["items"]])
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+        by_client = (await client.get("/api/commands/log", params={"client_id": "c2", "status": "error"})).json()
+        search = {q: (await client.get("/api/commands/log", params={"q": q})).json()
+                  for q in ("nginx bind", "panic", "filler", '"quoted" OR', "")}
+        bad = await client.get("/api/commands/log", params={"cursor": "a"})
+        full = (await client.get("/api/commands/log/cmd3")).json()
+        return pages, by_client, search, bad, full
+
+    pages, by_client, search, bad, full = run_app(app, fn)
+    # одинаковый created_at упорядочен по id, страницы не теряют и не повторяют строки
+    assert pages == [["cmd4", "cmd3"], ["cmd2", "cmd1"], ["cmd0"]]
+    assert [i["id"] for i in by_client["items"]] == ["cmd2"]
+    assert [i["id"] for i in search["nginx bind"]["items"]] == ["cmd2"]
+    assert search["nginx bind"]["search"] == "fts5"
+    # хвост большого вывода остаётся в превью, середина — нет (ищется только превью)
+    assert [i["id"] for i in search["panic"]["items"]] == ["cmd3"]
+    assert search["filler"]["items"][0]["stdout_truncated"] is True
+    assert [i["id"] for i in search['"quoted" OR']["items"]] == ["cmd4"]
+    assert len(search[""]["items"]) == 5 and search[""]["search"] is None
+    assert bad.status_code == 400
+    assert full["stdout"].endswith("panic: disk quota") and "filler " * 2000 in full["stdout"]
+
+
+def sse(resp: httpx.Response) -> list:
+    events = []
+    for block in resp.text.split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if ": " in line and not line.startswith(":"))
+        if "event" in fields:
+            events.append((fields["event"], fields.get("id"), json.loads(fields["data"])))
+    return events
+
+
+def test_async_command_output_streams_resumes_and_replays(command_logs):
+    def handler(req: httpx.Request):
+        if req.method == "POST" and req.url.path == "/api/commands/c1":
+            lines = [{"stream": "stdout", "data": "a\n"}, {"stream": "stderr", "data": "b\n"},
+                     {"stream": "stdout", "data": "c\n"}, {"success": True, "exit_code": 0}]
+            return httpx.Response(200, content="".join(json.dumps(x) + "\n" for x in lines).encode(),
+                                  headers={"content-type": "application/x-ndjson"})
+        return httpx.Response(200, json=[])
+
+    app = make_app(handler)
+
+    async def fn(client):
+        started = await client.post("/api/commands/c1", params={"mode": "async"}, json={"command": "ls"})
+        cid = started.json()["command_id"]
+        full = await client.get(f"/api/commands/{cid}/stream")
+        resumed = await client.get(f"/api/commands/{cid}/stream", headers={"Last-Event-ID": "0"})
+        await asyncio.to_thread(app.state.writes.flush, 5)
+        app.state.command_streams._streams.clear()
+        replayed = await client.get(f"/api/commands/{cid}/stream")
+        return started, full, resumed, replayed
+
+    started, full, resumed, replayed = run_app(app, fn)
+    assert started.status_code == 202
+    assert [(e, i, d.get("data")) for e, i, d in sse(full)] == [
+        ("chunk", "0", "a\n"), ("chunk", "1", "b\n"), ("chunk", "2", "c\n"), ("done", None, None)]
+    assert sse(full)[-1][2]["status"] == "success"
+    assert [i for _, i, _ in sse(resumed)] == ["1", "2", None]
+    assert [(e, d.get("stream"), d.get("data")) for e, _, d in sse(replayed)] == [
+        ("chunk", "stdout", "a\nc\n"), ("chunk", "stderr", "b\n"), ("done", None, None)]
+    assert sse(replayed)[-1][2]["source"] == "log"
+
+
+def test_presence_routes_query_the_index():
+    from datetime import datetime, timedelta
+
+    app = make_app()
+    old = (datetime.utcnow() - timedelta(minutes=10)).isoformat()
+    app.state.presence.apply_snapshot([
+        {"id": "a", "hostname": "alpha", "ip": "10.0.0.1", "status": "online", "last_heartbeat": datetime.utcnow().isoformat()},
+        {"id": "b", "hostname": "beta", "ip": "10.0.0.2", "status": "online", "last_heartbeat": old},
+    ])
+
+    async def fn(client):
+        return {path: await client.get(path) for path in (
+            "/api/presence/summary", "/api/presence/stale?older_than=60", "/api/presence/lookup?hostname=beta",
+            "/api/presence/lookup", "/api/presence/clients/a", "/api/presence/clients/zzz")}
+
+    r = run_app(app, fn, lifespan=False)
+    assert r["/api/presence/summary"].json()["by_status"] == {"online": 2}
+    assert r["/api/presence/summary"].json()["stale"] == 1
+    stale = r["/api/presence/stale?older_than=60"].json()
+    assert stale["count"] == 1 and [c["id"] for c in stale["items"]] == ["b"]
+    assert [c["id"] for c in r["/api/presence/lookup?hostname=beta"].json()] == ["b"]
+    assert r["/api/presence/lookup"].status_code == 400
+    assert r["/api/presence/clients/a"].json()["hostname"] == "alpha"
+    assert r["/api/presence/clients/zzz"].status_code == 404
+
+
+def test_heartbeat_ingest_route():
+    app = make_app()
+
+    async def fn(client):
+        ok = await client.post("/api/presence/heartbeats", content=b'{"id": "a", "at": 1700000000}\n{"id": "b"}\n',
+                               headers={"Content-Type": "application/x-ndjson"})
+        bad = await client.post("/api/presence/heartbeats", content=b'{"id": "a"}\n{oops\n')
+        return ok, bad
+
+    ok, bad = run_app(app, fn, lifespan=False)
+    assert ok.json() == {"accepted": 2, "ignored": 0, "rejected": 0}
+    assert app.state.presence.get("a")["last_heartbeat"] == "2023-11-14T22:13:20"
+    assert bad.status_code == 400 and "line 2" in bad.json()["detail"]
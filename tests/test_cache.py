@@ -0,0 +1,191 @@
+import asyncio
+
+import pytest
+
+from core_service.cache import CachePolicy, SWRCache
+
+
+class Loader:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = 0
+        self.fail = False
+
+    async def __call__(self):
+        self.calls += 1
+        n = self.calls
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("upstream down")
+        return n
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_fresh_entry_is_served_from_cache():
+    async def main():
+        cache, load = SWRCache(), Loader()
+        policy = CachePolicy(ttl=60, stale_ttl=60)
+        return [await cache.get("k", load, policy) for _ in range(3)], cache.stats()
+
+    values, stats = run(main())
+    assert values == [1, 1, 1]
+    assert stats["misses"] == 1
+    assert stats["hits"] == 2
+
+
+def test_stale_entry_is_served_while_refreshing():
+    async def main():
+        cache, load = SWRCache(), Loader()
+        policy = CachePolicy(ttl=0.01, stale_ttl=60)
+        first = await cache.get("k", load, policy)
+        await asyncio.sleep(0.02)
+        stale = await cache.get("k", load, policy)
+        await asyncio.sleep(0.01)
+        return first, stale, cache.peek("k"), cache.stats()
+
+    first, stale, refreshed, stats = run(main())
+    assert (first, stale, refreshed) == (1, 1, 2)
+    assert stats["stale_hits"] == 1
+    assert stats["refreshes"] == 1
+
+
+def test_expired_entry_is_reloaded():
+    async def main():
+        cache, load = SWRCache(), Loader()
+        policy = CachePolicy(ttl=0.01, stale_ttl=0.01)
+        await cache.get("k", load, policy)
+        await asyncio.sleep(0.03)
+        return await cache.get("k", load, policy)
+
+    assert run(main()) == 2
+
+
+def test_failed_background_refresh_keeps_stale_value():
+    async def main():
+        cache, load = SWRCache(), Loader()
+        policy = CachePolicy(ttl=0.01, stale_ttl=60)
+        await cache.get("k", load, policy)
+        await asyncio.sleep(0.02)
+        load.fail = True
+        value = await cache.get("k", load, policy)
+        await asyncio.sleep(0.01)
+        return value, cache.peek("k"), cache.stats()["refresh_errors"]
+
+    assert run(main()) == (1, 1, 1)
+
+
+def test_invalidate_drops_entry():
+    async def main():
+        cache, load = SWRCache(), Loader()
+        policy = CachePolicy(ttl=60, stale_ttl=60)
+        await cache.get("k", load, policy)
+        cache.invalidate("k")
+        return await cache.get("k", load, policy), cache.stats()["invalidations"]
+
+    assert run(main()) == (2, 1)
+
+
+def test_load_started_before_invalidate_is_not_joined_or_stored():
+    async def main():
+        cache, load = SWRCache(), Loader(delay=0.02)
+        policy = CachePolicy(ttl=60, stale_ttl=60)
+        before = asyncio.ensure_future(cache.get("k", load, policy))
+        await asyncio.sleep(0.005)
+        cache.invalidate("k")
+        after = await cache.get("k", load, policy)
+        return await before, after, cache.peek("k")
+
+    before, after, cached = run(main())
+    assert before == 1
+    # запрос после инвалидации не должен получить результат загрузки, начатой до неё
+    assert after == 2
+    assert cached == 2
+
+
+def test_refresh_reloads_fresh_entry():
+    async def main():
+        cache, load = SWRCache(), Loader()
+        policy = CachePolicy(ttl=60, stale_ttl=60)
+        await cache.get("k", load, policy)
+        return await cache.refresh("k", load, policy), cache.stats()["invalidations"]
+
+    assert run(main()) == (2, 0)
+
+
+def test_refresh_failure_keeps_cached_value():
+    async def main():
+        cache, load = SWRCache(), Loader()
+        policy = CachePolicy(ttl=60, stale_ttl=60)
+        await cache.get("k", load, policy)
+        load.fail = True
+        return await cache.refresh("k", load, policy), cache.peek("k")
+
+    assert run(main()) == (1, 1)
+
+
+def test_refresh_failure_without_cached_value_raises():
+    async def main():
+        cache, load = SWRCache(), Loader()
+        load.fail = True
+        await cache.refresh("k", load, CachePolicy(ttl=60, stale_ttl=60))
+
+    with pytest.raises(RuntimeError):
+        run(main())
+
+
+def test_lru_eviction():
+    async def main():
+        cache = SWRCache(max_entries=2)
+        policy = CachePolicy(ttl=60, stale_ttl=60)
+        for key in ("a", "b", "c"):
+            await cache.get(key, Loader(), policy)
+        return cache.stats()
+
+    stats = run(main())
+    assert list(stats["keys"]) == ["b", "c"]
+    assert stats["evictions"] == 1
+
+
+def test_invalidate_prefix():
+    async def main():
+        cache = SWRCache()
+        policy = CachePolicy(ttl=60, stale_ttl=60)
+        for key in ("history:a", "history:b", "clients"):
+            await cache.get(key, Loader(), policy)
+        cache.invalidate_prefix("history:")
+        return list(cache.stats()["keys"])
+
+    assert run(main()) == ["clients"]
+
+
+def test_generations_do_not_outlive_their_keys():
+    async def main():
+        cache = SWRCache(max_entries=2)
+        policy = CachePolicy(ttl=60, stale_ttl=60)
+        for i in range(50):
+            await cache.get(f"k{i}", Loader(), policy)
+            cache.invalidate(f"k{i}", f"gone{i}")
+            await cache.get(f"k{i}", Loader(), policy)
+        return cache._generation, cache._loading
+
+    generation, loading = run(main())
+    assert set(generation) <= {"k48", "k49"}
+    assert loading == {}
+
+
+def test_generation_is_kept_while_a_load_is_in_flight():
+    async def main():
+        cache, load = SWRCache(max_entries=1), Loader(delay=0.02)
+        policy = CachePolicy(ttl=60, stale_ttl=60)
+        before = asyncio.ensure_future(cache.get("k", load, policy))
+        await asyncio.sleep(0.005)
+        cache.invalidate("k")
+        # вытеснение другого ключа не должно сбросить поколение "k"
+        await cache.get("other", Loader(), policy)
+        await before
+        return cache.peek("k"), await cache.get("k", load, policy)
+
+    assert run(main()) == (None, 2)
@@ -0,0 +1,73 @@
+import pytest
+from sqlalchemy import delete
+
+from core_service.client_snapshot import read_snapshot, write_rows
+from core_service.db import engine, get_session
+from core_service.models import Base, Client
+from core_service.presence import PresenceIndex
+
+
+@pytest.fixture(autouse=True)
+def tables():
+    Base.metadata.create_all(bind=engine)
+    clear()
+    yield
+    clear()
+
+
+def clear() -> None:
+    with get_session() as db:
+        db.execute(delete(Client))
+
+
+def client(cid: str, **kw) -> dict:
+    return {"id": cid, "hostname": f"host-{cid}", "ip": "10.0.0.1", "port": 9000, "status": "online",
+            "connected_at": "2026-10-17T10:00:00Z", "last_heartbeat": "2026-10-17T10:05:00Z", **kw}
+
+
+def flush(index: PresenceIndex) -> int:
+    return write_rows(index.take_dirty(), index.take_removed())
+
+
+def stored_ids() -> list:
+    return [c["id"] for c in read_snapshot()]
+
+
+def test_snapshot_diff_counts_only_changed_rows():
+    index = PresenceIndex()
+    assert index.apply_snapshot([client("a"), client("b")]) == {"inserted": 2, "updated": 0, "unchanged": 0, "removed": 0}
+    assert flush(index) == 2
+    counts = index.apply_snapshot([client("a"), client("b", status="offline")])
+    assert counts == {"inserted": 0, "updated": 1, "unchanged": 1, "removed": 0}
+    assert [r["id"] for r in index.take_dirty()] == ["b"]
+
+
+def test_removed_clients_leave_the_fallback_snapshot():
+    index = PresenceIndex()
+    index.apply_snapshot([client("a"), client("b"), client("c")])
+    flush(index)
+    assert stored_ids() == ["a", "b", "c"]
+
+    assert index.apply_snapshot([client("a"), client("c")])["removed"] == 1
+    assert flush(index) == 1
+    assert stored_ids() == ["a", "c"]
+
+
+def test_failed_delete_is_retried_unless_the_client_came_back():
+    index = PresenceIndex()
+    index.apply_snapshot([client("a"), client("b")])
+    flush(index)
+    index.apply_snapshot([client("a")])
+    removed = index.take_removed()
+    assert removed == ["b"]
+
+    # запись не удалась — id возвращается в очередь на удаление
+    index.mark_removed(removed)
+    assert index.take_removed() == ["b"]
+
+    index.apply_snapshot([client("a")])
+    index.heartbeat_many([{"id": "b", "at": "2026-10-17T10:06:00Z"}])
+    index.mark_removed(["b"])
+    assert index.take_removed() == []
+    flush(index)
+    assert stored_ids() == ["a", "b"]
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from core_service.coalesce import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    async def main():
+        sf = SingleFlight()
+        results = await asyncio.gather(*(sf.do("k", fetch) for _ in range(5)))
+        return sf, results
+
+    sf, results = asyncio.run(main())
+    assert calls == 1
+    assert results == [1] * 5
+    assert sf.stats()["originated"] == 1
+    assert sf.stats()["coalesced"] == 4
+    assert sf.in_flight() == 0
+
+
+def test_sequential_calls_are_not_coalesced():
+    async def main():
+        sf = SingleFlight()
+        await sf.do("k", lambda: asyncio.sleep(0, result=1))
+        await sf.do("k", lambda: asyncio.sleep(0, result=2))
+        return sf.stats()
+
+    stats = asyncio.run(main())
+    assert stats["originated"] == 2
+    assert stats["coalesced"] == 0
+
+
+def test_error_is_shared_by_all_waiters():
+    async def boom():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream down")
+
+    async def main():
+        sf = SingleFlight()
+        return await asyncio.gather(sf.do("k", boom), sf.do("k", boom), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def test_cancelled_caller_does_not_cancel_the_call():
+    async def main():
+        sf = SingleFlight()
+        slow = lambda: asyncio.sleep(0.05, result="done")
+        first = asyncio.ensure_future(sf.do("k", slow))
+        second = asyncio.ensure_future(sf.do("k", slow))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == "done"
+
+
+def test_stats_are_kept_per_label_and_bounded():
+    async def main():
+        sf = SingleFlight(max_labels=2)
+        for i in range(50):
+            await sf.do(f"GET /api/commands/{i}", lambda: asyncio.sleep(0), label="GET /api/commands/{command_id}")
+        await sf.do("a", lambda: asyncio.sleep(0))
+        await sf.do("b", lambda: asyncio.sleep(0))
+        return sf.stats()
+
+    stats = asyncio.run(main())
+    assert list(stats["keys"]) == ["a", "b"]
+    # итоги не теряются при вытеснении меток
+    assert stats["originated"] == 52
+
+
+@pytest.mark.parametrize("label", [None, "route"])
+def test_label_defaults_to_key(label):
+    async def main():
+        sf = SingleFlight()
+        await sf.do("key", lambda: asyncio.sleep(0), label=label)
+        return sf.stats()["keys"]
+
+    assert list(asyncio.run(main())) == [label or "key"]
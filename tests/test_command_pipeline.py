@@ -0,0 +1,19 @@
+import asyncio
+
+from sqlalchemy import delete
+
+from core_service.bench.command_pipeline import _run
+from core_service.db import get_session
+from core_service.models import CommandLog
+
+
+def test_every_command_is_logged_under_the_id_sent_upstream(monkeypatch):
+    monkeypatch.setenv("CORE_MAINTENANCE_INITIAL_DELAY", "3600")
+    monkeypatch.setenv("CORE_PRESENCE_POLL_INTERVAL", "0")
+    # бенч считает строки всей таблицы, а база у тестов общая
+    with get_session() as db:
+        db.execute(delete(CommandLog))
+    result = asyncio.run(_run(n=200, concurrency=20, upstream_delay=0.0, clients=10))
+    assert result["http_errors"] == 0
+    assert result["log_rows_success"] == 200
+    assert result["ids_match_upstream"]
@@ -0,0 +1,102 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from sqlalchemy import delete
+
+from core_service.command_stream import OutputStream, run_streaming
+from core_service.db import engine, get_session
+from core_service.models import Base, CommandLog
+from core_service.upstream import UpstreamClient
+from core_service.writebehind import WriteBehindQueue
+
+
+@pytest.fixture(autouse=True)
+def tables():
+    Base.metadata.create_all(bind=engine)
+    clear()
+    yield
+    clear()
+
+
+def clear() -> None:
+    with get_session() as db:
+        db.execute(delete(CommandLog))
+
+
+def ndjson_handler(lines: list, status: int = 200):
+    def handler(req: httpx.Request):
+        assert json.loads(req.content)["stream"] is True
+        body = "".join(json.dumps(line) + "\n" if isinstance(line, dict) else line for line in lines)
+        return httpx.Response(status, content=body.encode(), headers={"content-type": "application/x-ndjson"})
+    return handler
+
+
+def execute(handler, command_id: str = "cmd1") -> tuple[OutputStream, dict]:
+    with get_session() as db:
+        db.add(CommandLog(id=command_id, client_id="c1", command="tail -f", status="queued"))
+    writes = WriteBehindQueue()
+    done = []
+
+    async def main():
+        upstream = UpstreamClient("http://cm", transport=httpx.MockTransport(handler))
+        out = OutputStream(command_id, "c1")
+        try:
+            await run_streaming(upstream, writes, out, {"command": "tail -f"}, flush_interval=0, on_done=done.append)
+        finally:
+            await upstream.aclose()
+        return out
+
+    out = asyncio.run(main())
+    writes.flush(5)
+    writes.stop()
+    assert done == [out]
+    with get_session() as db:
+        log = db.get(CommandLog, command_id)
+        return out, {k: getattr(log, k) for k in ("status", "exit_code", "stdout", "stderr", "finished_at")}
+
+
+def test_ndjson_chunks_are_buffered_and_logged():
+    out, log = execute(ndjson_handler([
+        {"stream": "stdout", "data": "line 1\n"},
+        "\n",
+        {"stream": "stderr", "data": "warn\n"},
+        "not json\n",
+        {"stream": "stdout", "data": "line 2\n"},
+        {"success": True, "exit_code": 0},
+    ]))
+    assert [(o, s) for o, s, _ in out.since(0)] == [(0, "stdout"), (1, "stderr"), (2, "stdout"), (3, "stdout")]
+    assert out.since(2)[0] == (2, "stdout", "not json\n")
+    assert (out.status, out.exit_code, out.done) == ("success", 0, True)
+    assert log["status"] == "success" and log["exit_code"] == 0 and log["finished_at"] is not None
+    assert log["stdout"] == "line 1\nnot json\nline 2\n"
+    assert log["stderr"] == "warn\n"
+
+
+def test_single_json_answer_from_older_client_manager():
+    out, log = execute(lambda req: httpx.Response(200, json={"success": False, "result": "partial", "error": "boom", "exit_code": 2}))
+    assert [(s, d) for _, s, d in out.since(0)] == [("stdout", "partial"), ("stderr", "boom")]
+    assert [log[k] for k in ("status", "exit_code", "stdout", "stderr")] == ["failed", 2, "partial", "boom"]
+
+
+def test_upstream_error_finishes_the_command():
+    out, log = execute(lambda req: httpx.Response(404, text="client not connected"))
+    assert out.status == "error"
+    assert log["status"] == "error" and log["stderr"] == "client not connected"
+
+
+def test_evicted_chunks_move_the_first_offset():
+    async def main():
+        out = OutputStream("cmd", "c1", max_chunks=3)
+        for i in range(5):
+            out.append("stdout", f"{i}\n")
+        waiter = asyncio.ensure_future(out.wait(out.next_offset, 1))
+        await asyncio.sleep(0)
+        out.finish("success", 0)
+        return out, await waiter, await out.wait(out.next_offset, 0.01)
+
+    out, woke, done = asyncio.run(main())
+    assert out.first_offset == 2 and [o for o, _, _ in out.since(0)] == [2, 3, 4]
+    assert out.full_text("stdout") == "0\n1\n2\n3\n4\n"
+    assert woke and done
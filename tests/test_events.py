@@ -0,0 +1,75 @@
+import asyncio
+
+from core_service.events import EventBus, diff_by_id
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_new_subscriber_gets_snapshots_then_live_events():
+    async def main():
+        bus = EventBus()
+        bus.publish("services", {"upserted": [1]}, snapshot={"items": [1]})
+        bus.publish("log", {"line": "dropped before subscribe"})
+        async with bus.subscribe() as sub:
+            bus.publish("log", {"line": "live"})
+            return [await sub.get(0.1) for _ in range(2)], await sub.get(0.01)
+
+    (snap, live), idle = run(main())
+    assert (snap.seq, snap.type) == (1, "services")
+    assert 'data: {"items": [1]}' in snap.frame
+    assert (live.type, live.seq) == ("log", 3)
+    assert live.frame == 'id: 3\nevent: log\ndata: {"line": "live"}\n\n'
+    assert idle is None
+
+
+def test_slow_subscriber_is_dropped_without_blocking_others():
+    async def main():
+        bus = EventBus(queue_size=2)
+        async with bus.subscribe() as slow, bus.subscribe() as fast:
+            for i in range(3):
+                bus.publish("tick", i)
+                await fast.get(0.1)
+            return slow.closed, (await slow.get(0.1)).type, fast.closed, bus.stats()
+
+    closed, last, fast_closed, stats = run(main())
+    assert closed and last == "closed"
+    assert not fast_closed
+    assert stats["dropped_subscribers"] == 1
+
+
+def test_producer_runs_only_while_subscribed():
+    async def main():
+        started = []
+
+        async def producer(bus):
+            started.append(1)
+            bus.publish("services", "up", snapshot="up")
+            await asyncio.Event().wait()
+
+        bus = EventBus(producer, idle_timeout=0.02)
+        async with bus.subscribe() as sub:
+            first = await sub.get(0.1)
+            async with bus.subscribe():
+                pass
+            running = bus.stats()["producer_running"]
+        await asyncio.sleep(0.05)
+        after = bus.stats()
+        await bus.close()
+        return first.type, running, after, len(started)
+
+    first, running, after, starts = run(main())
+    assert first == "services"
+    assert running
+    assert not after["producer_running"]
+    # устаревший снапшот не отдаётся после остановки продюсера
+    assert after["snapshots"] == []
+    assert starts == 1
+
+
+def test_diff_by_id_compares_only_listed_fields():
+    prev, upserted, removed = diff_by_id({}, [{"id": "a", "status": "up", "hb": 1}, {"id": "b", "status": "up"}], ("status",))
+    assert [i["id"] for i in upserted] == ["a", "b"] and removed == []
+    _, upserted, removed = diff_by_id(prev, [{"id": "a", "status": "up", "hb": 2}, {"no_id": True}], ("status",))
+    assert upserted == [] and removed == ["b"]
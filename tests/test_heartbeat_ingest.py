@@ -0,0 +1,28 @@
+import asyncio
+
+import pytest
+from sqlalchemy import delete
+
+from core_service.bench.heartbeat_ingest import _run
+from core_service.db import engine, get_session
+from core_service.models import Base, Client
+
+
+@pytest.mark.parametrize("fmt", ["ndjson", "msgpack"])
+def test_every_client_last_heartbeat_is_persisted(monkeypatch, fmt):
+    monkeypatch.setenv("CORE_MAINTENANCE_INITIAL_DELAY", "3600")
+    monkeypatch.setenv("CORE_PRESENCE_POLL_INTERVAL", "0")
+    # бенч считает строки всей таблицы, а база у тестов общая
+    Base.metadata.create_all(bind=engine)
+    with get_session() as db:
+        db.execute(delete(Client))
+    try:
+        # батчи по одному: при параллельной отправке более ранний батч законно отбрасывается как устаревший
+        result = asyncio.run(_run(clients=500, heartbeats=5000, batch=500, concurrency=1, fmt=fmt))
+    finally:
+        with get_session() as db:
+            db.execute(delete(Client))
+    assert result["http_errors"] == 0
+    assert result["accepted"] == 5000
+    assert result["persisted_rows"] == 500 and result["client_rows"] == 500
+    assert result["last_heartbeat_persisted"]
@@ -0,0 +1,19 @@
+import re
+
+from core_service.ids import new_command_id, ulid
+
+
+def test_ulid_format():
+    value = ulid()
+    assert re.fullmatch(r"[0-9A-HJKMNP-TV-Z]{26}", value)
+
+
+def test_ulids_are_strictly_increasing():
+    # тысячи id укладываются в несколько миллисекунд: порядок держит инкремент случайной части
+    ids = [ulid() for _ in range(5000)]
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+
+
+def test_command_id_prefix():
+    assert new_command_id().startswith("cmd_")
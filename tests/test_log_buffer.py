@@ -0,0 +1,44 @@
+from core_service.services.LogBuffer import MAX_LINE, LogLine, LogRing, ServiceLogs
+
+
+def test_ring_is_bounded_by_lines():
+    ring = LogRing(max_lines=3, max_bytes=1 << 20)
+    for i in range(5):
+        ring.append(LogLine(i, 0.0, "stdout", f"line {i}"))
+    assert [e.seq for e in ring.lines] == [2, 3, 4]
+    assert ring.dropped == 2
+    assert ring.size == sum(len(e.line) for e in ring.lines)
+
+
+def test_ring_is_bounded_by_bytes():
+    ring = LogRing(max_lines=100, max_bytes=10)
+    for i in range(4):
+        ring.append(LogLine(i, 0.0, "stdout", "x" * 4))
+    assert ring.size <= 10
+    assert [e.seq for e in ring.lines] == [2, 3]
+
+
+def test_oversized_line_is_kept_alone():
+    ring = LogRing(max_lines=10, max_bytes=5)
+    ring.append(LogLine(1, 0.0, "stdout", "x" * 50))
+    assert len(ring.lines) == 1
+
+
+def test_query_merges_streams_in_sequence_order():
+    logs = ServiceLogs("svc")
+    logs.append("stdout", "a\n")
+    logs.append("stderr", "b\n")
+    logs.append("system", "c")
+    logs.append("stdout", "d")
+    assert [e.line for e in logs.query()] == ["a", "b", "c", "d"]
+    assert [e.line for e in logs.query(tail=2)] == ["c", "d"]
+    assert [e.line for e in logs.query(since_seq=2)] == ["c", "d"]
+    assert [e.line for e in logs.query(stream="stdout")] == ["a", "d"]
+
+
+def test_long_lines_are_truncated():
+    logs = ServiceLogs("svc")
+    logs.append("stdout", "x" * (MAX_LINE + 10))
+    line = logs.query()[0].line
+    assert line.startswith("x" * MAX_LINE)
+    assert line.endswith("[10 chars truncated]")
@@ -0,0 +1,95 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, select
+
+from core_service import maintenance
+from core_service.db import engine, get_session
+from core_service.models import Base, CommandDailyRollup, CommandLog
+
+
+TODAY = date(2026, 10, 17)
+KEEP_DAYS = 5
+
+
+@pytest.fixture(autouse=True)
+def tables(monkeypatch):
+    Base.metadata.create_all(bind=engine)
+    monkeypatch.setitem(maintenance.RETENTION_DAYS, "command_logs", KEEP_DAYS)
+    clear()
+    yield
+    clear()
+
+
+def clear() -> None:
+    with get_session() as db:
+        db.execute(delete(CommandLog))
+        db.execute(delete(CommandDailyRollup))
+
+
+def add_logs(day: date, n: int, hour: int = 12) -> None:
+    with get_session() as db:
+        db.add_all([CommandLog(id=f"{day}-{hour}-{i}", client_id="c1", command="uptime", status="success",
+                               created_at=datetime(day.year, day.month, day.day, hour)) for i in range(n)])
+
+
+def rollups() -> dict:
+    with get_session() as db:
+        return {r.day: r.count for r in db.execute(select(CommandDailyRollup)).scalars()}
+
+
+def test_rollup_counts_complete_days():
+    add_logs(TODAY - timedelta(days=2), 3)
+    add_logs(TODAY - timedelta(days=1), 2)
+    add_logs(TODAY, 7)  # текущий день ещё не закончен
+    maintenance.rollup_commands(TODAY)
+    assert rollups() == {TODAY - timedelta(days=2): 3, TODAY - timedelta(days=1): 2}
+
+
+def test_lagging_rollup_keeps_days_partly_pruned_by_retention():
+    partial = TODAY - timedelta(days=KEEP_DAYS)
+    with get_session() as db:
+        # роллап отстал: последний сохранён задолго до окна ретенции, а день partial посчитан полностью
+        db.add(CommandDailyRollup(day=TODAY - timedelta(days=20), client_id="c1", status="success", count=1))
+        db.add(CommandDailyRollup(day=partial, client_id="c1", status="success", count=10))
+    # ретенция уже удалила утреннюю часть дня partial — осталась только вечерняя
+    add_logs(partial, 2, hour=22)
+    add_logs(partial + timedelta(days=1), 4)
+
+    maintenance.rollup_commands(TODAY)
+
+    stored = rollups()
+    assert stored[partial] == 10
+    assert stored[partial + timedelta(days=1)] == 4
+
+
+def test_retention_then_rollup_never_rewrites_with_partial_counts():
+    day = TODAY - timedelta(days=KEEP_DAYS)
+    add_logs(day, 3, hour=1)
+    add_logs(day, 3, hour=23)
+    with get_session() as db:
+        db.add(CommandDailyRollup(day=day, client_id="c1", status="success", count=6))
+        db.add(CommandDailyRollup(day=TODAY - timedelta(days=30), client_id="c1", status="success", count=1))
+    maintenance.apply_retention(datetime(TODAY.year, TODAY.month, TODAY.day, 12))
+    maintenance.rollup_commands(TODAY)
+    assert rollups()[day] == 6
+
+
+def test_first_rollup_covers_history_older_than_retention():
+    history = 2 * KEEP_DAYS
+    for back in range(1, history + 1):
+        add_logs(TODAY - timedelta(days=back), 1)
+    with get_session() as db:
+        before = {r.date() for r in db.execute(select(CommandLog.created_at)).scalars()}
+
+    # как run_retention: сначала роллап, потом удаление сырых строк
+    maintenance.rollup_commands(TODAY)
+    maintenance.apply_retention(datetime(TODAY.year, TODAY.month, TODAY.day, 12))
+
+    with get_session() as db:
+        after = {r.date() for r in db.execute(select(CommandLog.created_at)).scalars()}
+    deleted = before - after
+    assert len(deleted) > KEEP_DAYS - 1
+    stored = rollups()
+    assert all(stored.get(day) == 1 for day in deleted)
+    assert len(stored) == history
@@ -0,0 +1,168 @@
+import time
+
+import pytest
+
+from core_service.services import ManagedService, Orchestrator
+from core_service.services.HealthProber import HealthState
+
+
+class FakeProc:
+    def __init__(self, pid: int = 4242):
+        self.pid = pid
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self):
+        return self.returncode
+
+
+@pytest.fixture
+def orch(tmp_path):
+    o = Orchestrator(str(tmp_path))
+    o.services.clear()
+    yield o
+    o.restarts.stop()
+
+
+def add(orch, name="svc", healthcheck_url="http://127.0.0.1:1/health", **kwargs) -> ManagedService:
+    svc = ManagedService(name=name, command=["true"], cwd=None, healthcheck_url=healthcheck_url, **kwargs)
+    orch.register(svc)
+    return svc
+
+
+def test_status_uses_startup_readiness_until_first_probe(orch):
+    svc = add(orch)
+    svc.process = FakeProc()
+    assert orch.get_services_status()["svc"]["healthy"] == "no"
+    svc._ready.set()
+    status = orch.get_services_status()["svc"]
+    assert (status["running"], status["healthy"], status["pid"]) == ("yes", "yes", "4242")
+    assert status["last_checked"] == "-"
+
+
+def test_probe_result_overrides_startup_readiness(orch):
+    svc = add(orch)
+    svc.process = FakeProc()
+    svc._ready.set()
+    orch.health.snapshot["svc"] = HealthState(healthy=False, last_checked=1.0, latency_ms=3.0, consecutive_failures=1,
+                                              last_error="HTTP 500")
+    status = orch.get_services_status()["svc"]
+    assert status["healthy"] == "no"
+    assert status["last_error"] == "HTTP 500"
+
+
+def test_stopped_service_is_not_healthy(orch):
+    svc = add(orch)
+    svc._ready.set()
+    status = orch.get_services_status()["svc"]
+    assert (status["running"], status["healthy"], status["pid"]) == ("no", "no", "-")
+
+
+def test_service_routes_do_not_block_the_event_loop(orch):
+    import asyncio
+    import threading
+    import time
+
+    import httpx
+
+    from core_service.admin_app import create_admin_app
+
+    add(orch)
+    release = threading.Event()
+
+    def slow_start(name):
+        # как _start_service, ожидающий зависимость
+        release.wait(5)
+        return True
+
+    orch.start = slow_start
+    app = create_admin_app(orch)
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://core") as client:
+            t = time.perf_counter()
+            start = asyncio.ensure_future(client.post("/api/services/start/svc"))
+            await asyncio.sleep(0.05)
+            status = await client.get("/api/services")
+            elapsed = time.perf_counter() - t
+            release.set()
+            return status.status_code, elapsed, (await start).status_code
+
+    code, elapsed, start_code = asyncio.run(main())
+    assert code == 200 and start_code == 200
+    assert elapsed < 1.0
+
+
+def test_startup_order_layers_follow_dependencies(orch):
+    add(orch, "db")
+    add(orch, "cache")
+    add(orch, "api", depends_on=["db", "cache"])
+    add(orch, "web", depends_on=["api"])
+    layers = orch.startup_order()
+    assert [sorted(layer) for layer in layers] == [["cache", "db"], ["api"], ["web"]]
+
+
+def test_startup_order_rejects_cycles_and_unknown_deps(orch):
+    add(orch, "a", depends_on=["b"])
+    add(orch, "b", depends_on=["a"])
+    with pytest.raises(ValueError, match="cycle"):
+        orch.startup_order()
+    orch.services.clear()
+    add(orch, "a", depends_on=["ghost"])
+    with pytest.raises(ValueError, match="unknown"):
+        orch.startup_order()
+
+
+def crash(orch, svc, code=3, uptime=0.0) -> FakeProc:
+    proc = FakeProc()
+    proc.returncode = code
+    svc.process = proc
+    svc.last_start_ts = time.time() - uptime
+    orch._watch_child(svc, proc)
+    return proc
+
+
+def test_child_exit_schedules_a_backed_off_restart(orch):
+    svc = add(orch, restart_backoff_sec=20)
+    crash(orch, svc, uptime=5)
+    due, reason = orch.restarts.next_run("svc")
+    assert reason == "exit"
+    # backoff засчитывает время, которое процесс успел проработать
+    assert 14 <= due - time.time() <= 15.5
+    assert svc.process is None and svc.restart_backoff_sec == 30
+    assert orch.logs["svc"].query(tail=1)[0].line == "exited pid=4242 code=3"
+
+
+def test_replaced_or_stopping_child_is_not_restarted(orch):
+    svc = add(orch, restart_backoff_sec=20)
+    proc = FakeProc()
+    proc.returncode = 0
+    svc.process = FakeProc(pid=99)
+    orch._watch_child(svc, proc)
+    assert orch.restarts.next_run("svc") is None
+    assert svc.process.pid == 99
+
+    orch._stop_event.set()
+    crash(orch, svc)
+    assert orch.restarts.next_run("svc") is None
+
+
+def test_crash_loop_is_throttled_to_the_max_backoff(orch):
+    svc = add(orch, restart_backoff_sec=1, restart_limit_in_window=3, backoff_max_sec=40)
+    for _ in range(3):
+        orch.restarts.cancel("svc")
+        crash(orch, svc)
+    due, reason = orch.restarts.next_run("svc")
+    assert reason == "exit" and due - time.time() > 35
+
+
+def test_failed_start_retry_keeps_a_sooner_pending_restart(orch, monkeypatch):
+    svc = add(orch, backoff_max_sec=60)
+    monkeypatch.setattr(orch, "_start_service", lambda s: None)
+    due = orch.restarts.schedule("svc", 5, "exit")
+    # старт не удался — повтор через backoff_max_sec не должен отодвинуть рестарт после падения
+    orch._run_scheduled("svc", "retry")
+    assert orch.restarts.next_run("svc") == (due, "exit")
+    assert svc.process is None
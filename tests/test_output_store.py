@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, func, select
+
+from core_service import output_store
+from core_service.db import engine, get_session
+from core_service.maintenance import gc_output_blobs
+from core_service.models import Base, CommandLog, CommandOutputBlob
+
+
+LONG = "header\n" + "x" * 10_000 + "\nerror at the end"
+
+
+@pytest.fixture(autouse=True)
+def tables():
+    Base.metadata.create_all(bind=engine)
+    clear()
+    yield
+    clear()
+
+
+def clear() -> None:
+    with get_session() as db:
+        db.execute(delete(CommandLog))
+        db.execute(delete(CommandOutputBlob))
+
+
+def blob_count() -> int:
+    with get_session() as db:
+        return db.execute(select(func.count()).select_from(CommandOutputBlob)).scalar()
+
+
+def add_log(cid: str, stdout: str) -> None:
+    with get_session() as db:
+        log = CommandLog(id=cid, client_id="c1", command="df -h", status="success")
+        output_store.set_output(db, log, "stdout", stdout)
+        output_store.set_output(db, log, "stderr", None)
+        db.add(log)
+
+
+def test_long_output_is_spilled_and_shared():
+    add_log("a", LONG)
+    add_log("b", LONG)
+    add_log("c", "short")
+    assert blob_count() == 1
+    with get_session() as db:
+        a, c = db.get(CommandLog, "a"), db.get(CommandLog, "c")
+        assert a.stdout.startswith("header") and a.stdout.endswith("error at the end")
+        assert len(a.stdout) <= output_store.INLINE_LIMIT
+        assert output_store.output_meta(a) == {"stdout_size": len(LONG), "stdout_truncated": True,
+                                               "stderr_size": None, "stderr_truncated": False}
+        assert output_store.load_full_output(db, a) == {"stdout": LONG, "stderr": None}
+        assert c.stdout_blob is None and output_store.load_full_output(db, c)["stdout"] == "short"
+
+
+def test_put_blob_tolerates_a_concurrent_insert_of_the_same_blob(monkeypatch):
+    add_log("a", LONG)
+    with get_session() as db:
+        # другой поток успел записать тот же блоб между проверкой и вставкой
+        with monkeypatch.context() as m:
+            m.setattr(db, "get", lambda *a, **kw: None)
+            digest = output_store.put_blob(db, LONG)
+    assert blob_count() == 1
+    with get_session() as db:
+        assert db.get(CommandLog, "a").stdout_blob == digest
+
+
+def test_spill_moves_oversized_inline_rows():
+    with get_session() as db:
+        db.add(CommandLog(id="old", client_id="c1", command="dmesg", status="success", stdout=LONG))
+    with get_session() as db:
+        assert output_store.spill_inline_outputs(db) == 1
+    with get_session() as db:
+        assert output_store.spill_inline_outputs(db) == 0
+        log = db.get(CommandLog, "old")
+        assert log.stdout_blob is not None and log.stdout_size == len(LONG)
+        assert output_store.load_full_output(db, log)["stdout"] == LONG
+
+
+def test_gc_deletes_only_old_unreferenced_blobs():
+    add_log("a", LONG)
+    add_log("b", LONG + "!")
+    with get_session() as db:
+        db.execute(delete(CommandLog).where(CommandLog.id == "b"))
+    now = datetime.utcnow()
+    assert gc_output_blobs(now) == 0
+    assert gc_output_blobs(now + timedelta(days=30)) == 1
+    assert blob_count() == 1
+    with get_session() as db:
+        assert output_store.load_full_output(db, db.get(CommandLog, "a"))["stdout"] == LONG
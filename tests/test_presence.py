@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta
+
+from core_service.presence import PresenceIndex
+
+
+NOW = datetime.utcnow().replace(microsecond=0)
+
+
+def client(cid: str, ago: float | None, **kw) -> dict:
+    hb = (NOW - timedelta(seconds=ago)).isoformat() if ago is not None else None
+    return {"id": cid, "hostname": f"host-{cid}", "ip": "10.0.0.1", "port": 9000, "status": "online",
+            "last_heartbeat": hb, **kw}
+
+
+def test_counts_stale_and_lookup_follow_updates():
+    index = PresenceIndex()
+    index.apply_snapshot([client("a", 5), client("b", 300), client("c", None, status="offline", ip="10.0.0.2")])
+    assert index.counts() == {"online": 2, "offline": 1}
+    assert index.count_stale(NOW - timedelta(seconds=60)) == 2
+    assert [c["id"] for c in index.stale(NOW - timedelta(seconds=60))] == ["b", "c"]
+    assert [c["id"] for c in index.stale(NOW - timedelta(seconds=60), include_unknown=False)] == ["b"]
+    assert [c["id"] for c in index.lookup(ip="10.0.0.1")] == ["a", "b"]
+
+    index.apply_snapshot([client("a", 5, status="offline", hostname="renamed"), client("b", 1),
+                          client("c", None, status="offline", ip="10.0.0.2")])
+    assert index.counts() == {"online": 1, "offline": 2}
+    assert index.lookup(hostname="host-a") == []
+    assert [c["id"] for c in index.lookup(hostname="renamed", ip="10.0.0.1")] == ["a"]
+    assert index.count_stale(NOW - timedelta(seconds=60)) == 1
+    summary = index.summary(stale_after=60)
+    assert summary["total"] == 3 and summary["version"] == 2
+
+
+def test_bulk_snapshot_rebuilds_the_heartbeat_order_once():
+    index = PresenceIndex()
+    fleet = [client(f"c{i:03}", i) for i in range(200)]
+    assert index.apply_snapshot(fleet)["inserted"] == 200
+    stale = index.stale(NOW - timedelta(seconds=150), limit=5)
+    assert [c["id"] for c in stale] == ["c199", "c198", "c197", "c196", "c195"]
+    assert index.count_stale(NOW - timedelta(seconds=150)) == 49
+
+
+def test_partial_snapshot_keeps_missing_clients():
+    index = PresenceIndex()
+    index.apply_snapshot([client("a", 1), client("b", 1)])
+    assert index.apply_snapshot([client("a", 1, status="busy")], complete=False)["removed"] == 0
+    assert len(index) == 2 and index.get("a")["status"] == "busy"
+
+
+def test_loaded_rows_are_not_written_back():
+    index = PresenceIndex()
+    index.load_rows([{"id": "a", "hostname": "h", "ip": None, "port": None, "status": "online",
+                      "connected_at": None, "last_heartbeat": NOW, "updated_at": NOW}])
+    assert index.take_dirty() == [] and len(index) == 1
+    assert index.apply_snapshot([client("a", 0, hostname="h", ip=None, port=None)])["unchanged"] == 1
+    assert index.apply_snapshot([client("a", 0, hostname="h", ip=None, port=None, status="busy")])["updated"] == 1
+    assert [r["id"] for r in index.take_dirty()] == ["a"]
+    assert index.take_dirty() == []
+
+
+def test_decode_heartbeats_formats():
+    import msgpack
+    import pytest
+
+    from core_service.presence import decode_heartbeats
+
+    items = [{"id": "a", "at": 1.5}, {"id": "b", "at": 2.5}]
+    assert decode_heartbeats(b'{"id": "a", "at": 1.5}\n\n{"id": "b", "at": 2.5}\n', "application/x-ndjson") == items
+    assert decode_heartbeats(b'[{"id": "a", "at": 1.5}, {"id": "b", "at": 2.5}]', "application/json") == items
+    assert decode_heartbeats(msgpack.packb(items), "application/msgpack") == items
+    stream = msgpack.packb(items[0]) + msgpack.packb(items[1])
+    assert decode_heartbeats(stream, "application/x-msgpack; charset=binary") == items
+    assert decode_heartbeats(b"  ", "") == []
+    with pytest.raises(ValueError, match="line 2"):
+        decode_heartbeats(b'{"id": "a"}\n{broken\n', "")
+
+
+def test_heartbeat_batch_accepts_aliases_and_ignores_reordered_items():
+    index = PresenceIndex()
+    base = NOW.timestamp()
+    counts = index.heartbeat_many([
+        {"id": "a", "at": base},
+        {"client_id": "b", "ts": base, "status": "busy", "port": "bad"},
+        {"id": "a", "at": base - 5},
+        {"id": "c", "last_heartbeat": (NOW - timedelta(seconds=1)).isoformat()},
+        {"at": base},
+        {"id": "d", "at": "not a time"},
+        "garbage",
+    ])
+    assert counts == {"accepted": 3, "ignored": 1, "rejected": 3}
+    assert index.counts() == {"online": 2, "busy": 1}
+    assert index.get("b")["port"] is None
+    assert sorted(r["id"] for r in index.take_dirty()) == ["a", "b", "c"]
+    assert index.summary()["heartbeats_received"] == 3
+
+
+def test_late_heartbeats_and_flips_mark_a_client_as_flapping():
+    index = PresenceIndex()
+    base = NOW.timestamp() - 600
+    steady = [{"id": "steady", "at": base + i * 10} for i in range(30)]
+    flaky = [{"id": "flaky", "at": base + t, "status": s}
+             for t, s in ((0, "online"), (100, "offline"), (200, "online"), (300, "online"))]
+    index.heartbeat_many(steady + flaky)
+    found = index.flapping(window=3600, min_events=3)
+    assert [c["id"] for c in found] == ["flaky"]
+    assert found[0]["late_heartbeats"] == 3 and found[0]["status_flips"] == 2
+    assert found[0]["max_gap_sec"] == 100.0
+    buckets = index.gap_series("steady", 3600)
+    assert sum(b["heartbeats"] for b in buckets) == 30
+    assert all(b["late"] == 0 for b in buckets)
@@ -0,0 +1,150 @@
+import asyncio
+import gzip
+import json
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from core_service.responses import ListResponder, decode_cursor, encode_cursor, negotiate_encoding
+
+
+def make_request(query: str = "", **headers: str) -> Request:
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "scheme": "http",
+        "server": ("testserver", 80),
+        "path": "/api/items",
+        "query_string": query.encode(),
+        "headers": [(k.replace("_", "-").encode(), v.encode()) for k, v in headers.items()],
+    })
+
+
+def respond(lists: ListResponder, value, request: Request | None = None, **kwargs):
+    return asyncio.run(lists.respond(request or make_request(), "items", value, **kwargs))
+
+
+ITEMS = [{"id": f"c{i}", "hostname": f"h{i}", "status": "online"} for i in range(5)]
+
+
+def test_etag_and_not_modified():
+    lists = ListResponder()
+    first = respond(lists, ITEMS)
+    assert first.status_code == 200
+    assert json.loads(first.body) == ITEMS
+    etag = first.headers["etag"]
+
+    second = respond(lists, list(ITEMS), make_request(if_none_match=etag))
+    assert second.status_code == 304
+    assert second.headers["etag"] == etag
+    assert lists.not_modified == 1
+
+
+def test_changed_data_gets_new_etag():
+    lists = ListResponder()
+    etag = respond(lists, ITEMS).headers["etag"]
+    changed = ITEMS[:-1]
+    resp = respond(lists, changed, make_request(if_none_match=etag))
+    assert resp.status_code == 200
+    assert resp.headers["etag"] != etag
+
+
+def test_version_bumps_only_on_change():
+    lists = ListResponder()
+    assert lists.version("x", [1, 2]) == 1
+    assert lists.version("x", [1, 2]) == 1
+    assert lists.version("x", [1, 2, 3]) == 2
+
+
+def test_unchanged_body_is_reused():
+    lists = ListResponder()
+    a = respond(lists, ITEMS)
+    b = respond(lists, ITEMS)
+    assert a.body is b.body
+    assert (lists.rendered, lists.reused) == (1, 1)
+
+
+def test_cursor_pagination_walks_all_items():
+    lists = ListResponder()
+    seen, cursor = [], None
+    while True:
+        resp = respond(lists, ITEMS, limit=2, cursor=cursor)
+        seen += [item["id"] for item in json.loads(resp.body)]
+        cursor = resp.headers.get("x-next-cursor")
+        if not cursor:
+            break
+        assert 'rel="next"' in resp.headers["link"]
+    assert seen == [item["id"] for item in ITEMS]
+
+
+def test_pagination_descending_and_dict_values():
+    lists = ListResponder()
+    resp = respond(lists, {k: {"n": i} for i, k in enumerate("abcd")}, limit=2, descending=True)
+    assert json.loads(resp.body) == {"d": {"n": 3}, "c": {"n": 2}}
+    assert decode_cursor(resp.headers["x-next-cursor"]) == "c"
+
+
+def test_fields_projection():
+    resp = respond(ListResponder(), ITEMS, fields="id, status")
+    assert json.loads(resp.body)[0] == {"id": "c0", "status": "online"}
+
+
+def test_gzip_above_threshold():
+    lists = ListResponder(compress_min_bytes=10)
+    resp = respond(lists, ITEMS, make_request(accept_encoding="gzip"))
+    assert resp.headers["content-encoding"] == "gzip"
+    assert json.loads(gzip.decompress(resp.body)) == ITEMS
+    assert resp.headers["etag"].endswith('-gzip"')
+    # ETag сжатого представления тоже даёт 304
+    again = respond(lists, ITEMS, make_request(accept_encoding="gzip", if_none_match=resp.headers["etag"]))
+    assert again.status_code == 304
+
+
+def test_small_body_is_not_compressed():
+    resp = respond(ListResponder(compress_min_bytes=1 << 20), ITEMS, make_request(accept_encoding="gzip"))
+    assert "content-encoding" not in resp.headers
+
+
+def test_cursor_roundtrip_and_invalid_cursor():
+    assert decode_cursor(encode_cursor("c42")) == "c42"
+    with pytest.raises(HTTPException) as exc:
+        decode_cursor("a")
+    assert exc.value.status_code == 400
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("", None),
+    ("identity", None),
+    ("gzip", "gzip"),
+    ("gzip;q=0", None),
+    ("*", "gzip"),
+])
+def test_negotiate_encoding_gzip(header, expected, monkeypatch):
+    monkeypatch.setattr("core_service.responses._brotli", None)
+    assert negotiate_encoding(header) == expected
+
+
+def test_version_of_ignores_volatile_fields():
+    lists = ListResponder()
+    first = {"svc": {"running": "yes", "latency_ms": 1.0}}
+    etag = respond(lists, first, version_of={"svc": "yes"}).headers["etag"]
+    probed = {"svc": {"running": "yes", "latency_ms": 7.5}}
+    assert respond(lists, probed, make_request(if_none_match=etag), version_of={"svc": "yes"}).status_code == 304
+    stopped = {"svc": {"running": "no", "latency_ms": 7.5}}
+    assert respond(lists, stopped, make_request(if_none_match=etag), version_of={"svc": "no"}).status_code == 200
+
+
+def test_cursor_falls_back_to_secondary_key():
+    lists = ListResponder()
+    items = [{"command_id": "b"}, {"id": "a"}, {"command_id": "c"}]
+    resp = respond(lists, items, key=("command_id", "id"), limit=2)
+    assert json.loads(resp.body) == [{"id": "a"}, {"command_id": "b"}]
+    assert decode_cursor(resp.headers["x-next-cursor"]) == "b"
+
+
+def test_items_without_key_are_served_unpaginated():
+    items = [{"command_id": "b"}, {"other": 1}, {"command_id": "a"}]
+    resp = respond(ListResponder(), items, key="command_id", limit=1)
+    assert json.loads(resp.body) == items
+    assert "x-next-cursor" not in resp.headers
@@ -0,0 +1,107 @@
+import threading
+import time
+
+from core_service.services.RestartScheduler import RestartScheduler
+
+
+class Recorder:
+    def __init__(self):
+        self.runs = []
+        self.event = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self, name, reason):
+        with self._lock:
+            self.runs.append((name, reason))
+        self.event.set()
+
+    def wait_for(self, n, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if len(self.runs) >= n:
+                    return list(self.runs)
+            time.sleep(0.005)
+        return list(self.runs)
+
+
+def test_jobs_run_in_deadline_order():
+    rec = Recorder()
+    sched = RestartScheduler(rec)
+    sched.schedule("slow", 0.15, "exit")
+    sched.schedule("fast", 0.02, "health")
+    sched.schedule("mid", 0.08, "exit")
+    try:
+        assert rec.wait_for(3) == [("fast", "health"), ("mid", "exit"), ("slow", "exit")]
+    finally:
+        sched.stop()
+
+
+def test_earlier_schedule_replaces_pending_job():
+    rec = Recorder()
+    sched = RestartScheduler(rec)
+    sched.schedule("svc", 0.1, "health")
+    sched.schedule("svc", 0.02, "exit")
+    try:
+        assert rec.wait_for(1) == [("svc", "exit")]
+        time.sleep(0.15)
+        assert rec.runs == [("svc", "exit")]
+    finally:
+        sched.stop()
+
+
+def test_later_schedule_keeps_the_earlier_run():
+    rec = Recorder()
+    sched = RestartScheduler(rec)
+    due = sched.schedule("svc", 0.05, "exit")
+    # повторная попытка после неудачного старта не должна откладывать уже назначенный рестарт
+    assert sched.schedule("svc", 30, "retry") == due
+    assert sched.next_run("svc") == (due, "exit")
+    try:
+        assert rec.wait_for(1, timeout=1) == [("svc", "exit")]
+    finally:
+        sched.stop()
+
+
+def test_cancel_and_next_run():
+    rec = Recorder()
+    sched = RestartScheduler(rec)
+    due = sched.schedule("svc", 0.05, "exit")
+    assert sched.next_run("svc") == (due, "exit")
+    assert abs(due - time.time() - 0.05) < 0.05
+    assert sched.cancel("svc")
+    assert not sched.cancel("svc")
+    assert sched.next_run("svc") is None
+    time.sleep(0.1)
+    sched.stop()
+    assert rec.runs == []
+
+
+def test_slow_job_does_not_delay_others():
+    release = threading.Event()
+    rec = Recorder()
+
+    def run(name, reason):
+        if name == "blocked":
+            release.wait(5)
+        rec(name, reason)
+
+    sched = RestartScheduler(run)
+    sched.schedule("blocked", 0, "exit")
+    sched.schedule("other", 0.02, "exit")
+    try:
+        assert rec.wait_for(1, timeout=1) == [("other", "exit")]
+    finally:
+        release.set()
+        sched.stop()
+
+
+def test_stop_drops_pending_and_ignores_new_jobs():
+    rec = Recorder()
+    sched = RestartScheduler(rec)
+    sched.schedule("svc", 0.05, "exit")
+    sched.stop()
+    sched.schedule("late", 0, "exit")
+    time.sleep(0.1)
+    assert rec.runs == []
+    assert sched.next_run("late") is None
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from core_service.upload_stream import MultipartPipe
+
+
+BOUNDARY = "testboundary"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+
+
+def body(fields: dict, payload: bytes, filename: str = "data.bin", trailing: bool = True) -> bytes:
+    parts = [f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'.encode() for k, v in fields.items()]
+    parts.append(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+                 f'Content-Type: application/zip\r\n\r\n'.encode() + payload + b"\r\n")
+    if trailing:
+        parts.append(f"--{BOUNDARY}--\r\n".encode())
+    return b"".join(parts)
+
+
+async def chunked(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+async def collect(pipe: MultipartPipe, source) -> bytes:
+    producer = asyncio.create_task(pipe.run(source))
+    await pipe.wait_file_start()
+    out = b"".join([c async for c in pipe.file_chunks()])
+    await producer
+    return out
+
+
+def test_fields_and_file_are_split_across_odd_chunk_sizes():
+    payload = bytes(range(256)) * 40
+
+    async def main():
+        pipe = MultipartPipe(CONTENT_TYPE, max_buffered_chunks=2)
+        out = await collect(pipe, chunked(body({"client_id": "c1", "dest_path": "/tmp/x"}, payload), 7))
+        return pipe, out
+
+    pipe, out = asyncio.run(main())
+    assert out == payload
+    assert pipe.fields == {"client_id": "c1", "dest_path": "/tmp/x"}
+    assert pipe.filename == "data.bin"
+    assert pipe.file_content_type == "application/zip"
+
+
+def test_body_cut_inside_the_file_part_is_an_error():
+    data = body({"client_id": "c1"}, b"y" * 5000, trailing=False)[:-100]
+
+    async def main():
+        await collect(MultipartPipe(CONTENT_TYPE), chunked(data, 512))
+
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(main())
+    assert e.value.status_code == 400
+
+
+def test_missing_boundary_is_rejected():
+    with pytest.raises(HTTPException):
+        MultipartPipe("multipart/form-data")
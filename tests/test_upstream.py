@@ -0,0 +1,137 @@
+import asyncio
+import importlib.util
+import json
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from core_service.upstream import CircuitBreaker, UpstreamClient
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def client(handler, **kwargs) -> UpstreamClient:
+    return UpstreamClient("http://cm/", transport=httpx.MockTransport(handler), **kwargs)
+
+
+def test_request_json_sends_body_and_decodes_response():
+    seen = []
+
+    def handler(req: httpx.Request):
+        seen.append((req.method, str(req.url), req.headers["content-type"], json.loads(req.content), req.headers.get("x-a")))
+        return httpx.Response(200, json={"ok": True})
+
+    async def main():
+        up = client(handler)
+        try:
+            return await up.request_json("post", "api/commands/c1", body={"command": "uptime"}, headers={"X-A": "1"})
+        finally:
+            await up.aclose()
+
+    assert run(main()) == {"ok": True}
+    assert seen == [("POST", "http://cm/api/commands/c1", "application/json", {"command": "uptime"}, "1")]
+
+
+def test_upstream_error_status_is_passed_through():
+    async def main():
+        up = client(lambda req: httpx.Response(404, text="no such client"))
+        try:
+            await up.request_json("GET", "/api/clients/x")
+        finally:
+            await up.aclose()
+
+    with pytest.raises(HTTPException) as exc:
+        run(main())
+    assert (exc.value.status_code, exc.value.detail) == (404, "no such client")
+
+
+def test_connection_error_becomes_503():
+    def handler(req):
+        raise httpx.ConnectError("refused", request=req)
+
+    async def main():
+        up = client(handler)
+        try:
+            await up.request_json("GET", "/api/clients")
+        finally:
+            await up.aclose()
+
+    with pytest.raises(HTTPException) as exc:
+        run(main())
+    assert exc.value.status_code == 503
+
+
+def test_empty_body_decodes_to_none():
+    async def main():
+        up = client(lambda req: httpx.Response(204))
+        try:
+            return await up.request_json("DELETE", "/api/x")
+        finally:
+            await up.aclose()
+
+    assert run(main()) is None
+
+
+def fail(breaker, times):
+    for _ in range(times):
+        breaker.before_call()
+        breaker.record_failure()
+
+
+def test_opens_after_threshold_failures():
+    breaker = CircuitBreaker(threshold=3, cooldown=60)
+    fail(breaker, 2)
+    assert breaker.state == "closed"
+    fail(breaker, 1)
+    assert breaker.state == "open"
+    with pytest.raises(HTTPException) as exc:
+        breaker.before_call()
+    assert exc.value.status_code == 503
+    assert breaker.rejected == 1
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker(threshold=2, cooldown=60)
+    fail(breaker, 1)
+    breaker.record_success()
+    fail(breaker, 1)
+    assert breaker.state == "closed"
+
+
+def test_half_open_lets_one_probe_through():
+    breaker = CircuitBreaker(threshold=1, cooldown=0)
+    fail(breaker, 1)
+    assert breaker.state == "half_open"
+    breaker.before_call()
+    with pytest.raises(HTTPException):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_failed_probe_reopens():
+    breaker = CircuitBreaker(threshold=5, cooldown=60)
+    fail(breaker, 5)
+    breaker.opened_at -= 60
+    assert breaker.state == "half_open"
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def test_released_probe_can_be_retried():
+    breaker = CircuitBreaker(threshold=1, cooldown=0)
+    fail(breaker, 1)
+    breaker.before_call()
+    breaker.release_probe()
+    breaker.before_call()
+
+
+def test_http2_falls_back_without_h2(monkeypatch):
+    monkeypatch.setattr(importlib.util, "find_spec", lambda name: None)
+    client = UpstreamClient("http://cm", http2=True)
+    assert client.http2 is False
+    run(client.aclose())
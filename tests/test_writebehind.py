@@ -0,0 +1,168 @@
+import asyncio
+import threading
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import Column, Integer, MetaData, Table, create_engine, func, select
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from core_service.writebehind import WriteBehindQueue
+
+
+metadata = MetaData()
+rows = Table("rows", metadata, Column("id", Integer, primary_key=True))
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def writes(engine):
+    @contextmanager
+    def session_factory():
+        # как db.get_session: коммит при успехе, откат при ошибке
+        with Session(engine) as db:
+            try:
+                yield db
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+
+    queue = WriteBehindQueue(session_factory=session_factory, max_batch=4, max_delay=0.05)
+    yield queue
+    queue.stop()
+
+
+def insert(i):
+    return lambda db: db.execute(rows.insert().values(id=i))
+
+
+def count(engine):
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(rows)).scalar()
+
+
+def test_ops_are_committed_in_batches(writes, engine):
+    writes.start()
+    for i in range(10):
+        assert writes.submit(insert(i))
+    assert writes.flush(5)
+    assert count(engine) == 10
+    stats = writes.stats()
+    assert stats["committed"] == 10
+    assert 3 <= stats["batches"] < 10
+    assert stats["last_batch_size"] <= 4
+
+
+def test_failing_op_does_not_drop_the_batch(writes, engine):
+    writes.start()
+    writes.submit(insert(1))
+    writes.submit(insert(1))  # дубликат первичного ключа
+    writes.submit(insert(2))
+    assert writes.flush(5)
+    assert count(engine) == 2
+    assert (writes.stats()["committed"], writes.stats()["failed"]) == (2, 1)
+
+
+def test_submit_starts_writer_lazily(writes, engine):
+    assert writes.submit(insert(1))
+    assert writes.stats()["running"]
+    assert writes.flush(5)
+    assert count(engine) == 1
+
+
+def test_submit_after_stop_is_rejected(writes, engine):
+    writes.start()
+    writes.stop()
+    assert not writes.submit(insert(1))
+    assert writes.stats()["rejected"] == 1
+    assert count(engine) == 0
+
+
+def test_full_queue_rejects_instead_of_blocking(engine):
+    @contextmanager
+    def session_factory():
+        with Session(engine) as db:
+            yield db
+            db.commit()
+
+    writes = WriteBehindQueue(session_factory=session_factory, max_queue=1)
+    started, release = threading.Event(), threading.Event()
+
+    def stall():
+        started.set()
+        release.wait(5)
+
+    writes.start()
+    writes.run_exclusive(stall)
+    assert started.wait(5)
+    assert writes.submit(insert(1))
+    assert not writes.submit(insert(2))
+    release.set()
+    assert writes.flush(5)
+    writes.stop()
+    assert count(engine) == 1
+    assert writes.stats()["rejected"] == 1
+
+
+def test_exclusive_runs_after_earlier_writes(writes, engine):
+    writes.start()
+    for i in range(3):
+        writes.submit(insert(i))
+    assert writes.run_exclusive(lambda: count(engine)).result(5) == 3
+
+
+def test_exclusive_error_is_set_on_future(writes):
+    writes.start()
+    future = writes.run_exclusive(lambda: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        future.result(5)
+
+
+def test_submit_async_waits_for_room_off_the_loop(engine):
+    @contextmanager
+    def session_factory():
+        with Session(engine) as db:
+            yield db
+            db.commit()
+
+    writes = WriteBehindQueue(session_factory=session_factory, max_queue=1)
+    started, release = threading.Event(), threading.Event()
+
+    def stall():
+        started.set()
+        release.wait(5)
+
+    async def main():
+        writes.start()
+        writes.run_exclusive(stall)
+        assert started.wait(5)
+        await writes.submit_async(insert(1))
+        waiting = asyncio.ensure_future(writes.submit_async(insert(2)))
+        # цикл событий не заблокирован, пока запись ждёт места в очереди
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+        release.set()
+        await waiting
+
+    asyncio.run(main())
+    assert writes.flush(5)
+    writes.stop()
+    assert count(engine) == 2
+    stats = writes.stats()
+    assert (stats["rejected"], stats["overflow_waits"], stats["direct_writes"]) == (0, 1, 0)
+
+
+def test_submit_async_after_stop_writes_directly(writes, engine):
+    writes.start()
+    writes.stop()
+    asyncio.run(writes.submit_async(insert(7)))
+    assert count(engine) == 1
+    assert writes.stats()["direct_writes"] == 1
@@ -0,0 +1,157 @@
+"""Incremental multipart parsing for pass-through uploads.
+
+`MultipartPipe` consumes a request body chunk by chunk and exposes the first file part
+as an async byte stream, so an upload can be forwarded to client_manager while it is
+still being received. Buffering is bounded by a small queue: when upstream is slower
+than the browser, reading the request body simply pauses.
+"""
+from __future__ import annotations
+
+import asyncio
+from typing import AsyncIterator, Dict
+
+from fastapi import HTTPException
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # older python-multipart releases
+    from multipart.multipart import MultipartParser, parse_options_header  # type: ignore
+
+
+_EOF = object()
+
+
+class MultipartPipe:
+    """Streams the file part of a multipart/form-data body.
+
+    Plain form fields must precede the file part (browsers keep FormData order), since
+    they are needed to build the upstream request before any file bytes are sent.
+    Anything after the first file part is ignored.
+    """
+
+    def __init__(self, content_type: str, max_buffered_chunks: int = 16, max_field_size: int = 64 * 1024):
+        _, params = parse_options_header(content_type)
+        boundary = params.get(b"boundary")
+        if not boundary:
+            raise HTTPException(status_code=400, detail="multipart boundary missing")
+        self.fields: Dict[str, str] = {}
+        self.filename: str | None = None
+        self.file_content_type = "application/octet-stream"
+        self._max_field_size = max_field_size
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_buffered_chunks)
+        self._file_started = asyncio.Event()
+        self._error: Exception | None = None
+
+        # состояние текущей части, заполняется колбэками парсера
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._part_name: str | None = None
+        self._part_is_file = False
+        self._field_buf = bytearray()
+        self._file_buf = bytearray()
+        self._file_done = False
+        self._in_file = False
+
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    # --- parser callbacks (synchronous) ---
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+        self._part_name = None
+        self._part_is_file = False
+        self._field_buf = bytearray()
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        _, opts = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = opts.get(b"name")
+        self._part_name = name.decode("utf-8", errors="replace") if name else None
+        filename = opts.get(b"filename")
+        if filename is not None and not self._file_done and not self._in_file:
+            self._part_is_file = True
+            self._in_file = True
+            self.filename = filename.decode("utf-8", errors="replace")
+            ctype = self._headers.get(b"content-type")
+            if ctype:
+                self.file_content_type = ctype.decode("latin-1")
+            self._file_started.set()
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._part_is_file:
+            self._file_buf += data[start:end]
+        elif not self._file_done and not self._in_file:
+            self._field_buf += data[start:end]
+            if len(self._field_buf) > self._max_field_size:
+                raise HTTPException(status_code=413, detail=f"form field {self._part_name} too large")
+
+    def _on_part_end(self) -> None:
+        if self._part_is_file:
+            self._part_is_file = False
+            self._in_file = False
+            self._file_done = True
+        elif self._part_name and not self._file_done:
+            self.fields[self._part_name] = self._field_buf.decode("utf-8", errors="replace")
+
+    # --- async side ---
+    async def _drain(self) -> None:
+        if self._file_buf:
+            chunk = bytes(self._file_buf)
+            self._file_buf.clear()
+            await self._queue.put(chunk)
+
+    async def run(self, source: AsyncIterator[bytes]) -> None:
+        """Feed the parser from `source` until the body ends (producer side)."""
+        try:
+            async for chunk in source:
+                if not chunk:
+                    continue
+                self._parser.write(chunk)
+                await self._drain()
+                if self._file_done:
+                    break
+            else:
+                self._parser.finalize()
+                await self._drain()
+            if not self._file_started.is_set():
+                raise HTTPException(status_code=400, detail="file part missing in multipart body")
+            if not self._file_done:
+                raise HTTPException(status_code=400, detail="multipart body ended before file part was complete")
+            await self._queue.put(_EOF)
+        except Exception as e:
+            self._error = e if isinstance(e, HTTPException) else HTTPException(status_code=400, detail=f"Invalid multipart body: {e}")
+            self._file_started.set()
+            await self._queue.put(_EOF)
+
+    async def wait_file_start(self) -> None:
+        """Wait until the file part header is parsed; form fields are known after this."""
+        await self._file_started.wait()
+        if self._error is not None and self.filename is None:
+            raise self._error
+
+    async def file_chunks(self) -> AsyncIterator[bytes]:
+        while True:
+            item = await self._queue.get()
+            if item is _EOF:
+                if self._error is not None:
+                    raise self._error
+                return
+            yield item
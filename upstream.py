@@ -0,0 +1,264 @@
+"""Shared asyncio HTTP client for talking to client_manager.
+
+One pooled `httpx.AsyncClient` is created in the admin app lifespan and reused by
+every proxy route, so requests ride on keep-alive connections instead of paying a
+TCP/TLS handshake and a thread hop per call.
+"""
+from __future__ import annotations
+
+import importlib.util
+import json
+import os
+import random
+import string
+import time
+from typing import Any, AsyncIterator, Dict
+
+import httpx
+from fastapi import HTTPException
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_flag(name: str, default: str = "0") -> bool:
+    return os.getenv(name, default) in ("1", "true", "True", "yes")
+
+
+class CircuitBreaker:
+    """Fast-fail guard for an unreachable upstream.
+
+    After `threshold` consecutive connection failures the circuit opens and calls are
+    rejected immediately for `cooldown` seconds. Then one probe call is let through:
+    success closes the circuit, failure re-opens it for another cooldown.
+    Upstream HTTP errors count as success: the host answered.
+    """
+
+    def __init__(self, threshold: int = 5, cooldown: float = 15.0):
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.rejected = 0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def before_call(self) -> None:
+        state = self.state
+        if state == "closed":
+            return
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return
+        self.rejected += 1
+        retry_in = max(0.0, self.cooldown - (time.monotonic() - (self.opened_at or 0.0)))
+        raise HTTPException(status_code=503, detail=f"Client manager unavailable: circuit open, retry in {retry_in:.1f}s")
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def release_probe(self) -> None:
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probing or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "threshold": self.threshold,
+            "cooldown_sec": self.cooldown,
+            "rejected": self.rejected,
+        }
+
+
+class UpstreamClient:
+    """Pooled async client bound to a single upstream base url.
+
+    All calls go to one host, so the pool limits below are effectively per-host limits.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        timeout: float = 15.0,
+        connect_timeout: float = 5.0,
+        max_connections: int = 50,
+        max_keepalive: int = 20,
+        keepalive_expiry: float = 30.0,
+        http2: bool = False,
+        verify: bool = False,
+        transport: httpx.AsyncBaseTransport | None = None,
+        breaker: CircuitBreaker | None = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.breaker = breaker or CircuitBreaker()
+        self.max_connections = max_connections
+        if http2 and importlib.util.find_spec("h2") is None:
+            # HTTP/2 требует пакет h2 (httpx[http2]); без него работаем по HTTP/1.1
+            http2 = False
+        self.http2 = http2
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            http2=http2,
+            # Dev-режим: внутри docker-сети сертификат client_manager не проверяем
+            verify=verify,
+            transport=transport,
+        )
+
+    @classmethod
+    def from_env(cls) -> "UpstreamClient":
+        return cls(
+            base_url=os.getenv("CM_BASE_URL", "http://127.0.0.1:10000"),
+            timeout=_env_float("CM_HTTP_TIMEOUT", 15.0),
+            connect_timeout=_env_float("CM_HTTP_CONNECT_TIMEOUT", 5.0),
+            max_connections=_env_int("CM_HTTP_MAX_CONNECTIONS", 50),
+            max_keepalive=_env_int("CM_HTTP_MAX_KEEPALIVE", 20),
+            keepalive_expiry=_env_float("CM_HTTP_KEEPALIVE_EXPIRY", 30.0),
+            http2=_env_flag("CM_HTTP2"),
+            verify=_env_flag("CM_TLS_VERIFY"),
+            breaker=CircuitBreaker(
+                threshold=_env_int("CM_BREAKER_THRESHOLD", 5),
+                cooldown=_env_float("CM_BREAKER_COOLDOWN", 15.0),
+            ),
+        )
+
+    @staticmethod
+    def _path(path: str) -> str:
+        return path if path.startswith("/") else "/" + path
+
+    def _unavailable(self, e: Exception) -> HTTPException:
+        self.breaker.record_failure()
+        return HTTPException(status_code=503, detail=f"Client manager unavailable: {str(e)}")
+
+    async def _send(self, request: httpx.Request, stream: bool = False) -> httpx.Response:
+        self.breaker.before_call()
+        try:
+            resp = await self._client.send(request, stream=stream)
+        except httpx.TransportError as e:
+            raise self._unavailable(e)
+        except BaseException:
+            # ошибка не связана с доступностью хоста (отмена, ошибка тела запроса)
+            self.breaker.release_probe()
+            raise
+        self.breaker.record_success()
+        return resp
+
+    @staticmethod
+    def _decode(resp: httpx.Response) -> Any:
+        text = resp.text if resp.content else ""
+        if 200 <= resp.status_code < 300:
+            return json.loads(text) if text else None
+        raise HTTPException(status_code=resp.status_code, detail=text or "Upstream error")
+
+    async def request_json(
+        self,
+        method: str,
+        path: str,
+        body: Dict[str, Any] | None = None,
+        headers: Dict[str, str] | None = None,
+        timeout: float | None = None,
+    ) -> Any:
+        hdrs = {"Content-Type": "application/json"}
+        if headers:
+            hdrs.update(headers)
+        payload = json.dumps(body) if body is not None else None
+        kwargs: Dict[str, Any] = {"content": payload, "headers": hdrs}
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        resp = await self._send(self._client.build_request(method.upper(), self._path(path), **kwargs))
+        return self._decode(resp)
+
+    async def post_multipart(
+        self,
+        path: str,
+        fields: Dict[str, str],
+        file_field: str,
+        filename: str,
+        chunks: AsyncIterator[bytes],
+        file_content_type: str = "application/octet-stream",
+        timeout: float | None = 30.0,
+    ) -> Any:
+        """Stream a multipart/form-data POST using chunked encoding.
+
+        The body is produced lazily: preamble -> file chunks -> epilogue, so the file
+        never has to be held in memory.
+        """
+        boundary = "----boundary" + ''.join(random.choice(string.ascii_letters + string.digits) for _ in range(16))
+        crlf = "\r\n"
+        pre_parts = []
+        for k, v in (fields or {}).items():
+            pre_parts.append(f"--{boundary}{crlf}Content-Disposition: form-data; name=\"{k}\"{crlf}{crlf}{v}")
+        pre_parts.append(f"--{boundary}{crlf}Content-Disposition: form-data; name=\"{file_field}\"; filename=\"{filename}\"{crlf}Content-Type: {file_content_type}{crlf}{crlf}")
+        preamble = crlf.join(pre_parts).encode("utf-8")
+        epilogue = (crlf + f"--{boundary}--{crlf}").encode("utf-8")
+
+        async def body_iter():
+            yield preamble
+            async for chunk in chunks:
+                if chunk:
+                    yield chunk
+            yield epilogue
+
+        hdrs = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+        kwargs: Dict[str, Any] = {"content": body_iter(), "headers": hdrs}
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        resp = await self._send(self._client.build_request("POST", self._path(path), **kwargs))
+        return self._decode(resp)
+
+    async def open_stream(
+        self,
+        method: str,
+        path: str,
+        headers: Dict[str, str] | None = None,
+        timeout: float | None = 30.0,
+        body: Dict[str, Any] | None = None,
+    ) -> httpx.Response:
+        """Send a request and return as soon as response headers arrive.
+
+        The body is left unread; the caller iterates it and must `aclose()` the response.
+        `timeout` bounds each read, not the whole transfer. `body` is sent as JSON.
+        """
+        hdrs = dict(headers or {})
+        kwargs: Dict[str, Any] = {"headers": hdrs}
+        if body is not None:
+            hdrs.setdefault("Content-Type", "application/json")
+            kwargs["content"] = json.dumps(body)
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        req = self._client.build_request(method.upper(), self._path(path), **kwargs)
+        return await self._send(req, stream=True)
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
@@ -0,0 +1,245 @@
+"""Write-behind queue for audit and command log writes.
+
+Routes enqueue small write operations (callables taking a Session) and return without
+waiting for a commit. A background thread drains the queue and applies operations in
+batched transactions, bounded by `max_batch` operations or `max_delay` seconds after
+the first queued one. On SQLite this turns many short write transactions into a few
+longer ones, so bursts stop serialising on the database write lock.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import queue
+from concurrent.futures import Future
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+from sqlalchemy.orm import Session
+
+from .db import get_session
+
+
+logger = logging.getLogger(__name__)
+
+WriteOp = Callable[[Session], Any]
+
+_STOP = object()
+
+
+class _Barrier:
+    def __init__(self) -> None:
+        self.event = threading.Event()
+
+
+class _Exclusive:
+    def __init__(self, fn: Callable[[], Any]) -> None:
+        self.fn = fn
+        self.future: "Future[Any]" = Future()
+
+
+class WriteBehindQueue:
+    def __init__(self, session_factory=get_session, max_batch: int = 200, max_delay: float = 0.2, max_queue: int = 100_000):
+        self._session_factory = session_factory
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max_delay
+        # submit() зовут из async-роутов: при переполнении запись отклоняется, а не блокирует цикл
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max_queue)
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self.enqueued = 0
+        self.rejected = 0
+        self.overflow_waits = 0
+        self.direct_writes = 0
+        self.committed = 0
+        self.failed = 0
+        self.batches = 0
+        self.max_depth = 0
+        self.last_batch_size = 0
+        self.last_commit_ms = 0.0
+
+    def start(self) -> None:
+        self._closed = False
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def submit(self, op: WriteOp) -> bool:
+        """Enqueue `op` without blocking; False (op dropped) when the queue is stopped or full.
+
+        Coroutines that must not lose the write use `submit_async`.
+        """
+        why = self._offer(op)
+        if why is None:
+            return True
+        with self._lock:
+            self.rejected += 1
+        logger.warning("write-behind op rejected: %s", why)
+        return False
+
+    async def submit_async(self, op: WriteOp, timeout: float = 30.0) -> None:
+        """Enqueue `op` from a coroutine without dropping it and without blocking the event loop.
+
+        When the queue is full, the coroutine waits for room in a worker thread, so the op keeps
+        its place after earlier writes. When the queue is stopped, or still full after `timeout`,
+        the op is written directly, also off the loop.
+        """
+        why = self._offer(op)
+        if why is None:
+            return
+        if not self._closed and await asyncio.to_thread(self._put_wait, op, timeout):
+            return
+        with self._lock:
+            self.direct_writes += 1
+        logger.warning("write-behind op written directly: %s", why)
+        await asyncio.to_thread(self._apply_batch, [op])
+
+    def _offer(self, op: WriteOp) -> str | None:
+        if self._closed:
+            return "queue is stopped"
+        if not self._thread or not self._thread.is_alive():
+            # очередь не запущена (скрипты, тесты) — поднимаем поток, а не пишем на вызывающем
+            self.start()
+        try:
+            self._queue.put_nowait(op)
+        except queue.Full:
+            return "queue is full"
+        self._enqueued()
+        return None
+
+    def _put_wait(self, op: WriteOp, timeout: float) -> bool:
+        try:
+            self._queue.put(op, timeout=timeout)
+        except queue.Full:
+            return False
+        with self._lock:
+            self.overflow_waits += 1
+        self._enqueued()
+        return True
+
+    def _enqueued(self) -> None:
+        with self._lock:
+            self.enqueued += 1
+            depth = self._queue.qsize()
+            if depth > self.max_depth:
+                self.max_depth = depth
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Block until everything submitted before this call is committed."""
+        if not self._thread or not self._thread.is_alive():
+            return True
+        barrier = _Barrier()
+        self._queue.put(barrier)
+        return barrier.event.wait(timeout)
+
+    def run_exclusive(self, fn: Callable[[], Any]) -> "Future[Any]":
+        """Run `fn` on the writer thread between batches, with no batch in flight.
+
+        For statements that need the database to themselves (VACUUM): queued writes wait
+        behind them instead of failing on a busy lock.
+        """
+        item = _Exclusive(fn)
+        if self._closed:
+            item.future.set_exception(RuntimeError("write-behind queue is stopped"))
+            return item.future
+        if not self._thread or not self._thread.is_alive():
+            self.start()
+        self._queue.put(item)
+        return item.future
+
+    @staticmethod
+    def _execute_exclusive(item: _Exclusive) -> None:
+        try:
+            item.future.set_result(item.fn())
+        except Exception as e:
+            item.future.set_exception(e)
+
+    def stop(self, timeout: float | None = 10.0) -> None:
+        self._closed = True
+        if not self._thread or not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            batch: List[WriteOp] = []
+            barriers: List[_Barrier] = []
+            exclusive: _Exclusive | None = None
+            deadline = time.monotonic() + self.max_delay
+            while True:
+                if item is _STOP:
+                    stopping = True
+                elif isinstance(item, _Barrier):
+                    barriers.append(item)
+                elif isinstance(item, _Exclusive):
+                    exclusive = item
+                else:
+                    batch.append(item)
+                if stopping or exclusive or len(batch) >= self.max_batch:
+                    break
+                # барьер означает, что кто-то ждёт flush — не тянем до дедлайна
+                remaining = 0 if barriers else deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._apply_batch(batch)
+            # всё, что пришло раньше, уже закоммичено; более поздние записи ждут в очереди
+            if exclusive:
+                self._execute_exclusive(exclusive)
+            for b in barriers:
+                b.event.set()
+
+    def _apply_batch(self, batch: List[WriteOp]) -> None:
+        started = time.perf_counter()
+        try:
+            with self._session_factory() as db:
+                for op in batch:
+                    op(db)
+                    # autoflush выключен: следующая операция батча должна видеть предыдущие
+                    db.flush()
+            ok, failed = len(batch), 0
+        except Exception:
+            # одна плохая операция не должна утащить за собой весь батч
+            ok, failed = 0, 0
+            for op in batch:
+                try:
+                    with self._session_factory() as db:
+                        op(db)
+                    ok += 1
+                except Exception as e:
+                    failed += 1
+                    logger.warning("write-behind op failed: %s", e)
+        with self._lock:
+            self.batches += 1
+            self.committed += ok
+            self.failed += failed
+            self.last_batch_size = len(batch)
+            self.last_commit_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "depth": self._queue.qsize(),
+                "max_depth": self.max_depth,
+                "enqueued": self.enqueued,
+                "rejected": self.rejected,
+                "overflow_waits": self.overflow_waits,
+                "direct_writes": self.direct_writes,
+                "committed": self.committed,
+                "failed": self.failed,
+                "batches": self.batches,
+                "last_batch_size": self.last_batch_size,
+                "last_commit_ms": self.last_commit_ms,
+                "max_batch": self.max_batch,
+                "max_delay_sec": self.max_delay,
+                "running": bool(self._thread and self._thread.is_alive()),
+            }